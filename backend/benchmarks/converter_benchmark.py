@@ -0,0 +1,235 @@
+"""
+Benchmark of `vod_converter` on synthetic datasets.
+
+For every ingestor and egestor pair a synthetic dataset is generated and converted twice, each time in a fresh
+process so peak RSS of one case does not leak into another:
+
+    - end to end, through `converter.convert`, which streams image detections between the stages,
+    - stage by stage, materializing output of every stage, to time layout validation, ingestion, schema validation,
+      label conversion and egestion separately.
+
+Results are written as json, so reports of two releases can be diffed. Usage (from backend directory):
+
+    python -m benchmarks.converter_benchmark --images 1000 --output converter-benchmark.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime
+
+from workers.lib.messenger import messenger
+from workers.lib.vod_converter import converter
+from workers.lib.vod_converter.abstract import DataConversionException
+
+from .synthetic_datasets import generate, GENERATORS, DEFAULT_DETECTIONS_PER_IMAGE
+
+REPORT_VERSION = 1
+DEFAULT_NUM_IMAGES = 200
+DEFAULT_EGESTORS = ["coco"]
+STAGES = ["validate_layout", "ingest", "validate", "convert_labels", "egest"]
+
+
+class _SilentTask:
+    """Swallows progress messages of ingestors and egestors, they would dominate the timings otherwise"""
+
+    def info(self, msg):
+        pass
+
+
+def run_benchmark(*, ingestors, egestors, num_images, detections_per_image, work_dir, select_only_known_labels=False,
+                  filter_images_without_labels=True, log=print):
+    """
+    Benchmarks conversion of every ingestor to every egestor
+
+    :param ingestors: list of ingestor keys, see `synthetic_datasets.GENERATORS`
+    :param egestors: list of egestor keys, see `converter.EGESTORS`
+    :param num_images: number of images in every synthetic dataset
+    :param detections_per_image: number of boxes on every image
+    :param work_dir: directory datasets and converted output are written to
+    :return: report dict
+    """
+    report = {
+        "version": REPORT_VERSION,
+        "created": datetime.now().isoformat(),
+        "environment": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "parameters": {
+            "num_images": num_images,
+            "detections_per_image": detections_per_image,
+            "select_only_known_labels": select_only_known_labels,
+            "filter_images_without_labels": filter_images_without_labels
+        },
+        "results": []
+    }
+
+    context = multiprocessing.get_context("fork")
+    for ingestor_key in ingestors:
+        dataset_dir = os.path.join(work_dir, "datasets", ingestor_key)
+        started = time.perf_counter()
+        from_path = generate(ingestor_key, dataset_dir, num_images, detections_per_image=detections_per_image)
+        log(f"Generated {ingestor_key} dataset in {time.perf_counter() - started:.2f}s")
+
+        for egestor_key in egestors:
+            case = {
+                "ingestor": ingestor_key,
+                "egestor": egestor_key,
+                "from_path": from_path,
+                "select_only_known_labels": select_only_known_labels,
+                "filter_images_without_labels": filter_images_without_labels
+            }
+            result = {"ingestor": ingestor_key, "egestor": egestor_key}
+            for mode, function in [("end_to_end", _run_end_to_end), ("stages", _run_stages)]:
+                to_path = os.path.join(work_dir, "output", f"{ingestor_key}-{egestor_key}-{mode}")
+                with context.Pool(processes=1, maxtasksperchild=1) as pool:
+                    result[mode] = pool.apply(_run_case, (function, dict(case, to_path=to_path)))
+                shutil.rmtree(to_path, ignore_errors=True)
+            if result["end_to_end"]["status"] == "ok" and result["stages"]["status"] == "ok":
+                result["end_to_end"]["images_per_second"] = _rate(result["stages"]["ingested_images"],
+                                                                  result["end_to_end"]["seconds"])
+            report["results"].append(result)
+            log(_summary(result))
+
+    return report
+
+
+def _run_case(function, case):
+    messenger.connect_task(_SilentTask())
+    baseline_rss = _peak_rss_kb()
+    try:
+        result = function(case)
+        result["status"] = "ok"
+    except Exception as e:
+        result = {"status": "error", "error": f"{type(e).__name__}: {e}", "traceback": traceback.format_exc()}
+    result["baseline_rss_kb"] = baseline_rss
+    result["peak_rss_kb"] = _peak_rss_kb()
+    return result
+
+
+def _run_end_to_end(case):
+    started = time.perf_counter()
+    success, message = converter.convert(from_path=case["from_path"], ingestor_key=case["ingestor"],
+                                         to_path=case["to_path"], egestor_key=case["egestor"],
+                                         select_only_known_labels=case["select_only_known_labels"],
+                                         filter_images_without_labels=case["filter_images_without_labels"],
+                                         folder_names=None)
+    seconds = time.perf_counter() - started
+    if not success:
+        raise DataConversionException(message or f"{case['ingestor']} ingestor rejected {case['from_path']}")
+    return {"seconds": seconds}
+
+
+def _run_stages(case):
+    ingestor = converter.INGESTORS[case["ingestor"]]
+    egestor = converter.EGESTORS[case["egestor"]]
+    timings = {}
+
+    with _timed(timings, "validate_layout"):
+        valid, message = ingestor.validate(case["from_path"], None)
+    if not valid:
+        raise DataConversionException(message or f"{case['ingestor']} ingestor rejected {case['from_path']}")
+
+    with _timed(timings, "ingest"):
+        image_detections = list(ingestor.iter_ingest(case["from_path"], None))
+    ingested_images = len(image_detections)
+    ingested_detections = _count_detections(image_detections)
+
+    with _timed(timings, "validate"):
+        image_detections = list(converter.validate_image_detections(image_detections))
+
+    with _timed(timings, "convert_labels"):
+        image_detections = list(converter.convert_labels(
+            image_detections=image_detections, expected_labels=egestor.expected_labels(),
+            select_only_known_labels=case["select_only_known_labels"],
+            filter_images_without_labels=case["filter_images_without_labels"]))
+
+    with _timed(timings, "egest"):
+        egestor.egest(image_detections=image_detections, root=case["to_path"], folder_names=None)
+
+    return {
+        "seconds": sum(timings.values()),
+        "stages": {
+            stage: {"seconds": seconds, "images_per_second": _rate(ingested_images, seconds)}
+            for stage, seconds in timings.items()
+        },
+        "ingested_images": ingested_images,
+        "ingested_detections": ingested_detections,
+        "egested_images": len(image_detections),
+        "egested_detections": _count_detections(image_detections)
+    }
+
+
+@contextmanager
+def _timed(timings, stage):
+    started = time.perf_counter()
+    yield
+    timings[stage] = time.perf_counter() - started
+
+
+def _count_detections(image_detections):
+    return sum(len(image_detection["detections"]) for image_detection in image_detections)
+
+
+def _rate(count, seconds):
+    return count / seconds if seconds > 0 else None
+
+
+def _peak_rss_kb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _summary(result):
+    stages = result["stages"]
+    end_to_end = result["end_to_end"]
+    if stages["status"] != "ok" or end_to_end["status"] != "ok":
+        return f"{result['ingestor']} -> {result['egestor']}: " \
+               f"{stages.get('error') or end_to_end.get('error')}"
+
+    images = stages["ingested_images"]
+    per_stage = ", ".join(f"{stage} {timing['seconds']:.2f}s" for stage, timing in stages["stages"].items())
+    return f"{result['ingestor']} -> {result['egestor']}: {images} images, {end_to_end['seconds']:.2f}s end to end " \
+           f"({end_to_end['images_per_second']:.0f} images/s, peak RSS {end_to_end['peak_rss_kb'] // 1024} MB); " \
+           f"{per_stage}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks vod_converter on synthetic datasets")
+    parser.add_argument("--images", type=int, default=DEFAULT_NUM_IMAGES, help="images per dataset")
+    parser.add_argument("--detections", type=int, default=DEFAULT_DETECTIONS_PER_IMAGE, help="boxes per image")
+    parser.add_argument("--ingestors", nargs="+", default=list(GENERATORS), choices=list(GENERATORS))
+    parser.add_argument("--egestors", nargs="+", default=DEFAULT_EGESTORS, choices=list(converter.EGESTORS))
+    parser.add_argument("--work-dir", help="directory for generated datasets, temporary directory by default")
+    parser.add_argument("--output", help="path of json report, printed to stdout by default")
+    args = parser.parse_args(argv)
+
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix="converter-benchmark-")
+    try:
+        report = run_benchmark(ingestors=args.ingestors, egestors=args.egestors, num_images=args.images,
+                               detections_per_image=args.detections, work_dir=work_dir,
+                               log=lambda msg: print(msg, file=sys.stderr))
+    finally:
+        if args.work_dir is None:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,370 @@
+"""
+Generators of synthetic datasets in every input layout supported by `vod_converter`.
+
+Every generator writes `num_images` images with `detections_per_image` random boxes each into `root` and returns
+the path which should be passed to the matching ingestor. Images are encoded once per size and written as raw
+bytes, so generating large datasets is bound by disk speed only. Labels are drawn from names the format actually
+uses, so label conversion does the same work as for real data.
+"""
+import csv
+import io
+import json
+import os
+import random
+import xml.etree.ElementTree as ElementTree
+
+from PIL import Image
+
+DEFAULT_WIDTH = 640
+DEFAULT_HEIGHT = 480
+DEFAULT_DETECTIONS_PER_IMAGE = 5
+
+VOC_LABELS = ["person", "car", "bicycle", "dog", "bus", "motorbike", "train", "boat"]
+KITTI_LABELS = ["Car", "Van", "Truck", "Pedestrian", "Person_sitting", "Cyclist", "Tram", "Misc"]
+COCO_LABELS = ["person", "car", "bicycle", "bus", "truck", "motorcycle"]
+DETRAC_LABELS = ["car", "bus", "van", "others"]
+CALTECH_LABELS = ["person", "people", "person?", "person-fa"]
+AICITY_LABELS = ["car", "bus", "truck", "person"]
+PEDX_LABELS = ["pedestrian", "cyclist"]
+CITYCAM_LABELS = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "10"]
+MIO_LABELS = ["pedestrian", "bicycle", "articulated_truck", "bus", "car", "motorcycle", "pickup_truck",
+              "single_unit_truck", "work_van", "motorized_vehicle", "non-motorized_vehicle"]
+
+PEDX_KEYPOINTS = ["nose", "leye", "reye", "lear", "rear", "lsho", "rsho", "lelb", "relb", "lwri", "rwri", "lhip",
+                  "rhip", "lknee", "rknee", "lankl", "rankl"]
+
+# Frames per video / sequence / camera in formats which group images
+FRAMES_PER_SEQUENCE = 1000
+
+
+def generate(format_key, root, num_images, *, detections_per_image=DEFAULT_DETECTIONS_PER_IMAGE,
+             width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, seed=0):
+    """
+    Writes synthetic dataset in given format
+
+    :param format_key: key of ingestor in `converter.INGESTORS`
+    :param root: directory the dataset is written to, created if missing
+    :param num_images: number of images in dataset
+    :param detections_per_image: number of boxes on every image
+    :param width: width of every image
+    :param height: height of every image
+    :param seed: seed of random boxes and labels
+    :return: path to pass to the ingestor as `from_path`
+    """
+    if format_key not in GENERATORS:
+        raise ValueError(f"No generator for format {format_key}, expected one of {sorted(GENERATORS)}")
+    os.makedirs(root, exist_ok=True)
+    dataset = _SyntheticDataset(root, num_images, detections_per_image, width, height, seed)
+    return GENERATORS[format_key](dataset)
+
+
+class _SyntheticDataset:
+    def __init__(self, root, num_images, detections_per_image, width, height, seed):
+        self.root = root
+        self.num_images = num_images
+        self.detections_per_image = detections_per_image
+        self.width = width
+        self.height = height
+        self.random = random.Random(seed)
+        self._encoded_images = {}
+
+    def path(self, *parts):
+        return os.path.join(self.root, *parts)
+
+    def makedirs(self, *parts):
+        path = self.path(*parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def write_image(self, path, image_format="JPEG"):
+        encoded = self._encoded_images.get(image_format)
+        if encoded is None:
+            buffer = io.BytesIO()
+            Image.new("RGB", (self.width, self.height), (127, 127, 127)).save(buffer, format=image_format)
+            encoded = self._encoded_images[image_format] = buffer.getvalue()
+        with open(path, "wb") as f:
+            f.write(encoded)
+
+    def boxes(self, labels):
+        """
+        :return: list of (label, left, top, right, bottom) with integer coordinates inside the image
+        """
+        boxes = []
+        for _ in range(self.detections_per_image):
+            box_width = self.random.randint(8, max(self.width // 4, 9))
+            box_height = self.random.randint(8, max(self.height // 4, 9))
+            left = self.random.randint(0, self.width - box_width - 1)
+            top = self.random.randint(0, self.height - box_height - 1)
+            boxes.append((self.random.choice(labels), left, top, left + box_width, top + box_height))
+        return boxes
+
+
+def _generate_voc(dataset):
+    images_dir = dataset.makedirs("JPEGImages")
+    annotations_dir = dataset.makedirs("Annotations")
+    dataset.makedirs("SegmentationClass")
+    dataset.makedirs("SegmentationObject")
+
+    for i in range(dataset.num_images):
+        image_id = f"{i:06d}"
+        dataset.write_image(os.path.join(images_dir, f"{image_id}.jpg"))
+
+        annotation = ElementTree.Element("annotation")
+        ElementTree.SubElement(annotation, "filename").text = f"{image_id}.jpg"
+        size = ElementTree.SubElement(annotation, "size")
+        ElementTree.SubElement(size, "width").text = str(dataset.width)
+        ElementTree.SubElement(size, "height").text = str(dataset.height)
+        ElementTree.SubElement(size, "depth").text = "3"
+        ElementTree.SubElement(annotation, "segmented").text = "0"
+        for label, left, top, right, bottom in dataset.boxes(VOC_LABELS):
+            node = ElementTree.SubElement(annotation, "object")
+            ElementTree.SubElement(node, "name").text = label
+            _add_bndbox(node, left, top, right, bottom)
+        ElementTree.ElementTree(annotation).write(os.path.join(annotations_dir, f"{image_id}.xml"))
+    return dataset.root
+
+
+def _generate_citycam(dataset):
+    images_dir = dataset.makedirs("JPEGImages")
+    annotations_dir = dataset.makedirs("Annotations")
+    sets_dir = dataset.makedirs("ImageSets", "Main")
+
+    image_ids = []
+    for i in range(dataset.num_images):
+        image_id = f"{i:06d}"
+        image_ids.append(image_id)
+        dataset.write_image(os.path.join(images_dir, f"{image_id}.jpg"))
+
+        annotation = ElementTree.Element("annotation")
+        ElementTree.SubElement(annotation, "width").text = str(dataset.width)
+        ElementTree.SubElement(annotation, "height").text = str(dataset.height)
+        for j, (label, left, top, right, bottom) in enumerate(dataset.boxes(CITYCAM_LABELS)):
+            # every fifth box is a passenger, which CityCam stores separately
+            if j % 5 == 4:
+                node = ElementTree.SubElement(annotation, "passengers")
+            else:
+                node = ElementTree.SubElement(annotation, "vehicle")
+                ElementTree.SubElement(node, "type").text = label
+            _add_bndbox(node, left, top, right, bottom)
+        ElementTree.ElementTree(annotation).write(os.path.join(annotations_dir, f"{image_id}.xml"))
+
+    with open(os.path.join(sets_dir, "trainval.txt"), "w") as f:
+        f.write("\n".join(image_ids))
+    return dataset.root
+
+
+def _generate_kitti(dataset):
+    images_dir = dataset.makedirs("images")
+    labels_dir = dataset.makedirs("labels")
+
+    image_ids = []
+    for i in range(dataset.num_images):
+        image_id = f"{i:06d}"
+        image_ids.append(image_id)
+        dataset.write_image(os.path.join(images_dir, f"{image_id}.png"), "PNG")
+        with open(os.path.join(labels_dir, f"{image_id}.txt"), "w") as f:
+            for label, left, top, right, bottom in dataset.boxes(KITTI_LABELS):
+                f.write(f"{label} 0.00 0 -1.57 {left:.2f} {top:.2f} {right:.2f} {bottom:.2f} "
+                        f"1.50 1.60 3.70 0.00 1.50 10.00 0.00\n")
+
+    with open(dataset.path("train.txt"), "w") as f:
+        f.write("\n".join(image_ids))
+    return dataset.root
+
+
+def _generate_kitti_tracking(dataset):
+    dataset.makedirs("image_02")
+    labels_dir = dataset.makedirs("label_02")
+
+    for sequence, frames in _sequences(dataset.num_images):
+        sequence_name = f"{sequence:04d}"
+        images_dir = dataset.makedirs("image_02", sequence_name)
+        with open(os.path.join(labels_dir, f"{sequence_name}.txt"), "w") as f:
+            for frame in frames:
+                dataset.write_image(os.path.join(images_dir, f"{frame:06d}.png"), "PNG")
+                for track_id, (label, left, top, right, bottom) in enumerate(dataset.boxes(KITTI_LABELS)):
+                    f.write(f"{frame} {track_id} {label} 0 0 -1.57 {left:.2f} {top:.2f} {right:.2f} {bottom:.2f} "
+                            f"1.50 1.60 3.70 0.00 1.50 10.00 0.00\n")
+    return dataset.root
+
+
+def _generate_coco(dataset):
+    images_dir = dataset.makedirs("images")
+    categories = [{"id": i, "name": label, "supercategory": ""} for i, label in enumerate(COCO_LABELS)]
+    category_ids = {category["name"]: category["id"] for category in categories}
+
+    images, annotations = [], []
+    for i in range(dataset.num_images):
+        file_name = f"{i:06d}.jpg"
+        image_path = os.path.join(images_dir, file_name)
+        dataset.write_image(image_path)
+        images.append({"id": i, "path": image_path, "width": dataset.width, "height": dataset.height,
+                       "file_name": file_name})
+        for j, (label, left, top, right, bottom) in enumerate(dataset.boxes(COCO_LABELS)):
+            # half of the annotations are polygons, the other half plain boxes
+            if j % 2:
+                segmentation = [[left, top, right, (top + bottom) // 2, left, bottom]]
+                isbbox = False
+            else:
+                segmentation = []
+                isbbox = True
+            annotations.append({"id": len(annotations), "image_id": i, "category_id": category_ids[label],
+                                "segmentation": segmentation, "bbox": [left, top, right - left, bottom - top],
+                                "iscrowd": False, "isbbox": isbbox, "keypoints": []})
+
+    with open(dataset.path("labels.json"), "w") as f:
+        json.dump({"images": images, "categories": categories, "annotations": annotations}, f)
+    return dataset.root
+
+
+def _generate_detrac(dataset):
+    annotations_dir = dataset.makedirs("DETRAC-Train-Annotations-XML")
+    dataset.makedirs("DETRAC-Test-Annotations-XML")
+    dataset.makedirs("DETRAC-Train-Data")
+    dataset.makedirs("DETRAC-test-data")
+
+    for sequence, frames in _sequences(dataset.num_images):
+        sequence_name = f"MVI_{sequence:05d}"
+        images_dir = dataset.makedirs("DETRAC-Train-Data", sequence_name)
+        root = ElementTree.Element("sequence", name=sequence_name)
+        for frame in frames:
+            number = frame + 1
+            dataset.write_image(os.path.join(images_dir, f"img{number:05d}.jpg"))
+            frame_node = ElementTree.SubElement(root, "frame", num=str(number))
+            targets = ElementTree.SubElement(frame_node, "target_list")
+            for target_id, (label, left, top, right, bottom) in enumerate(dataset.boxes(DETRAC_LABELS)):
+                target = ElementTree.SubElement(targets, "target", id=str(target_id + 1))
+                ElementTree.SubElement(target, "box", left=str(left), top=str(top), width=str(right - left),
+                                       height=str(bottom - top))
+                ElementTree.SubElement(target, "attribute", orientation="0", speed="0", trajectory_length="1",
+                                       truncation_ratio="0", vehicle_type=label)
+        ElementTree.ElementTree(root).write(os.path.join(annotations_dir, f"{sequence_name}.xml"))
+    return dataset.root
+
+
+def _generate_caltech(dataset):
+    images_dir = dataset.makedirs("images")
+
+    videos = {}
+    for video, frames in _sequences(dataset.num_images):
+        video_key = f"V{video:03d}"
+        video_frames = {}
+        for frame in frames:
+            dataset.write_image(os.path.join(images_dir, f"set00_{video_key}_{frame}.png"), "PNG")
+            video_frames[str(frame)] = [
+                {"id": i + 1, "lbl": label, "pos": [left, top, right - left, bottom - top], "posv": [0, 0, 0, 0],
+                 "occl": 0, "lock": 0, "str": frame, "end": frame, "hide": 0, "init": 1}
+                for i, (label, left, top, right, bottom) in enumerate(dataset.boxes(CALTECH_LABELS))
+            ]
+        videos[video_key] = {"altered": 0, "frames": video_frames, "log": [],
+                             "maxObj": dataset.detections_per_image, "nFrames": len(frames)}
+
+    with open(dataset.path("annotations.json"), "w") as f:
+        json.dump({"set00": videos}, f)
+    return dataset.root
+
+
+def _generate_aicity(dataset):
+    annotations_dir = dataset.makedirs("train", "annotations")
+    images_dir = dataset.makedirs("train", "images")
+
+    for camera, frames in _sequences(dataset.num_images):
+        # MOT_AICITYIngestor takes first nine characters of annotation file name as the image name prefix
+        prefix = f"c{camera:03d}_img_"
+        with open(os.path.join(annotations_dir, f"{prefix}gt.txt"), "w", newline="") as f:
+            writer = csv.writer(f)
+            for frame in frames:
+                number = frame % FRAMES_PER_SEQUENCE + 1
+                dataset.write_image(os.path.join(images_dir, f"{prefix}{number:04d}.jpg"))
+                for track_id, (label, left, top, right, bottom) in enumerate(dataset.boxes(AICITY_LABELS)):
+                    writer.writerow([number, track_id, left, top, right - left, bottom - top, label, -1, -1, -1])
+    return dataset.root
+
+
+def _generate_pedx(dataset):
+    for directory in ["calib", "preview", "timestamps"]:
+        dataset.makedirs(directory)
+    date = "20171130T2000"
+
+    for camera, frames in _sequences(dataset.num_images):
+        camera_name = f"c{camera:03d}"
+        images_dir = dataset.makedirs("images", date, camera_name)
+        labels_dir = dataset.makedirs("labels", "2d", date)
+        for frame in frames:
+            # PEDXIngestor matches labels to images by the first 29 characters of the label file name
+            image_name = f"{date}_{camera_name}_{frame:010d}"
+            dataset.write_image(os.path.join(images_dir, f"{image_name}.jpg"))
+            for i, (label, left, top, right, bottom) in enumerate(dataset.boxes(PEDX_LABELS)):
+                keypoints = {name: {"x": dataset.random.randint(left, right), "y": dataset.random.randint(top, bottom),
+                                    "visible": dataset.random.random() > 0.2}
+                             for name in PEDX_KEYPOINTS}
+                label_data = {"category": label,
+                              "polygon": [[left, top], [right, top], [right, bottom], [left, bottom]],
+                              "keypoint": keypoints}
+                with open(os.path.join(labels_dir, f"{image_name}_{i:04d}.json"), "w") as f:
+                    json.dump(label_data, f)
+    return dataset.root
+
+
+def _generate_mio(dataset):
+    images_dir = dataset.makedirs("train")
+
+    with open(dataset.path("gt_train.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "label", "x1", "y1", "x2", "y2"])
+        for i in range(dataset.num_images):
+            image_id = f"{i:08d}"
+            dataset.write_image(os.path.join(images_dir, f"{image_id}.jpg"))
+            for label, left, top, right, bottom in dataset.boxes(MIO_LABELS):
+                writer.writerow([image_id, label, left, top, right, bottom])
+    return dataset.root
+
+
+def _generate_town_centre(dataset):
+    images_dir = dataset.makedirs("images")
+
+    with open(dataset.path("TownCentre-groundtruth.csv"), "w", newline="") as f:
+        writer = csv.writer(f)
+        for frame in range(dataset.num_images):
+            dataset.write_image(os.path.join(images_dir, f"town_centre_{frame:04d}.png"), "PNG")
+            for person, (_, left, top, right, bottom) in enumerate(dataset.boxes(["person"])):
+                head_bottom = top + (bottom - top) // 5
+                # personNumber, frameNumber, headValid, bodyValid, head box, body box
+                writer.writerow([person, frame, 1, 1, left, top, right, head_bottom,
+                                 float(left), float(top), float(right), float(bottom)])
+    return dataset.root
+
+
+def _add_bndbox(node, left, top, right, bottom):
+    bndbox = ElementTree.SubElement(node, "bndbox")
+    ElementTree.SubElement(bndbox, "xmin").text = str(left)
+    ElementTree.SubElement(bndbox, "ymin").text = str(top)
+    ElementTree.SubElement(bndbox, "xmax").text = str(right)
+    ElementTree.SubElement(bndbox, "ymax").text = str(bottom)
+
+
+def _sequences(num_images):
+    """
+    Splits images into sequences of at most `FRAMES_PER_SEQUENCE` frames
+
+    :return: iterator of (sequence number, range of global frame numbers)
+    """
+    for sequence, start in enumerate(range(0, num_images, FRAMES_PER_SEQUENCE)):
+        yield sequence, range(start, min(start + FRAMES_PER_SEQUENCE, num_images))
+
+
+GENERATORS = {
+    "voc": _generate_voc,
+    "kitti": _generate_kitti,
+    "kitti-tracking": _generate_kitti_tracking,
+    "coco": _generate_coco,
+    "detrac": _generate_detrac,
+    "caltech": _generate_caltech,
+    "aicity": _generate_aicity,
+    "pedx": _generate_pedx,
+    "citycam": _generate_citycam,
+    "mio": _generate_mio,
+    "town-centre": _generate_town_centre
+}
+
+__all__ = ["generate", "GENERATORS"]
@@ -13,6 +13,8 @@ class Config:
 
     ### File Watcher
     FILE_WATCHER = os.getenv("FILE_WATCHER", False)
+    # Seconds without new events after which collected events are sent to workers
+    FILE_WATCHER_DELAY = float(os.getenv("FILE_WATCHER_DELAY", 1))
     IGNORE_DIRECTORIES = ["_thumbnail", "_settings"]
 
     # Flask/Gunicorn
@@ -39,6 +41,9 @@ class Config:
     SECRET_KEY = os.getenv("SECRET_KEY", "<--- CHANGE THIS KEY --->")
 
     LOG_LEVEL = 'debug'
+    # Lets gunicorn send files with sendfile(), off by default as gunicorn 19 does not retry it on the
+    # non-blocking sockets of eventlet workers
+    SENDFILE = os.getenv("SENDFILE", 'false').lower() == 'true'
     WORKER_CONNECTIONS = os.getenv("CELERY_RESULT_BACKEND", 1000)
 
     TESTING = os.getenv("TESTING", False)
@@ -49,6 +54,9 @@ class Config:
 
     ### Dataset Options
     DATASET_DIRECTORY = os.getenv("DATASET_DIRECTORY", r"/datasets/")
+    # Resized images served by webserver, shared by its processes
+    RENDITION_CACHE_DIRECTORY = os.getenv("RENDITION_CACHE_DIRECTORY", r"/datasets/.renditions/")
+    RENDITION_CACHE_SIZE = int(os.getenv("RENDITION_CACHE_SIZE", 1 * 1024 * 1024 * 1024))  # 1GB
     INITIALIZE_FROM_FILE = os.getenv("INITIALIZE_FROM_FILE")
 
     ### User Options
@@ -1,4 +1,6 @@
 from mongoengine import connect
+from mongoengine.connection import get_db
+from pymongo import ReturnDocument
 from config import Config
 
 from .annotations import *
@@ -7,6 +9,7 @@ from .datasets import *
 from .lisence import *
 from .exports import *
 from .images import *
+from .paper_objects import *
 from .events import *
 from .users import *
 from .tasks import *
@@ -41,6 +44,28 @@ def upsert(model, query=None, update=None):
     return new_model
 
 
+def reserve_ids(model, count):
+    """
+    Reserves a block of consecutive values of a model's SequenceField primary key in a single query,
+    so documents can be inserted in bulk without generating every id separately.
+
+    :param model: Document class with SequenceField `id`
+    :param count: Number of ids to reserve
+    :return: range of reserved ids
+    """
+    field = model._fields['id']
+    sequence_id = f"{field.get_sequence_name()}.{field.name}"
+    collection = get_db(alias=field.db_alias)[field.collection_name]
+
+    counter = collection.find_one_and_update(
+        {"_id": sequence_id},
+        {"$inc": {"next": count}},
+        return_document=ReturnDocument.AFTER,
+        upsert=True
+    )
+    return range(counter["next"] - count + 1, counter["next"] + 1)
+
+
 def fix_ids(q):
     json_obj = json.loads(q.to_json().replace('\"_id\"', '\"id\"'))
     return json_obj
@@ -6,6 +6,7 @@ from mongoengine import *
 from .datasets import DatasetModel
 from .categories import CategoryModel
 from .events import Event
+from .paper_objects import PaperObjectModel
 from flask_login import current_user
 
 
@@ -36,7 +37,7 @@ class AnnotationModel(DynamicDocument):
     keypoints = ListField(default=[])
 
     metadata = DictField(default={})
-    paper_object = ListField(default=[])
+    # paper.js object drawn in the annotator is stored in PaperObjectModel
 
     deleted = BooleanField(default=False)
     deleted_date = DateTimeField()
@@ -44,6 +45,9 @@ class AnnotationModel(DynamicDocument):
     milliseconds = IntField(default=0)
     events = EmbeddedDocumentListField(Event)
 
+    # Incremented on every change made by the annotator, annotations saved before it existed have none (version 0)
+    version = IntField(default=0)
+
     def __init__(self, image_id=None, **data):
 
         from .images import ImageModel
@@ -77,6 +81,10 @@ class AnnotationModel(DynamicDocument):
 
         return super(AnnotationModel, self).save(*args, **kwargs)
 
+    def delete(self, *args, **kwargs):
+        PaperObjectModel.objects(id=self.id).delete()
+        return super(AnnotationModel, self).delete(*args, **kwargs)
+
     def is_empty(self):
         return len(self.segmentation) == 0 or self.area == 0
 
@@ -94,6 +102,8 @@ class AnnotationModel(DynamicDocument):
         """ Creates a clone """
         create = json.loads(self.to_json())
         del create['_id']
+        # stored inline before paper objects had their own collection
+        create.pop('paper_object', None)
 
         return AnnotationModel(**create)
 
@@ -1,12 +1,17 @@
+import datetime
 import os
+import re
+import shutil
 
 import imantics as im
 from PIL import Image
 from mongoengine import *
 
 from .annotations import AnnotationModel
+from .categories import CategoryModel
 from .datasets import DatasetModel
 from .events import Event, SessionEvent
+from .paper_objects import PaperObjectModel
 
 
 class ImageModel(DynamicDocument):
@@ -16,14 +21,31 @@ class ImageModel(DynamicDocument):
 
     # -- Contants
     THUMBNAIL_DIRECTORY = '.thumbnail'
+    TILES_DIRECTORY = '.tiles'
     PATTERN = (".gif", ".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff", ".GIF", ".PNG", ".JPG", ".JPEG", ".BMP", ".TIF", ".TIFF")
 
     # Set maximum thumbnail size (h x w) to use on dataset page
     MAX_THUMBNAIL_DIM = (1024, 1024)
+    # Number of thumbnails generated by a single worker task
+    THUMBNAIL_BATCH_SIZE = 50
+    THUMBNAIL_QUEUE_TIMEOUT = 60 * 60
+    # Pyramid generation queued longer ago is assumed lost
+    PYRAMID_QUEUE_TIMEOUT = 60 * 60
+    # Orders images of a dataset can be browsed in, mapped to the database field they sort on
+    NAVIGATION_ORDERS = {'file_name': 'file_name', 'id': '_id', 'path': 'path'}
 
     # -- Private
     _dataset = None
 
+    meta = {'indexes': [
+        'sha256',
+        ('dataset_id', 'sha256'),
+        # previous and next image in every navigation order, ties broken by id
+        ('dataset_id', 'deleted', 'file_name', 'id'),
+        ('dataset_id', 'deleted', 'path', 'id'),
+        ('dataset_id', 'deleted', 'id')
+    ]}
+
     # -- Database
     id = SequenceField(primary_key=True)
     dataset_id = IntField(required=True)
@@ -34,6 +56,11 @@ class ImageModel(DynamicDocument):
     width = IntField(required=True)
     height = IntField(required=True)
     file_name = StringField()
+
+    # Digest of file content, valid for file of given size and modification time
+    sha256 = StringField()
+    file_size = LongField()
+    file_mtime = FloatField()
     
     # True if the image is annotated
     annotated = BooleanField(default=False)
@@ -55,17 +82,19 @@ class ImageModel(DynamicDocument):
     milliseconds = IntField(default=0)
     events = EmbeddedDocumentListField(Event)
     regenerate_thumbnail = BooleanField(default=False)
+    # Time thumbnail generation was queued, unset once a worker picks it up
+    thumbnail_queued = DateTimeField()
 
     @classmethod
     def create_from_path(cls, path, dataset_id=None):
 
-        pil_image = Image.open(path)
+        from workers.lib.image_probe import image_dimensions
 
         image = cls()
         image.file_name = os.path.basename(path)
         image.path = path
-        image.width = pil_image.size[0]
-        image.height = pil_image.size[1]
+        image.width, image.height = image_dimensions(path)
+        image.update_digest()
 
         if dataset_id is not None:
             image.dataset_id = dataset_id
@@ -79,13 +108,83 @@ class ImageModel(DynamicDocument):
             if dataset is not None:
                 image.dataset_id = dataset.id
 
-        pil_image.close()
-
         return image
 
+    @classmethod
+    def duplicates(cls, dataset_id):
+        """
+        Groups images of dataset with the same content
+
+        :return: list of {"sha256", "count", "images": [{"id", "path", "file_name"}]}, largest groups first
+        """
+        return list(cls._get_collection().aggregate([
+            {"$match": {"dataset_id": dataset_id, "sha256": {"$ne": None}, "deleted": False}},
+            {"$group": {
+                "_id": "$sha256",
+                "count": {"$sum": 1},
+                "images": {"$push": {"id": "$_id", "path": "$path", "file_name": "$file_name"}}
+            }},
+            {"$match": {"count": {"$gt": 1}}},
+            {"$sort": {"count": -1}},
+            {"$project": {"_id": 0, "sha256": "$_id", "count": 1, "images": 1}}
+        ], allowDiskUse=True))
+
+    def neighbours(self, order='file_name', directory=None):
+        """
+        Finds images before and after this one in its dataset, each with a single index seek
+
+        A directory is a prefix range on the path index, so it is only seeked in path order. In file name and id
+        order it is a filter applied to the entries of their index, which are walked from this image until one
+        inside the directory is found. Browsing a small folder of a large dataset in these orders therefore costs
+        up to a scan of the images between its neighbours.
+
+        :param order: one of `NAVIGATION_ORDERS`, prefixed with '-' for descending order
+        :param directory: only consider images in this directory or its subdirectories
+        :return: (id of previous image, id of next image), None if there is none
+        """
+        descending = order.startswith('-')
+        field = self.NAVIGATION_ORDERS.get(order.lstrip('-'), 'file_name')
+        value = self.id if field == '_id' else getattr(self, field)
+
+        query = {'dataset_id': self.dataset_id, 'deleted': False}
+        if directory:
+            # prefix expressions are evaluated as index range
+            query['path'] = {'$regex': '^' + re.escape(directory)}
+
+        collection = self._get_collection()
+
+        def find(direction):
+            operator = '$gt' if direction == 1 else '$lt'
+            if field == '_id':
+                after = {'_id': {operator: value}}
+            else:
+                after = {'$or': [{field: {operator: value}}, {field: value, '_id': {operator: self.id}}]}
+            sort = [(field, direction)] if field == '_id' else [(field, direction), ('_id', direction)]
+            image = collection.find_one({**query, **after}, {'_id': 1}, sort=sort)
+            return image['_id'] if image else None
+
+        previous, following = find(-1), find(1)
+        if descending:
+            previous, following = following, previous
+        return previous, following
+
+    def update_digest(self):
+        """
+        Computes digest of image file, without saving it
+        """
+        from workers.lib.file_digest import file_digest
+
+        stat = os.stat(self.path)
+        self.file_size = stat.st_size
+        self.file_mtime = stat.st_mtime
+        self.sha256 = file_digest(self.path)
+
     def delete(self, *args, **kwargs):
         self.thumbnail_delete()
-        AnnotationModel.objects(image_id=self.id).delete()
+        self.pyramid_delete()
+        annotations = AnnotationModel.objects(image_id=self.id)
+        PaperObjectModel.delete_many(annotations.scalar('id'))
+        annotations.delete()
         return super(ImageModel, self).delete(*args, **kwargs)
 
     def get_dataset_id(self):
@@ -93,30 +192,74 @@ class ImageModel(DynamicDocument):
 
     def thumbnail(self):
         """
-        Generates (if required) and returns thumbnail
+        Returns thumbnail already generated by workers, queueing its generation if there is none
+
+        :return: PIL image or None if thumbnail is not generated yet
+        """
+        thumbnail_path = self.thumbnail_file()
+        return Image.open(thumbnail_path) if thumbnail_path else None
+
+    def thumbnail_file(self):
+        """
+        Returns path to thumbnail already generated by workers, queueing its generation if there is none or it is
+        outdated
+
+        :return: path or None if thumbnail is not generated yet
         """
-        
         thumbnail_path = self.thumbnail_path()
+        exists = os.path.isfile(thumbnail_path)
+
+        if not exists or (self.regenerate_thumbnail and self.thumbnail_queued is None):
+            self.queue_thumbnails([self.id])
 
-        if self.regenerate_thumbnail or \
-            not os.path.isfile(thumbnail_path):
-            
-            # logger.debug(f'Generating thumbnail for {self.id}')
+        return thumbnail_path if exists else None
 
-            pil_image = self.generate_thumbnail()
-            pil_image = pil_image.convert("RGB")
+    def render_thumbnail(self):
+        """
+        Generates thumbnail and stores it on disk, called by workers
+        """
+        thumbnail_path = self.thumbnail_path()
 
-            # Resize image to fit in MAX_THUMBNAIL_DIM envelope as necessary
-            pil_image.thumbnail((self.MAX_THUMBNAIL_DIM[1], self.MAX_THUMBNAIL_DIM[0]))
+        pil_image = self.generate_thumbnail()
 
-            # Save as a jpeg to improve loading time
-            # (note file extension will not match but allows for backwards compatibility)
-            pil_image.save(thumbnail_path, "JPEG", quality=80, optimize=True, progressive=True)
+        # Save as a jpeg to improve loading time
+        # (note file extension will not match but allows for backwards compatibility)
+        # Written next to the thumbnail first, so requests never read a partially written file
+        temporary_path = f"{thumbnail_path}.{os.getpid()}"
+        pil_image.save(temporary_path, "JPEG", quality=80, optimize=True, progressive=True)
+        os.replace(temporary_path, thumbnail_path)
 
-            self.update(is_modified=False)
-            return pil_image
-        else:
-            return Image.open(thumbnail_path)
+        return pil_image
+
+    @classmethod
+    def queue_thumbnails(cls, image_ids):
+        """
+        Marks thumbnails of images as outdated and queues their generation. Images which are already queued and
+        not picked up by a worker yet are not queued again.
+
+        :return: number of queued images
+        """
+        from workers.tasks import generate_thumbnails
+
+        image_ids = list(image_ids)
+        if not image_ids:
+            return 0
+
+        # generations not picked up in time are assumed lost and queued again
+        now = datetime.datetime.utcnow()
+        # stored with millisecond precision
+        now = now.replace(microsecond=now.microsecond // 1000 * 1000)
+        expired = now - datetime.timedelta(seconds=cls.THUMBNAIL_QUEUE_TIMEOUT)
+
+        cls.objects(id__in=image_ids).update(set__regenerate_thumbnail=True)
+        cls.objects(Q(thumbnail_queued=None) | Q(thumbnail_queued__lt=expired), id__in=image_ids) \
+            .update(set__thumbnail_queued=now)
+        queued = list(cls.objects(id__in=image_ids, thumbnail_queued=now).scalar('id'))
+
+        for i in range(0, len(queued), cls.THUMBNAIL_BATCH_SIZE):
+            generate_thumbnails.delay(queued[i:i + cls.THUMBNAIL_BATCH_SIZE])
+
+        return len(queued)
     
     def thumbnail_path(self):
         folders = self.path.split('/')
@@ -136,15 +279,85 @@ class ImageModel(DynamicDocument):
             os.remove(path)
 
     def generate_thumbnail(self):
-        image = self().draw(color_by_category=True, bbox=False)
-        return Image.fromarray(image)
+        """
+        Draws annotations colored by category on image decoded at reduced scale
+
+        :return: RGB PIL image fitting in MAX_THUMBNAIL_DIM envelope
+        """
+        from workers.lib.thumbnail_renderer import render_thumbnail
+
+        annotations = AnnotationModel.objects(image_id=self.id, deleted=False, area__ne=0) \
+            .only('segmentation', 'category_id').as_pymongo()
+        annotations = [a for a in annotations if a.get('segmentation')]
+        colors = dict(CategoryModel.objects(id__in=list({a['category_id'] for a in annotations})).scalar('id', 'color'))
+
+        return render_thumbnail(
+            self.path,
+            [(a['segmentation'], colors.get(a['category_id'])) for a in annotations],
+            (self.MAX_THUMBNAIL_DIM[1], self.MAX_THUMBNAIL_DIM[0])
+        )
+
+    def pyramid(self):
+        """
+        Returns descriptor of tiled pyramid of the image, queueing its generation if there is none or the image
+        changed since it was generated
+
+        :return: descriptor (see `workers.lib.image_pyramid`) or None if pyramid is not generated yet
+        """
+        from workers.lib.image_pyramid import load_descriptor
+
+        directory = self.pyramid_directory()
+        descriptor = load_descriptor(directory, mtime=os.stat(self.path).st_mtime)
+        if descriptor is None:
+            self.queue_pyramid()
+        return descriptor
+
+    def queue_pyramid(self):
+        """
+        Queues generation of tiled pyramid, unless it is already queued
+
+        :return: True if generation was queued
+        """
+        from workers.tasks import generate_image_pyramid
+
+        marker = self.pyramid_directory().rstrip('/') + '.queued'
+        os.makedirs(os.path.dirname(marker), exist_ok=True)
+        try:
+            fd = os.open(marker, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                queued = os.stat(marker).st_mtime
+            except FileNotFoundError:
+                return False
+            if queued > datetime.datetime.now().timestamp() - self.PYRAMID_QUEUE_TIMEOUT:
+                return False
+            os.utime(marker)
+        else:
+            os.close(fd)
+
+        generate_image_pyramid.delay(self.id)
+        return True
+
+    def pyramid_directory(self):
+        """
+        :return: directory of tiled pyramid of the image, which may not exist
+        """
+        directory, file_name = os.path.split(self.path)
+        return os.path.join(directory, self.TILES_DIRECTORY, file_name)
+
+    def pyramid_delete(self):
+        path = self.pyramid_directory()
+        if os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
 
     def flag_thumbnail(self, flag=True):
         """
-        Toggles values to regenerate thumbnail on next thumbnail request
+        Toggles values to regenerate thumbnail, queueing its generation
         """
-        if self.regenerate_thumbnail != flag:
-            self.update(regenerate_thumbnail=flag)
+        if flag:
+            self.queue_thumbnails([self.id])
+        elif self.regenerate_thumbnail:
+            self.update(regenerate_thumbnail=False)
 
     def copy_annotations(self, annotations):
         """
@@ -152,9 +365,11 @@ class ImageModel(DynamicDocument):
         :param annotations: QuerySet of annotation models
         :return: number of annotations
         """
-        annotations = annotations.filter(
-            width=self.width, height=self.height, area__gt=0).exclude('events')
+        annotations = list(annotations.filter(
+            width=self.width, height=self.height, area__gt=0).exclude('events'))
+        paper_objects = PaperObjectModel.load(annotation.id for annotation in annotations)
 
+        copied_paper_objects = {}
         for annotation in annotations:
             clone = annotation.clone()
 
@@ -163,7 +378,13 @@ class ImageModel(DynamicDocument):
 
             clone.save(copy=True)
 
-        return annotations.count()
+            paper_object = paper_objects.get(annotation.id, getattr(annotation, 'paper_object', None))
+            if paper_object:
+                copied_paper_objects[clone.id] = paper_object
+
+        PaperObjectModel.store(copied_paper_objects)
+
+        return len(annotations)
 
     @property
     def dataset(self):
@@ -0,0 +1,73 @@
+import json
+import zlib
+
+from bson import Binary
+from mongoengine import *
+from pymongo import UpdateOne
+
+
+class PaperObjectModel(Document):
+    """
+    paper.js compound path of an annotation as drawn in the annotator. It is often larger than the rest of the
+    annotation and only the annotator needs it, so it is kept out of annotation documents and stored compressed.
+    """
+    COMPRESSION_LEVEL = 6
+    # Number of paper objects deleted with a single query, keeps the list of ids well below the BSON size limit
+    DELETE_BATCH_SIZE = 1000
+
+    # Id of the annotation
+    id = IntField(primary_key=True)
+    # zlib compressed JSON
+    data = BinaryField()
+
+    @classmethod
+    def compress(cls, paper_object):
+        return Binary(zlib.compress(json.dumps(paper_object, separators=(',', ':')).encode(), cls.COMPRESSION_LEVEL))
+
+    @classmethod
+    def decompress(cls, data):
+        return json.loads(zlib.decompress(data).decode())
+
+    @classmethod
+    def load(cls, annotation_ids):
+        """
+        :return: dict of annotation id to paper object, for annotations which have one
+        """
+        return {
+            document['_id']: cls.decompress(document['data'])
+            for document in cls.objects(id__in=list(annotation_ids)).as_pymongo()
+        }
+
+    @classmethod
+    def store(cls, paper_objects):
+        """
+        Stores paper objects, replacing existing ones
+
+        :param paper_objects: dict of annotation id to paper object
+        """
+        if not paper_objects:
+            return
+
+        cls._get_collection().bulk_write([
+            UpdateOne({'_id': annotation_id}, {'$set': {'data': cls.compress(paper_object)}}, upsert=True)
+            for annotation_id, paper_object in paper_objects.items()
+        ], ordered=False)
+
+    @classmethod
+    def delete_many(cls, annotation_ids):
+        """
+        Deletes paper objects of annotations, in batches of `DELETE_BATCH_SIZE`
+
+        :param annotation_ids: iterable of annotation ids, e.g. `scalar('id')` of a queryset
+        """
+        batch = []
+        for annotation_id in annotation_ids:
+            batch.append(annotation_id)
+            if len(batch) == cls.DELETE_BATCH_SIZE:
+                cls.objects(id__in=batch).delete()
+                batch = []
+        if batch:
+            cls.objects(id__in=batch).delete()
+
+
+__all__ = ["PaperObjectModel"]
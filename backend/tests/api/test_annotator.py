@@ -0,0 +1,89 @@
+import json
+
+from database import AnnotationModel, CategoryModel, DatasetModel, ImageModel
+
+annotator_url = "/api/annotator/data"
+
+
+class TestAnnotatorSave:
+
+    @classmethod
+    def setup_class(cls):
+        cls.dataset = DatasetModel(name="Annotator Save Dataset", directory="/datasets/annotator_save/", owner="user")
+        # DatasetModel.save creates the dataset directory
+        super(DatasetModel, cls.dataset).save()
+        cls.category = CategoryModel(name="Annotator Save Category").save()
+        cls.image = ImageModel(file_name="a.jpg", path="/datasets/annotator_save/a.jpg", width=10, height=10,
+                               dataset_id=cls.dataset.id).save()
+
+    @classmethod
+    def teardown_class(cls):
+        AnnotationModel.objects(image_id=cls.image.id).delete()
+        cls.image.delete()
+        cls.category.delete()
+        cls.dataset.delete()
+
+    def create_annotation(self, version):
+        annotation = AnnotationModel(image_id=self.image.id, category_id=self.category.id).save()
+        annotation.update(version=version)
+        return annotation.id
+
+    def save(self, client, annotations):
+        data = {
+            "image": {"id": self.image.id, "metadata": {}, "category_ids": [self.category.id]},
+            "dataset": {"annotate_url": ""},
+            "user": {},
+            "categories": [{"id": self.category.id, "color": "white", "annotations": annotations}]
+        }
+        return client.post(annotator_url, data=json.dumps(data))
+
+    def test_current_version(self, client):
+        annotation_id = self.create_annotation(2)
+
+        response = self.save(client, [{"id": annotation_id, "version": 2, "metadata": {"saved": True}}])
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["saved"] == [{"id": annotation_id, "version": 3}]
+        assert AnnotationModel.objects.get(id=annotation_id).metadata == {"saved": True}
+
+    def test_stale_version(self, client):
+        annotation_id = self.create_annotation(2)
+
+        response = self.save(client, [{"id": annotation_id, "version": 1, "metadata": {"saved": True}}])
+
+        assert response.status_code == 409
+        data = json.loads(response.data)
+        assert data["saved"] == []
+        assert data["conflicts"] == [{"id": annotation_id, "version": 2}]
+        annotation = AnnotationModel.objects.get(id=annotation_id)
+        assert annotation.version == 2
+        assert annotation.metadata != {"saved": True}
+
+    def test_unversioned_overwrite(self, client):
+        annotation_id = self.create_annotation(2)
+
+        # clients sending no version always overwrite the stored annotation
+        response = self.save(client, [{"id": annotation_id, "metadata": {"saved": True}}])
+
+        assert response.status_code == 200
+        assert json.loads(response.data)["saved"] == [{"id": annotation_id, "version": 3}]
+        annotation = AnnotationModel.objects.get(id=annotation_id)
+        assert annotation.version == 3
+        assert annotation.metadata == {"saved": True}
+
+    def test_partial_conflict(self, client):
+        current_id = self.create_annotation(0)
+        stale_id = self.create_annotation(4)
+
+        response = self.save(client, [
+            {"id": current_id, "version": 0, "metadata": {"saved": True}},
+            {"id": stale_id, "version": 3, "metadata": {"saved": True}}
+        ])
+
+        # annotations without conflicts are stored regardless
+        assert response.status_code == 409
+        data = json.loads(response.data)
+        assert data["saved"] == [{"id": current_id, "version": 1}]
+        assert data["conflicts"] == [{"id": stale_id, "version": 4}]
+        assert AnnotationModel.objects.get(id=current_id).metadata == {"saved": True}
+        assert AnnotationModel.objects.get(id=stale_id).version == 4
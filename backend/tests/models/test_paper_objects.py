@@ -0,0 +1,23 @@
+from database import PaperObjectModel
+
+
+def test_compression_round_trip():
+    paper_object = ["CompoundPath", {"applyMatrix": True, "children": [
+        ["Path", {"applyMatrix": True, "segments": [[-10.5, 4], [[20, 4], [1, 1], [2, 2]], [20, 30]], "closed": True}]
+    ]}]
+
+    data = PaperObjectModel.compress(paper_object)
+
+    assert PaperObjectModel.decompress(data) == paper_object
+    assert len(data) < len(str(paper_object))
+
+
+def test_delete_many_in_batches(monkeypatch):
+    monkeypatch.setattr(PaperObjectModel, "DELETE_BATCH_SIZE", 2)
+    annotation_ids = list(range(900001, 900006))
+    PaperObjectModel.store({annotation_id: ["Path", {}] for annotation_id in annotation_ids})
+
+    PaperObjectModel.delete_many(iter(annotation_ids[:4]))
+
+    assert list(PaperObjectModel.load(annotation_ids)) == [annotation_ids[4]]
+    PaperObjectModel.delete_many(annotation_ids)
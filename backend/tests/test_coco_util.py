@@ -0,0 +1,35 @@
+from webserver.util.coco_util import paperjs_to_coco
+
+
+def test_path_is_shifted_and_rounded():
+    path = ["Path", {"segments": [[-40, -20], [10.004, -20], [10.004, 10], [-40, 10]]}]
+
+    segmentation, area, bbox = paperjs_to_coco(100, 50, path)
+
+    assert segmentation == [[10.0, 5.0, 60.0, 5.0, 60.0, 35.0, 10.0, 35.0]]
+    assert area == 1500
+    assert list(bbox) == [10, 5, 50, 30]
+
+
+def test_compound_path_is_clipped_and_filtered():
+    compound_path = ["CompoundPath", {"children": [
+        # partly outside of the image, with curves
+        ["Path", {"segments": [[-60, -30], [[20, -30], [1, 1], [2, 2], 0], [20, 20], [[0, 0], [1, 1], [2, 2]],
+                               [-60, 20]]}],
+        # line
+        ["Path", {"segments": [[0, 0], [10, 10]]}],
+        # outside of the image
+        ["Path", {"segments": [[-70, -30], [-60, -30], [-60, -40]]}]
+    ]}]
+
+    segmentation, area, bbox = paperjs_to_coco(100, 50, compound_path)
+
+    assert segmentation == [[0, 0, 70.0, 0, 70.0, 45.0, 0, 45.0]]
+    # coordinates clipped to the image are its bounds
+    assert [type(value) for value in segmentation[0]] == [int, int, float, int, float, float, int, float]
+    assert area == 3150
+    assert list(bbox) == [0, 0, 70, 45]
+
+
+def test_empty_compound_path():
+    assert paperjs_to_coco(100, 50, ["CompoundPath", {"children": []}]) == ([], 0, [0, 0, 0, 0])
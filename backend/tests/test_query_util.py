@@ -0,0 +1,29 @@
+import datetime
+
+from mongoengine import DynamicDocument, SequenceField, ListField, IntField, DateTimeField, StringField
+
+from webserver.util.query_util import fix_ids, fix_pymongo_ids, field_defaults
+
+
+class Document(DynamicDocument):
+    id = SequenceField(primary_key=True)
+    segmentation = ListField(default=[])
+    area = IntField(default=0)
+    color = StringField()
+    created_at = DateTimeField()
+
+
+def test_raw_document_matches_model_instance():
+    raw = {
+        '_id': 3,
+        'segmentation': [[1.5, 2, 3, 4, 5, 6]],
+        'color': None,
+        'created_at': datetime.datetime(2020, 1, 2, 3, 4, 5, 678000),
+        'metadata': {'_id': 1, 'name': 'car'}
+    }
+
+    expected = fix_ids(Document._from_son(raw))
+
+    assert fix_pymongo_ids(raw, field_defaults(Document)) == expected
+    assert expected['area'] == 0
+    assert expected['created_at'] == {'$date': 1577934245678}
@@ -0,0 +1,66 @@
+import os
+import time
+
+from webserver.util.rendition_cache import RenditionCache
+
+
+def age(path, seconds):
+    timestamp = time.time() - seconds
+    os.utime(path, (timestamp, timestamp))
+
+
+def test_path_depends_on_key(tmp_path):
+    cache = RenditionCache(str(tmp_path), 1000)
+
+    paths = {
+        cache.path(1, 10, 250, 250, 90),
+        cache.path(1, 11, 250, 250, 90),
+        cache.path(1, 10, 250, 100, 90),
+        cache.path(1, 10, 250, 250, 80),
+        cache.path(1, 10, 250, 250, 90, variant="thumbnail"),
+        cache.path(2, 10, 250, 250, 90)
+    }
+
+    assert len(paths) == 6
+
+
+def test_put_and_get(tmp_path):
+    cache = RenditionCache(str(tmp_path), 1000)
+    path = cache.path(1, 10, 250, 250, 90)
+
+    assert cache.get(path) is None
+    cache.put(path, b"rendition")
+
+    assert cache.get(path) == path
+    with open(path, "rb") as f:
+        assert f.read() == b"rendition"
+    # no temporary files are left behind
+    assert os.listdir(os.path.dirname(path)) == [os.path.basename(path)]
+
+
+def test_least_recently_used_evicted(tmp_path):
+    cache = RenditionCache(str(tmp_path), 300)
+    paths = [cache.path(i, 0, 10, 10, 90) for i in range(3)]
+    for i, path in enumerate(paths):
+        cache.put(path, b"x" * 100)
+        age(path, 100 - i)
+
+    # oldest entry was used recently
+    cache.get(paths[0])
+
+    cache.max_bytes = 250
+    assert cache.evict() == 1
+    assert [cache.get(path) is not None for path in paths] == [True, False, True]
+
+
+def test_evicts_when_budget_exceeded(tmp_path):
+    cache = RenditionCache(str(tmp_path), 250)
+
+    for i in range(10):
+        path = cache.path(i, 0, 10, 10, 90)
+        cache.put(path, b"x" * 100)
+        age(path, 100 - i)
+
+    sizes = [entry.stat().st_size for bucket in os.scandir(tmp_path) if bucket.is_dir()
+             for entry in os.scandir(bucket.path)]
+    assert sum(sizes) <= 250
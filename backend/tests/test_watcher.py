@@ -0,0 +1,69 @@
+import time
+
+from webserver.watcher import FileEventBatcher, CREATED, MOVED, DELETED
+
+
+def batcher():
+    return FileEventBatcher(delay=0, send=lambda events: None)
+
+
+def test_events_are_coalesced_per_path():
+    events = batcher()
+    events.add("created", "/datasets/a/1.jpg", "/datasets/a/1.jpg")
+    events.add("modified", "/datasets/a/1.jpg", "/datasets/a/1.jpg")
+    events.add("created", "/datasets/a/2.jpg", "/datasets/a/2.jpg")
+    events.add("deleted", "/datasets/a/2.jpg", "/datasets/a/2.jpg")
+    events.add("deleted", "/datasets/a/3.jpg", "/datasets/a/3.jpg")
+    events.add("created", "/datasets/a/3.jpg", "/datasets/a/3.jpg")
+
+    assert events.flush() == [
+        [CREATED, "/datasets/a/1.jpg", None],
+        [DELETED, "/datasets/a/2.jpg", None],
+        [CREATED, "/datasets/a/3.jpg", None]
+    ]
+    assert events.flush() == []
+
+
+def test_moves_are_coalesced():
+    events = batcher()
+    # new file renamed before it reached database
+    events.add("created", "/datasets/a/1.jpg", "/datasets/a/1.jpg")
+    events.add("moved", "/datasets/a/2.jpg", "/datasets/a/1.jpg")
+    # existing file renamed twice
+    events.add("moved", "/datasets/a/4.jpg", "/datasets/a/3.jpg")
+    events.add("moved", "/datasets/a/5.jpg", "/datasets/a/4.jpg")
+    # existing file renamed and back
+    events.add("moved", "/datasets/a/7.jpg", "/datasets/a/6.jpg")
+    events.add("moved", "/datasets/a/6.jpg", "/datasets/a/7.jpg")
+
+    assert events.flush() == [
+        [CREATED, "/datasets/a/2.jpg", None],
+        [MOVED, "/datasets/a/5.jpg", "/datasets/a/3.jpg"]
+    ]
+
+
+def test_deleting_moved_file_deletes_original():
+    events = batcher()
+    events.add("moved", "/datasets/a/2.jpg", "/datasets/a/1.jpg")
+    events.add("deleted", "/datasets/a/2.jpg", "/datasets/a/2.jpg")
+
+    assert sorted(events.flush()) == [
+        [DELETED, "/datasets/a/1.jpg", None],
+        [DELETED, "/datasets/a/2.jpg", None]
+    ]
+
+
+def test_events_are_sent_in_batches():
+    sent = []
+    events = FileEventBatcher(delay=0.05, send=sent.append)
+    events.start()
+    for i in range(100):
+        events.add("created", f"/datasets/a/{i}.jpg", f"/datasets/a/{i}.jpg")
+
+    for _ in range(100):
+        if sent:
+            break
+        time.sleep(0.05)
+
+    assert len(sent) == 1
+    assert len(sent[0]) == 100
@@ -0,0 +1,63 @@
+import random
+
+import pytest
+from pycocotools import mask
+from workers.lib.messenger import messenger
+from workers.lib.vod_converter.coco import COCOEgestor
+from workers.lib.vod_converter.validation_schemas import get_blank_detection_schema
+
+
+class TaskLog:
+    def info(self, string):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def task_log():
+    messenger.connect_task(TaskLog())
+
+
+def detection(label, left, top, right, bottom, segmentation=None, isbbox=True):
+    detection = get_blank_detection_schema()
+    detection.update(label=label, left=left, top=top, right=right, bottom=bottom, segmentation=segmentation,
+                     iscrowd=False, isbbox=isbbox)
+    return detection
+
+
+def pycocotools_area(segmentation, height, width):
+    return int(sum(mask.area(mask.frPyObjects(segmentation, height, width))))
+
+
+@pytest.mark.parametrize("number_of_boxes", [1, 100])
+def test_box_areas_match_pycocotools(number_of_boxes):
+    random.seed(number_of_boxes)
+    image = {"id": 0, "width": 120, "height": 80}
+    detections = []
+    for _ in range(number_of_boxes):
+        left, right = sorted(random.uniform(0, 123) for _ in range(2))
+        top, bottom = sorted(random.choice([random.uniform(0, 83), random.randint(0, 83)]) for _ in range(2))
+        detections.append(detection("car", left, top, right, bottom))
+
+    annotations = COCOEgestor.create_annotations(detections, image, {"car": 3})
+
+    assert len(annotations) == number_of_boxes
+    for annotation in annotations:
+        assert annotation["category_id"] == 3
+        assert annotation["area"] == pycocotools_area(annotation["segmentation"], 80, 120)
+
+
+def test_polygon_areas_match_pycocotools():
+    image = {"id": 0, "width": 120, "height": 80}
+    detections = [
+        detection("car", 0, 0, 0, 0, segmentation=[[10, 10, 50, 12, 30, 60]], isbbox=False),
+        detection("car", 0, 0, 0, 0, segmentation=[[0, 0, 20, 0, 20, 20, 0, 20], [40, 40, 60, 45, 50, 70]]),
+        detection("person", 0, 0, 0, 0, segmentation=[[1, 1, 5, 5, 1, 9]], isbbox=False),
+        detection("car", 0, 0, 0, 0, segmentation=None, isbbox=False)
+    ]
+
+    annotations = COCOEgestor.create_annotations(detections, image, {"car": 0}, first_id=10)
+
+    assert [annotation["id"] for annotation in annotations] == [10, 11, 12]
+    for annotation in annotations[:2]:
+        assert annotation["area"] == pycocotools_area(annotation["segmentation"], 80, 120)
+    assert annotations[2]["area"] == 0
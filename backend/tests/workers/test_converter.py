@@ -0,0 +1,57 @@
+import pytest
+from workers.lib.messenger import messenger
+from workers.lib.vod_converter.converter import validate_image_detections
+from workers.lib.vod_converter.validation_schemas import (
+    get_blank_detection_schema,
+    get_blank_image_detection_schema
+)
+
+
+class TaskLog:
+    def __init__(self):
+        self.logs = []
+
+    def info(self, string):
+        self.logs.append(string)
+
+
+@pytest.fixture
+def task_log():
+    task = TaskLog()
+    messenger.connect_task(task)
+    return task
+
+
+def image_detection(image_id, boxes, isbbox=True):
+    image_detection = get_blank_image_detection_schema()
+    image_detection["image"].update(id=image_id, path=f"/{image_id}.jpg", width=100, height=50,
+                                    file_name=f"{image_id}.jpg")
+    for i, (left, top, right, bottom) in enumerate(boxes):
+        detection = get_blank_detection_schema()
+        detection.update(id=i, image_id=image_id, label="car", left=left, top=top, right=right, bottom=bottom,
+                         iscrowd=False, isbbox=isbbox)
+        image_detection["detections"].append(detection)
+    return image_detection
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 1000])
+def test_validate_image_detections(task_log, batch_size):
+    invalid_schema = image_detection(3, [])
+    invalid_schema["image"]["width"] = None
+
+    image_detections = [
+        image_detection(0, [(0, 0, 10, 10)]),
+        image_detection(1, [(0, 0, 10, 10), (90, 0, 110, 10)]),
+        image_detection(2, [(10, 10, 10, 20)]),
+        invalid_schema,
+        image_detection(4, [(10, 10, 10, 20)], isbbox=False),
+        image_detection(5, [])
+    ]
+
+    valid = validate_image_detections(image_detections, batch_size=batch_size)
+
+    assert [valid_detection["image"]["id"] for valid_detection in valid] == [0, 4, 5]
+    assert "Deleted labels for 3 images" in task_log.logs
+    assert any(log.startswith("1 images rejected due to out of bounds bbox") for log in task_log.logs)
+    assert any(log.startswith("1 images rejected due to zero dimension bbox") for log in task_log.logs)
+    assert any(log.startswith("1 images rejected due to schema error") for log in task_log.logs)
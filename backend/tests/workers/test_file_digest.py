@@ -0,0 +1,20 @@
+import hashlib
+
+import pytest
+from workers.lib.file_digest import file_digest
+
+
+@pytest.mark.parametrize("size", [0, 1, 1023, 1024, 1025, 10 * 1024 + 7])
+def test_file_digest_matches_hashlib(tmp_path, size):
+    content = bytes(i % 251 for i in range(size))
+    path = tmp_path / "image.jpg"
+    path.write_bytes(content)
+
+    assert file_digest(str(path), chunk_size=1024) == hashlib.sha256(content).hexdigest()
+
+
+def test_file_digest_algorithm(tmp_path):
+    path = tmp_path / "image.jpg"
+    path.write_bytes(b"image")
+
+    assert file_digest(str(path), algorithm="md5") == hashlib.md5(b"image").hexdigest()
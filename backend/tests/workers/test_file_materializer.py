@@ -0,0 +1,114 @@
+import os
+
+import pytest
+from workers.lib.messenger import messenger
+from workers.lib.vod_converter.file_materializer import FileMaterializer, COPY, HARDLINK, REFLINK
+from workers.lib.vod_converter.kitti import KITTIEgestor
+from workers.lib.vod_converter.voc import VOCEgestor
+
+
+class TaskLog:
+    def __init__(self):
+        self.logs = []
+
+    def info(self, string):
+        self.logs.append(string)
+
+
+@pytest.fixture(autouse=True)
+def task_log():
+    task = TaskLog()
+    messenger.connect_task(task)
+    return task
+
+
+def write_files(directory, count):
+    paths = []
+    for i in range(count):
+        path = directory / f"{i}.jpg"
+        path.write_bytes(f"image {i}".encode())
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize("methods", [(REFLINK, HARDLINK, COPY), (HARDLINK, COPY), (COPY,)])
+def test_materialize(tmp_path, methods):
+    (tmp_path / "out").mkdir()
+    sources = write_files(tmp_path, 20)
+    # existing files are replaced
+    (tmp_path / "out" / "0.jpg").write_bytes(b"old")
+
+    with FileMaterializer(max_workers=2, methods=methods) as files:
+        for source in sources:
+            files.materialize(source, str(tmp_path / "out" / os.path.basename(source)))
+
+    for i in range(20):
+        assert (tmp_path / "out" / f"{i}.jpg").read_bytes() == f"image {i}".encode()
+    assert sum(files.counts.values()) == 20
+
+
+@pytest.mark.parametrize("methods", [(REFLINK, HARDLINK, COPY), (HARDLINK, COPY), (COPY,)])
+def test_materialize_twice(tmp_path, methods):
+    (tmp_path / "out").mkdir()
+    sources = write_files(tmp_path, 3)
+
+    # second export finds files linked by the first one
+    for _ in range(2):
+        with FileMaterializer(max_workers=2, methods=methods) as files:
+            for source in sources:
+                files.materialize(source, str(tmp_path / "out" / os.path.basename(source)))
+
+    for i in range(3):
+        assert (tmp_path / f"{i}.jpg").read_bytes() == f"image {i}".encode()
+        assert (tmp_path / "out" / f"{i}.jpg").read_bytes() == f"image {i}".encode()
+    assert not [name for name in os.listdir(tmp_path / "out") if name.endswith(".tmp")]
+
+
+def test_copy_over_link_to_other_file(tmp_path):
+    (tmp_path / "out").mkdir()
+    first, second = write_files(tmp_path, 2)
+    # left by an earlier export of another image to the same name
+    os.link(first, str(tmp_path / "out" / "x.jpg"))
+
+    with FileMaterializer(methods=(COPY,)) as files:
+        files.materialize(second, str(tmp_path / "out" / "x.jpg"))
+
+    assert (tmp_path / "0.jpg").read_bytes() == b"image 0"
+    assert (tmp_path / "out" / "x.jpg").read_bytes() == b"image 1"
+
+
+def test_materialize_missing_source(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        with FileMaterializer() as files:
+            files.materialize(str(tmp_path / "missing.jpg"), str(tmp_path / "copy.jpg"))
+
+
+def image_detections(paths):
+    return [{
+        "image": {"id": f"{i:03d}", "path": path, "segmented_path": None, "width": 10, "height": 10},
+        "detections": [{"label": "car", "left": 1, "top": 1, "right": 5, "bottom": 5}]
+    } for i, path in enumerate(paths)]
+
+
+def test_voc_egestor_writes_index_once(tmp_path):
+    (tmp_path / "in").mkdir()
+    paths = write_files(tmp_path / "in", 3)
+
+    VOCEgestor().egest(image_detections=image_detections(paths), root=str(tmp_path / "voc"), folder_names=None)
+
+    index = (tmp_path / "voc" / "ImageSets" / "Main" / "trainval.txt").read_text()
+    assert index == "000\n001\n002\n"
+    assert (tmp_path / "voc" / "JPEGImages" / "002.jpg").read_bytes() == b"image 2"
+    assert (tmp_path / "voc" / "Annotations" / "002.xml").exists()
+
+
+def test_kitti_egestor_skips_missing_images(tmp_path):
+    (tmp_path / "in").mkdir()
+    paths = write_files(tmp_path / "in", 3)
+    os.remove(paths[1])
+
+    KITTIEgestor().egest(image_detections=image_detections(paths), root=str(tmp_path / "kitti"), folder_names=None)
+
+    assert (tmp_path / "kitti" / "train.txt").read_text() == "000\n002\n"
+    assert (tmp_path / "kitti" / "images" / "002.jpg").read_bytes() == b"image 2"
+    assert not (tmp_path / "kitti" / "labels" / "001.txt").exists()
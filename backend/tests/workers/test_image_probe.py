@@ -0,0 +1,48 @@
+import os
+
+import pytest
+from PIL import Image
+from workers.lib.image_probe import image_dimensions, exif_orientation, clear_cache
+
+
+@pytest.mark.parametrize("image_format,extension", [
+    ("JPEG", "jpg"),
+    ("PNG", "png"),
+    ("GIF", "gif"),
+    ("BMP", "bmp"),
+    ("TIFF", "tif")
+])
+def test_image_dimensions(tmpdir, image_format, extension):
+    path = str(tmpdir.join(f"image.{extension}"))
+    Image.new("RGB", (321, 123)).save(path, image_format)
+
+    assert tuple(image_dimensions(path)) == (321, 123)
+
+
+def test_image_dimensions_cache(tmpdir):
+    clear_cache()
+    path = str(tmpdir.join("image.png"))
+    Image.new("RGB", (50, 40)).save(path, "PNG")
+    assert tuple(image_dimensions(path)) == (50, 40)
+
+    Image.new("RGB", (60, 70)).save(path, "PNG")
+    os.utime(path, ns=(0, 10 ** 9))
+    assert tuple(image_dimensions(path)) == (60, 70)
+
+
+def test_image_dimensions_missing_file(tmpdir):
+    with pytest.raises(FileNotFoundError):
+        image_dimensions(str(tmpdir.join("missing.jpg")))
+
+
+def test_exif_orientation(tmpdir):
+    path = str(tmpdir.join("image.jpg"))
+    Image.new("RGB", (30, 20)).save(path, "JPEG")
+    assert exif_orientation(path) == 1
+
+    exif = Image.Exif()
+    exif[0x0112] = 6
+    Image.new("RGB", (30, 20)).save(path, "JPEG", exif=exif)
+    assert exif_orientation(path) == 6
+    # stored pixels keep their orientation
+    assert tuple(image_dimensions(path)) == (30, 20)
@@ -0,0 +1,49 @@
+import os
+
+from PIL import Image
+from workers.lib.image_pyramid import (
+    generate_pyramid, load_descriptor, visible_tiles, tile_path, level_size, max_level
+)
+
+
+def test_levels():
+    assert max_level(1, 1) == 0
+    assert max_level(1000, 600) == 10
+    assert level_size(1000, 600, 10) == (1000, 600)
+    assert level_size(1000, 600, 9) == (500, 300)
+    assert level_size(1000, 600, 0) == (1, 1)
+
+
+def test_generate_pyramid(tmp_path):
+    path = str(tmp_path / "image.png")
+    Image.new("RGB", (600, 300), (200, 10, 10)).save(path)
+    directory = str(tmp_path / ".tiles" / "image.png")
+
+    descriptor = generate_pyramid(path, directory, tile_size=256, overlap=1)
+
+    assert descriptor["max_level"] == 10
+    assert load_descriptor(directory, mtime=os.stat(path).st_mtime) == descriptor
+    assert load_descriptor(directory, mtime=0) is None
+
+    # top level: 3 columns, 2 rows, edge tiles are cropped and overlap their neighbours
+    assert sorted(os.listdir(os.path.join(directory, "10"))) == \
+        ["0_0.jpg", "0_1.jpg", "1_0.jpg", "1_1.jpg", "2_0.jpg", "2_1.jpg"]
+    assert Image.open(tile_path(directory, 10, 0, 0)).size == (257, 257)
+    assert Image.open(tile_path(directory, 10, 1, 1)).size == (258, 45)
+    assert Image.open(tile_path(directory, 10, 2, 0)).size == (89, 257)
+    assert Image.open(tile_path(directory, 0, 0, 0)).size == (1, 1)
+
+    # regenerating replaces the pyramid without leftovers
+    generate_pyramid(path, directory)
+    assert sorted(os.listdir(tmp_path / ".tiles")) == ["image.png"]
+
+
+def test_visible_tiles():
+    descriptor = {"width": 1000, "height": 600, "tile_size": 256, "max_level": 10}
+
+    assert visible_tiles(descriptor, 10, 0, 0, 100, 100) == [(0, 0)]
+    assert visible_tiles(descriptor, 10, 200, 200, 100, 100) == [(0, 0), (1, 0), (0, 1), (1, 1)]
+    assert visible_tiles(descriptor, 10, 0, 0, 5000, 5000) == [(c, r) for r in range(3) for c in range(4)]
+    # level 9 is half the size, the whole image fits in 2x2 tiles
+    assert visible_tiles(descriptor, 9, 0, 0, 1000, 600) == [(0, 0), (1, 0), (0, 1), (1, 1)]
+    assert visible_tiles(descriptor, 10, 2000, 0, 100, 100) == []
@@ -0,0 +1,32 @@
+import os
+
+from PIL import Image
+from database import DatasetModel, ImageModel, TaskModel
+from workers.lib.image_pyramid import generate_pyramid
+from workers.tasks import scan
+
+
+def test_scan_skips_tile_pyramids(tmp_path, monkeypatch):
+    monkeypatch.setattr(scan, "create_socket", lambda: None)
+
+    directory = tmp_path / "scan_pyramid"
+    directory.mkdir()
+    path = str(directory / "a.jpg")
+    Image.new("RGB", (600, 300), (200, 10, 10)).save(path)
+
+    dataset = DatasetModel(name="Scan Pyramid Dataset", directory=str(directory) + "/", owner="test")
+    # DatasetModel.save places datasets under the dataset directory of the config
+    super(DatasetModel, dataset).save()
+    try:
+        image = ImageModel.create_from_path(path, dataset.id)
+        image.save()
+        generate_pyramid(path, image.pyramid_directory(), tile_size=256)
+
+        task = TaskModel(name="Scanning Scan Pyramid Dataset", group="Directory Image Scan").save()
+        scan.scan_dataset(task.id, dataset.id)
+
+        assert os.path.isdir(os.path.join(str(directory), ".tiles", "a.jpg", "10"))
+        assert list(ImageModel.objects(dataset_id=dataset.id).scalar('path')) == [path]
+    finally:
+        ImageModel.objects(dataset_id=dataset.id).delete()
+        dataset.delete()
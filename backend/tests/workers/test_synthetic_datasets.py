@@ -0,0 +1,47 @@
+import pytest
+from benchmarks.synthetic_datasets import generate, GENERATORS
+from workers.lib.messenger import messenger
+from workers.lib.vod_converter.converter import INGESTORS, validate_image_detections
+
+
+class TaskLog:
+    def __init__(self):
+        self.logs = []
+
+    def info(self, string):
+        self.logs.append(string)
+
+
+@pytest.fixture(autouse=True)
+def task_log():
+    task = TaskLog()
+    messenger.connect_task(task)
+    return task
+
+
+# MIO ingestor expects uploaded file objects instead of a path
+@pytest.mark.parametrize("format_key", [key for key in GENERATORS if key != "mio"])
+def test_generated_dataset_is_ingested(tmp_path, format_key):
+    from_path = generate(format_key, str(tmp_path / format_key), 4, detections_per_image=3, width=64, height=48)
+    ingestor = INGESTORS[format_key]
+
+    valid, message = ingestor.validate(from_path, None)
+    assert valid, message
+
+    image_detections = list(validate_image_detections(ingestor.iter_ingest(from_path, None)))
+    assert len(image_detections) == 4
+    assert all(image_detection["detections"] for image_detection in image_detections)
+
+
+def test_generate_is_deterministic(tmp_path):
+    generate("kitti", str(tmp_path / "first"), 2, seed=3)
+    generate("kitti", str(tmp_path / "second"), 2, seed=3)
+
+    for image_id in ["000000", "000001"]:
+        first = (tmp_path / "first" / "labels" / f"{image_id}.txt").read_text()
+        assert first == (tmp_path / "second" / "labels" / f"{image_id}.txt").read_text()
+
+
+def test_generate_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        generate("unknown", str(tmp_path), 1)
@@ -0,0 +1,77 @@
+from PIL import Image
+from workers.lib.thumbnail_renderer import render_thumbnail, render_sprite, scale_polygon
+
+
+def write_image(path, size, color=(0, 0, 0)):
+    Image.new("RGB", size, color).save(path)
+    return str(path)
+
+
+def test_scale_polygon():
+    assert scale_polygon([10, 20, 30, 40, 50, 60], 0.5, 0.25) == [5, 5, 15, 10, 25, 15]
+
+
+def test_jpeg_decoded_at_reduced_scale(tmp_path, monkeypatch):
+    path = write_image(tmp_path / "large.jpg", (4000, 3000))
+    opened = []
+    original_open = Image.open
+
+    def open_image(*args, **kwargs):
+        image = original_open(*args, **kwargs)
+        opened.append(image)
+        return image
+
+    monkeypatch.setattr(Image, "open", open_image)
+
+    thumbnail = render_thumbnail(path, [], (400, 400))
+
+    assert thumbnail.size == (400, 300)
+    assert thumbnail.mode == "RGB"
+    # decoder produced a fraction of the original image
+    assert opened[0].size == (1000, 750)
+
+
+def test_annotations_drawn_scaled(tmp_path):
+    path = write_image(tmp_path / "image.png", (1000, 1000))
+    square = [100, 100, 500, 100, 500, 500, 100, 500]
+
+    thumbnail = render_thumbnail(path, [([square], "#ff0000")], (100, 100), alpha=1, outline_width=0)
+
+    assert thumbnail.size == (100, 100)
+    assert thumbnail.getpixel((30, 30)) == (255, 0, 0)
+    assert thumbnail.getpixel((70, 70)) == (0, 0, 0)
+
+
+def test_mask_blended_with_image(tmp_path):
+    path = write_image(tmp_path / "image.png", (200, 200), color=(0, 0, 200))
+    everything = [0, 0, 200, 0, 200, 200, 0, 200]
+
+    thumbnail = render_thumbnail(path, [([everything], "#ff0000")], (100, 100), alpha=0.5, outline_width=0)
+
+    r, g, b = thumbnail.getpixel((50, 50))
+    assert abs(r - 128) <= 1 and g == 0 and abs(b - 100) <= 1
+
+
+def test_invalid_segmentations_skipped(tmp_path):
+    path = write_image(tmp_path / "image.png", (100, 100))
+
+    thumbnail = render_thumbnail(path, [({"counts": "abc", "size": [100, 100]}, "#ff0000"), ([[1, 2]], None)],
+                                 (50, 50))
+
+    assert thumbnail.getextrema() == ((0, 0), (0, 0), (0, 0))
+
+
+def test_render_sprite(tmp_path):
+    paths = [
+        write_image(tmp_path / "wide.png", (200, 100), color=(255, 0, 0)),
+        None,
+        write_image(tmp_path / "tall.png", (50, 100), color=(0, 255, 0))
+    ]
+
+    sprite, offsets = render_sprite(paths, 50, columns=2)
+
+    assert sprite.size == (100, 100)
+    assert offsets == [(0, 0, 50, 25), None, (0, 50, 25, 50)]
+    assert sprite.getpixel((10, 10)) == (255, 0, 0)
+    assert sprite.getpixel((10, 60)) == (0, 255, 0)
+    assert sprite.getpixel((60, 10)) == (0, 0, 0)
@@ -65,6 +65,8 @@ class Annotation(Resource):
         except (ValueError, TypeError) as e:
             return {'message': str(e)}, 400
 
+        image.flag_thumbnail()
+
         return query_util.fix_ids(annotation)
 
 
@@ -89,12 +91,15 @@ class AnnotationId(Resource):
         if annotation is None:
             return {"message": "Invalid annotation id"}, 400
 
+        annotation.update(set__deleted=True,
+                          set__deleted_date=datetime.datetime.now(),
+                          inc__version=1)
+
+        # after the update, so the thumbnail is rendered without the annotation
         image = current_user.images.filter(
             id=annotation.image_id, deleted=False).first()
-        image.flag_thumbnail()
-
-        annotation.update(set__deleted=True,
-                          set__deleted_date=datetime.datetime.now())
+        if image is not None:
+            image.flag_thumbnail()
         return {'success': True}
 
     @api.expect(update_annotation)
@@ -109,7 +114,7 @@ class AnnotationId(Resource):
         args = update_annotation.parse_args()
 
         new_category_id = args.get('category_id')
-        annotation.update(category_id=new_category_id)
+        annotation.update(category_id=new_category_id, inc__version=1)
         logger.info(
             f'{current_user.username} has updated category for annotation (id: {annotation.id})'
         )
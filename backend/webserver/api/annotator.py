@@ -1,21 +1,53 @@
 import datetime
-
-from flask_restplus import Namespace, Resource
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+import eventlet
+from eventlet import tpool
+from flask_restplus import Namespace, Resource, reqparse
 from flask_login import login_required, current_user
 from flask import request
+from pymongo import UpdateOne
 
 from ..util import query_util, coco_util, profile
+from .images import pass_through_type, rendition
 
 from config import Config
 from database import (
     ImageModel,
     CategoryModel,
     AnnotationModel,
+    PaperObjectModel,
     SessionEvent
 )
 
+logger = logging.getLogger('gunicorn.error')
+
 api = Namespace('annotator', description='Annotator related operations')
 
+image_data = reqparse.RequestParser()
+image_data.add_argument('order', default='file_name', help='Order images are browsed in')
+image_data.add_argument('folder', default='', help='Folder images are browsed in')
+
+# Seconds during which a warmed image is not warmed again, e.g. when moving back and forth
+WARM_INTERVAL = 60
+MAX_WARMED_IMAGES = 1000
+
+# Bytes of JSON of annotations of recently loaded and warmed images kept in memory
+MAX_CACHED_ANNOTATIONS_BYTES = 64 * 1024 * 1024
+# Seconds cached annotations are served for, bounds staleness after writes which do not bump annotation versions
+CACHED_ANNOTATIONS_TTL = 5 * 60
+
+_warmed = OrderedDict()
+_warmed_lock = threading.Lock()
+# image id to (time loaded, annotation ids and versions, annotations grouped by category, size)
+_annotations = OrderedDict()
+_annotations_bytes = 0
+
 
 @api.route('/data')
 class AnnotatorData(Resource):
@@ -25,12 +57,16 @@ class AnnotatorData(Resource):
     def post(self):
         """
         Called when saving data from the annotator client
+
+        Only annotations changed since the last save need to be sent. Annotations sent with the version they were
+        loaded or last saved with are only updated if nobody else changed them in the meantime, others are
+        reported as conflicts with a 409 response.
         """
         data = request.get_json(force=True)
         image = data.get('image')
         dataset = data.get('dataset')
         image_id = image.get('id')
-        
+
         image_model = ImageModel.objects(id=image_id).first()
 
         if image_model is None:
@@ -38,23 +74,33 @@ class AnnotatorData(Resource):
 
         # Check if current user can access dataset
         db_dataset = current_user.datasets.filter(id=image_model.dataset_id).first()
-        if dataset is None:
-            return {'success': False, 'message': 'Could not find associated dataset'}
-        
+        if db_dataset is None:
+            return {'success': False, 'message': 'Could not find associated dataset'}, 400
+
         db_dataset.update(annotate_url=dataset.get('annotate_url', ''))
-        
-        categories = CategoryModel.objects.all()
-        annotations = AnnotationModel.objects(image_id=image_id)
 
         current_user.update(preferences=data.get('user', {}))
 
-        annotated = False
-        # Iterate every category passed in the data
-        for category in data.get('categories', []):
-            category_id = category.get('id')
+        categories_data = data.get('categories', [])
 
-            # Find corresponding category object in the database
-            db_category = categories.filter(id=category_id).first()
+        # Referenced categories and every annotation of the image are loaded at once, the annotations also
+        # provide everything needed for the image summary
+        categories = CategoryModel.objects.only('id', 'creator')\
+            .in_bulk([category.get('id') for category in categories_data])
+        annotations = {
+            annotation['_id']: annotation for annotation in AnnotationModel.objects(image_id=image_id)
+            .only('id', 'width', 'height', 'area', 'deleted', 'version').as_pymongo()
+        }
+
+        category_updates = []
+        annotation_updates = []
+        # new version of every updated annotation
+        versions = {}
+        conflicts = []
+        paper_objects = {}
+        # Iterate every category passed in the data
+        for category in categories_data:
+            db_category = categories.get(category.get('id'))
             if db_category is None:
                 continue
 
@@ -62,23 +108,21 @@ class AnnotatorData(Resource):
             if current_user.can_edit(db_category):
                 category_update['keypoint_edges'] = category.get('keypoint_edges', [])
                 category_update['keypoint_labels'] = category.get('keypoint_labels', [])
-            
-            db_category.update(**category_update)
+
+            category_updates.append(UpdateOne({'_id': db_category.id}, {'$set': category_update}))
 
             # Iterate every annotation from the data annotations
             for annotation in category.get('annotations', []):
-
-                # Find corresponding annotation object in database
-                annotation_id = annotation.get('id')
-                db_annotation = annotations.filter(id=annotation_id).first()
-
+                db_annotation = annotations.get(annotation.get('id'))
                 if db_annotation is None:
                     continue
 
-                # Paperjs objects are complex, so they will not always be passed. Therefor we update
-                # the annotation twice, checking if the paperjs exists.
+                # Annotations sent without the version they were based on overwrite the stored one
+                version = annotation.get('version')
+                if version is not None and version != db_annotation.get('version', 0):
+                    conflicts.append(db_annotation['_id'])
+                    continue
 
-                # Update annotation in database
                 sessions = []
                 total_time = 0
                 for session in annotation.get('sessions', []):
@@ -90,59 +134,100 @@ class AnnotatorData(Resource):
                         tools_used=session.get('tools')
                     )
                     total_time += session.get('milliseconds')
-                    sessions.append(model)
-
-                db_annotation.update(
-                    add_to_set__events=sessions,
-                    inc__milliseconds=total_time,
-                    set__isbbox=annotation.get('isbbox', False),
-                    set__keypoints=annotation.get('keypoints', []),
-                    set__metadata=annotation.get('metadata'),
-                    set__color=annotation.get('color')
-                )
-
+                    sessions.append(model.to_mongo())
+
+                annotation_update = {
+                    '$inc': {'milliseconds': total_time, 'version': 1},
+                    '$set': {
+                        'isbbox': annotation.get('isbbox', False),
+                        'keypoints': annotation.get('keypoints', []),
+                        'metadata': annotation.get('metadata'),
+                        'color': annotation.get('color')
+                    }
+                }
+                if sessions:
+                    annotation_update['$addToSet'] = {'events': {'$each': sessions}}
+
+                # Paperjs objects are complex, so they will not always be passed
                 paperjs_object = annotation.get('compoundPath', [])
-
-                # Update paperjs if it exists
                 if len(paperjs_object) == 2:
 
-                    width = db_annotation.width
-                    height = db_annotation.height
-
                     # Generate coco formatted segmentation data
-                    segmentation, area, bbox = coco_util.\
-                        paperjs_to_coco(width, height, paperjs_object)
-
-                    db_annotation.update(
-                        set__segmentation=segmentation,
-                        set__area=area,
-                        set__isbbox=annotation.get('isbbox', False),
-                        set__bbox=bbox,
-                        set__paper_object=paperjs_object,
-                    )
-
-                    if area > 0:
-                        annotated = True
+                    segmentation, area, bbox = coco_util.paperjs_to_coco(
+                        db_annotation.get('width'), db_annotation.get('height'), paperjs_object)
 
+                    annotation_update['$set'].update(
+                        segmentation=segmentation,
+                        area=area,
+                        bbox=bbox
+                    )
+                    # stored inline before paper objects had their own collection
+                    annotation_update['$unset'] = {'paper_object': ''}
+                    paper_objects[db_annotation['_id']] = paperjs_object
+                    db_annotation['area'] = area
+
+                annotation_filter = {'_id': db_annotation['_id']}
+                if version is not None:
+                    # compare-and-set, fails if another save got in since the annotation was loaded
+                    annotation_filter['version'] = {'$in': [0, None]} if version == 0 else version
+                annotation_updates.append(UpdateOne(annotation_filter, annotation_update))
+                versions[db_annotation['_id']] = db_annotation.get('version', 0) + 1
+
+        if category_updates:
+            CategoryModel._get_collection().bulk_write(category_updates, ordered=True)
+        if annotation_updates:
+            result = AnnotationModel._get_collection().bulk_write(annotation_updates, ordered=True)
+            if result.matched_count < len(annotation_updates):
+                # lost a race, reload the annotations to find out which updates were not applied
+                for db_annotation in AnnotationModel.objects(id__in=list(versions.keys()))\
+                        .only('id', 'area', 'deleted', 'version').as_pymongo():
+                    if db_annotation.get('version', 0) != versions[db_annotation['_id']]:
+                        del versions[db_annotation['_id']]
+                        conflicts.append(db_annotation['_id'])
+                    annotations[db_annotation['_id']].update(db_annotation)
+
+        # only after the annotations, so paper objects of conflicting annotations are left alone
+        PaperObjectModel.store({
+            annotation_id: paper_object for annotation_id, paper_object in paper_objects.items()
+            if annotation_id in versions
+        })
+
+        num_annotations = sum(
+            1 for annotation in annotations.values()
+            if not annotation.get('deleted', False) and annotation.get('area', 0) > 0
+        )
         image_model.update(
             set__metadata=image.get('metadata', {}),
-            set__annotated=annotated,
+            set__annotated=num_annotations > 0,
             set__category_ids=image.get('category_ids', []),
-            set__regenerate_thumbnail=True,
-            set__num_annotations=annotations\
-                .filter(deleted=False, area__gt=0).count()
+            set__num_annotations=num_annotations
         )
+        ImageModel.queue_thumbnails([image_model.id])
 
-        return {"success": True}
+        saved = [{'id': annotation_id, 'version': version} for annotation_id, version in versions.items()]
+        if conflicts:
+            return {
+                'success': False,
+                'message': 'Annotations were changed by someone else',
+                'saved': saved,
+                'conflicts': [
+                    {'id': annotation_id, 'version': annotations[annotation_id].get('version', 0)}
+                    for annotation_id in conflicts
+                ]
+            }, 409
+
+        return {'success': True, 'saved': saved}
 
 
 @api.route('/data/<int:image_id>')
 class AnnotatorId(Resource):
 
     @profile
+    @api.expect(image_data)
     @login_required
     def get(self, image_id):
         """ Called when loading from the annotator client """
+        args = image_data.parse_args()
         image = ImageModel.objects(id=image_id)\
             .exclude('events').first()
 
@@ -153,13 +238,15 @@ class AnnotatorId(Resource):
         if dataset is None:
             return {'success': False, 'message': 'Could not find associated dataset'}, 400
 
-        categories = CategoryModel.objects(deleted=False)\
-            .in_bulk(dataset.categories).items()
+        categories = CategoryModel.objects(id__in=dataset.categories, deleted=False).as_pymongo()
+        annotations = cached_annotations(image_id)
 
-        # Get next and previous image
-        images = ImageModel.objects(dataset_id=dataset.id, deleted=False)
-        pre = images.filter(file_name__lt=image.file_name).order_by('-file_name').first()
-        nex = images.filter(file_name__gt=image.file_name).order_by('file_name').first()
+        # Get next and previous image, within the folder being browsed if the image is in it
+        directory = None
+        folder = args.get('folder').strip('/')
+        if folder and image.path.startswith(os.path.join(dataset.directory, folder, '')):
+            directory = os.path.join(dataset.directory, folder, '')
+        previous_id, next_id = image.neighbours(args.get('order'), directory)
 
         preferences = {}
         if not Config.LOGIN_DISABLED:
@@ -177,21 +264,127 @@ class AnnotatorId(Resource):
             }
         }
 
-        data['image']['previous'] = pre.id if pre else None
-        data['image']['next'] = nex.id if nex else None
+        data['image']['previous'] = previous_id
+        data['image']['next'] = next_id
+        warm_images([data['image']['previous'], data['image']['next']])
 
+        category_defaults = query_util.field_defaults(CategoryModel)
         for category in categories:
-            category = query_util.fix_ids(category[1])
-
-            category_id = category.get('id')
-            annotations = AnnotationModel.objects(image_id=image_id, category_id=category_id, deleted=False)\
-                .exclude('events').all()
+            category = query_util.fix_pymongo_ids(category, category_defaults)
 
             category['show'] = True
             category['visualize'] = False
-            category['annotations'] = [] if annotations is None else query_util.fix_ids(annotations)
+            category['annotations'] = annotations.get(category.get('id'), [])
             data.get('categories').append(category)
 
         return data
 
 
+def load_annotations(image_id):
+    """
+    Loads annotations of all categories of an image at once
+
+    :return: (sorted tuple of annotation ids and versions, dict of category id to annotations)
+    """
+    annotation_defaults = query_util.field_defaults(AnnotationModel)
+    db_annotations = list(AnnotationModel.objects(image_id=image_id, deleted=False).exclude('events').as_pymongo())
+    paper_objects = PaperObjectModel.load(annotation['_id'] for annotation in db_annotations)
+    annotations = defaultdict(list)
+    for annotation in db_annotations:
+        annotation = query_util.fix_pymongo_ids(annotation, annotation_defaults)
+        # annotations saved before paper objects had their own collection still have them inline
+        annotation['paper_object'] = paper_objects.get(annotation['id'], annotation.get('paper_object', []))
+        annotations[annotation.get('category_id')].append(annotation)
+
+    signature = tuple(sorted((annotation['_id'], annotation.get('version', 0)) for annotation in db_annotations))
+    return signature, dict(annotations)
+
+
+def cached_annotations(image_id):
+    """
+    Returns annotations of an image grouped by category. Annotations loaded before, e.g. when the image was warmed,
+    are used as long as no annotation was added, removed or changed since, which only takes a query of ids and
+    versions. Every write of an annotation must therefore increment its version.
+    """
+    with _warmed_lock:
+        cached = _annotations.get(image_id)
+
+    if cached is not None and time.monotonic() - cached[0] < CACHED_ANNOTATIONS_TTL:
+        signature = tuple(sorted(
+            (annotation['_id'], annotation.get('version', 0)) for annotation in
+            AnnotationModel.objects(image_id=image_id, deleted=False).only('id', 'version').as_pymongo()
+        ))
+        if signature == cached[1]:
+            with _warmed_lock:
+                if image_id in _annotations:
+                    _annotations.move_to_end(image_id)
+            return cached[2]
+
+    signature, annotations = load_annotations(image_id)
+    _cache_annotations(image_id, signature, annotations)
+    return annotations
+
+
+def warm_images(image_ids):
+    """
+    Loads images the user is likely to open next into caches in background: file contents into page cache,
+    renditions of originals which are not sent as they are into rendition cache and their annotations, ready
+    to be sent, into `_annotations`
+    """
+    now = time.monotonic()
+    claimed = []
+    with _warmed_lock:
+        for image_id in image_ids:
+            if image_id is None or now - _warmed.get(image_id, -WARM_INTERVAL) < WARM_INTERVAL:
+                continue
+            _warmed[image_id] = now
+            _warmed.move_to_end(image_id)
+            claimed.append(image_id)
+        while len(_warmed) > MAX_WARMED_IMAGES:
+            _warmed.popitem(last=False)
+
+    if claimed:
+        # green thread, requests are served by eventlet workers
+        eventlet.spawn_n(_warm_images, claimed)
+
+
+def _warm_images(image_ids):
+    for image in ImageModel.objects(id__in=image_ids, deleted=False).only('id', 'path', 'width', 'height'):
+        try:
+            _read_ahead(image.path)
+            if pass_through_type(image, image.path, image.width, image.height) is None:
+                # encoding is CPU bound, a green thread would hold up every request of the worker
+                tpool.execute(rendition, image, image.path, image.width, image.height)
+            _cache_annotations(image.id, *load_annotations(image.id))
+        except Exception as e:
+            logger.warning(f'Could not warm image {image.id}: {e}')
+
+
+def _cache_annotations(image_id, signature, annotations):
+    global _annotations_bytes
+
+    size = len(json.dumps(annotations, default=str))
+    if size > MAX_CACHED_ANNOTATIONS_BYTES:
+        return
+
+    with _warmed_lock:
+        replaced = _annotations.pop(image_id, None)
+        if replaced is not None:
+            _annotations_bytes -= replaced[3]
+        _annotations[image_id] = (time.monotonic(), signature, annotations, size)
+        _annotations_bytes += size
+        while _annotations_bytes > MAX_CACHED_ANNOTATIONS_BYTES:
+            _annotations_bytes -= _annotations.popitem(last=False)[1][3]
+
+
+def _read_ahead(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if hasattr(os, 'posix_fadvise'):
+            # kernel reads the file asynchronously
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        else:
+            while os.read(fd, 1024 * 1024):
+                pass
+    finally:
+        os.close(fd)
@@ -8,7 +8,8 @@ from database import (
     DatasetModel,
     CategoryModel,
     AnnotationModel,
-    ExportModel
+    ExportModel,
+    PaperObjectModel
 )
 from flask import request
 from flask_login import login_required, current_user
@@ -157,7 +158,8 @@ class DatasetCleanMeta(Resource):
         if dataset is None:
             return {"message": "Invalid dataset id"}, 400
 
-        AnnotationModel.objects(dataset_id=dataset.id).update(metadata=dataset.default_annotation_metadata)
+        AnnotationModel.objects(dataset_id=dataset.id)\
+            .update(metadata=dataset.default_annotation_metadata, inc__version=1)
         ImageModel.objects(dataset_id=dataset.id).update(metadata={})
 
         return {'success': True}
@@ -173,11 +175,14 @@ class DatasetCleanAnnotations(Resource):
         if dataset is None:
             return {"message": "Invalid dataset id"}, 400
 
-        AnnotationModel.objects(dataset_id=dataset.id).delete()
+        annotations = AnnotationModel.objects(dataset_id=dataset.id)
+        PaperObjectModel.delete_many(annotations.scalar('id'))
+        annotations.delete()
         ImageModel.objects(dataset_id=dataset.id).update(
             set__annotated=False,
             set__num_annotations=0
         )
+        ImageModel.queue_thumbnails(ImageModel.objects(dataset_id=dataset.id, deleted=False).scalar('id'))
         return {'success': True}
 
 
@@ -234,6 +239,24 @@ class DatasetStats(Resource):
         return stats
 
 
+@api.route('/<int:dataset_id>/duplicates')
+class DatasetDuplicates(Resource):
+
+    @login_required
+    def get(self, dataset_id):
+        """ Groups of images in the dataset with identical content """
+        dataset = current_user.datasets.filter(id=dataset_id, deleted=False).first()
+        if dataset is None:
+            return {"message": "Invalid dataset id"}, 400
+
+        duplicates = ImageModel.duplicates(dataset.id)
+        return {
+            "groups": duplicates,
+            "duplicated_images": sum(group["count"] - 1 for group in duplicates),
+            "missing_digests": ImageModel.objects(dataset_id=dataset.id, deleted=False, sha256=None).count()
+        }
+
+
 @api.route('/<int:dataset_id>')
 class DatasetId(Resource):
 
@@ -280,7 +303,7 @@ class DatasetId(Resource):
 
             if len(update.keys()) > 0:
                 AnnotationModel.objects(dataset_id=dataset.id, deleted=False) \
-                    .update(**update)
+                    .update(inc__version=1, **update)
 
         dataset.update(
             categories=dataset.categories,
@@ -3,21 +3,46 @@ from flask_login import login_required, current_user
 from werkzeug.datastructures import FileStorage
 from flask import send_file
 
-from ..util import query_util, coco_util
+from ..util import query_util, coco_util, cache_util
+from ..util.rendition_cache import RenditionCache
+from config import Config
 from database import (
     ImageModel,
     DatasetModel,
     AnnotationModel
 )
+from workers.lib.image_pyramid import tile_path, visible_tiles
+from workers.lib.thumbnail_renderer import render_sprite
+from workers.lib.image_probe import exif_orientation
 
 from PIL import Image
 import datetime
+import hashlib
+import json
 import os
 import io
+import re
 
 
 api = Namespace('image', description='Image related operations')
 
+# JPEG quality of resized images
+IMAGE_QUALITY = 90
+# Formats browsers display, originals in these formats are not re-encoded
+PASS_THROUGH_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".bmp": "image/bmp"
+}
+
+renditions = RenditionCache(Config.RENDITION_CACHE_DIRECTORY, Config.RENDITION_CACHE_SIZE)
+
+# Largest number of images packed into a sprite sheet
+MAX_SPRITE_IMAGES = 200
+MAX_SPRITE_CELL_SIZE = 1024
+
 
 image_all = reqparse.RequestParser()
 image_all.add_argument('fields', required=False, type=str)
@@ -37,6 +62,19 @@ image_download.add_argument('thumbnail', type=bool, default=False)
 image_download.add_argument('width', type=int)
 image_download.add_argument('height', type=int)
 
+image_tiles = reqparse.RequestParser()
+image_tiles.add_argument('level', type=int, required=True, help='Pyramid level')
+image_tiles.add_argument('x', type=float, default=0, help='Left edge of region in pixels of the original image')
+image_tiles.add_argument('y', type=float, default=0, help='Upper edge of region in pixels of the original image')
+image_tiles.add_argument('width', type=float, required=True, help='Width of region in pixels of the original image')
+image_tiles.add_argument('height', type=float, required=True, help='Height of region in pixels of the original image')
+
+image_sprite = reqparse.RequestParser()
+image_sprite.add_argument('ids', type=str, required=True, help='Comma separated ids of images')
+image_sprite.add_argument('size', type=int, default=250, help='Width and height of a cell')
+image_sprite.add_argument('columns', type=int, default=10, help='Number of cells in a row')
+image_sprite.add_argument('thumbnail', type=bool, default=False)
+
 copy_annotations = reqparse.RequestParser()
 copy_annotations.add_argument('category_ids', location='json', type=list,
                               required=False, default=None, help='Categories to copy')
@@ -100,14 +138,114 @@ class Images(Resource):
             path=path
         )
 
-        image_model.save()
         pil_image.save(path)
+        # digest of the file as written, so uploads are found by duplicate detection
+        image_model.update_digest()
+        image_model.save()
+        image_model.flag_thumbnail()
 
         image.close()
         pil_image.close()
         return query_util.fix_ids(image_model)
 
 
+@api.route('/sprite')
+class ImageSprite(Resource):
+
+    @api.expect(image_sprite)
+    @login_required
+    def get(self):
+        """ Packs thumbnails of a page of images into a single sprite sheet """
+        args = image_sprite.parse_args()
+        size = args['size']
+        thumbnail = args['thumbnail']
+
+        try:
+            image_ids = [int(image_id) for image_id in args['ids'].split(',') if image_id]
+        except ValueError:
+            return {"message": "Invalid image ids"}, 400
+        if not 0 < len(image_ids) <= MAX_SPRITE_IMAGES:
+            return {"message": f"Between 1 and {MAX_SPRITE_IMAGES} images can be packed"}, 400
+        if not 0 < size <= MAX_SPRITE_CELL_SIZE:
+            return {"message": "Invalid size"}, 400
+        columns = args['columns']
+        if columns < 1:
+            return {"message": "Invalid number of columns"}, 400
+        columns = min(columns, len(image_ids))
+
+        # permissions are checked once for the whole batch
+        images = current_user.images.filter(id__in=image_ids, deleted=False) \
+            .only('id', 'path', 'regenerate_thumbnail', 'thumbnail_queued')
+        images = {image.id: image for image in images}
+
+        queued = []
+        paths = []
+        for image_id in image_ids:
+            image = images.get(image_id)
+            path = image.path if image is not None else None
+            if image is not None and thumbnail:
+                thumbnail_path = image.thumbnail_path()
+                if not os.path.isfile(thumbnail_path) or \
+                        (image.regenerate_thumbnail and image.thumbnail_queued is None):
+                    queued.append(image_id)
+                if os.path.isfile(thumbnail_path):
+                    path = thumbnail_path
+            paths.append(path)
+        ImageModel.queue_thumbnails(queued)
+
+        sources = []
+        for path in paths:
+            try:
+                sources.append(f"{path}@{os.stat(path).st_mtime_ns}" if path else "")
+            except OSError:
+                sources.append("")
+        # secret makes keys of sprite sheets impossible to guess for users without access to the images
+        key = hashlib.sha1(":".join(
+            [Config.SECRET_KEY, str(size), str(columns), str(IMAGE_QUALITY), *sources]
+        ).encode()).hexdigest()
+
+        sprite_path = renditions.sprite_path(key)
+        layout_path = renditions.get(sprite_path + ".json")
+        if layout_path is not None and renditions.get(sprite_path) is not None:
+            with open(layout_path) as f:
+                offsets = json.load(f)
+        else:
+            sprite, offsets = render_sprite(paths, size, columns)
+            sprite_io = io.BytesIO()
+            sprite.save(sprite_io, "JPEG", quality=IMAGE_QUALITY)
+            renditions.put(sprite_path, sprite_io.getvalue())
+            renditions.put(sprite_path + ".json", json.dumps(offsets).encode())
+
+        return {
+            "url": f"/api/image/sprite/{key}.jpg",
+            "width": columns * size,
+            "height": (len(image_ids) + columns - 1) // columns * size,
+            "images": [
+                {"id": image_id, "x": offset[0], "y": offset[1], "width": offset[2], "height": offset[3]}
+                for image_id, offset in zip(image_ids, offsets) if offset is not None
+            ]
+        }
+
+
+@api.route('/sprite/<string:key>.jpg')
+class ImageSpriteFile(Resource):
+
+    @login_required
+    def get(self, key):
+        """ Returns sprite sheet packed by a previous call """
+        if not re.fullmatch(r'[0-9a-f]{40}', key):
+            return {"message": "Invalid sprite"}, 400
+
+        sprite_path = renditions.get(renditions.sprite_path(key))
+        if sprite_path is None:
+            return {"message": "Sprite does not exist"}, 404
+
+        response = send_file(sprite_path, mimetype='image/jpeg', add_etags=False)
+        # sprite sheets are addressed by their content
+        response.headers['Cache-Control'] = 'private, max-age=31536000, immutable'
+        return response
+
+
 @api.route('/<int:image_id>')
 class ImageId(Resource):
 
@@ -131,17 +269,27 @@ class ImageId(Resource):
             width = image.width
         if not height:
             height = image.height
-        
-        pil_image = image.thumbnail() if thumbnail else Image.open(image.path)
-        image.flag_thumbnail(flag=False)
-        
-        pil_image.thumbnail((width, height), Image.ANTIALIAS)
-        image_io = io.BytesIO()
-        pil_image = pil_image.convert("RGB")
-        pil_image.save(image_io, "JPEG", quality=90)
-        image_io.seek(0)
 
-        return send_file(image_io, attachment_filename=image.file_name, as_attachment=as_attachment)
+        path = image.thumbnail_file() if thumbnail else None
+        if path is None:
+            # thumbnail is not generated yet, original image is shown in the meantime
+            path = image.path
+
+        etag, last_modified = cache_util.file_validators(
+            path, thumbnail, image.regenerate_thumbnail, width, height, IMAGE_QUALITY)
+        if cache_util.is_not_modified(etag, last_modified):
+            return cache_util.not_modified(etag, last_modified)
+
+        mimetype = pass_through_type(image, path, width, height)
+        if mimetype is not None:
+            # original bytes are sent as they are, with sendfile if gunicorn is configured to use it
+            response = send_file(path, mimetype=mimetype, add_etags=False,
+                                 attachment_filename=image.file_name, as_attachment=as_attachment)
+            return cache_util.set_validators(response, etag, last_modified)
+
+        response = send_file(rendition(image, path, width, height), mimetype='image/jpeg', add_etags=False,
+                             attachment_filename=image.file_name, as_attachment=as_attachment)
+        return cache_util.set_validators(response, etag, last_modified)
 
     @login_required
     def delete(self, image_id):
@@ -157,6 +305,76 @@ class ImageId(Resource):
         return {"success": True}
 
 
+@api.route('/<int:image_id>/pyramid')
+class ImagePyramid(Resource):
+
+    @login_required
+    def get(self, image_id):
+        """ Returns descriptor of tiled pyramid of the image, generation is queued if there is none """
+        image = current_user.images.filter(id=image_id, deleted=False).only('id', 'path').first()
+        if image is None:
+            return {"message": "Invalid image id"}, 400
+
+        descriptor = image.pyramid()
+        if descriptor is None:
+            return {"ready": False}, 202
+
+        return {"ready": True, **descriptor}
+
+
+@api.route('/<int:image_id>/tiles')
+class ImageTiles(Resource):
+
+    @api.expect(image_tiles)
+    @login_required
+    def get(self, image_id):
+        """ Returns URLs of tiles of pyramid level covering region of the image """
+        args = image_tiles.parse_args()
+        level = args['level']
+
+        image = current_user.images.filter(id=image_id, deleted=False).only('id', 'path').first()
+        if image is None:
+            return {"message": "Invalid image id"}, 400
+
+        descriptor = image.pyramid()
+        if descriptor is None:
+            return {"ready": False}, 202
+
+        if not 0 <= level <= descriptor['max_level']:
+            return {"message": "Invalid level"}, 400
+
+        tiles = visible_tiles(descriptor, level, args['x'], args['y'], args['width'], args['height'])
+        return {
+            "ready": True,
+            "level": level,
+            "tiles": [
+                {
+                    "column": column,
+                    "row": row,
+                    "url": f"/api/image/{image_id}/tiles/{level}/{column}_{row}.{descriptor['format']}"
+                }
+                for column, row in tiles
+            ]
+        }
+
+
+@api.route('/<int:image_id>/tiles/<int:level>/<int:column>_<int:row>.jpg')
+class ImageTile(Resource):
+
+    @login_required
+    def get(self, image_id, level, column, row):
+        """ Returns tile of pyramid of the image """
+        image = current_user.images.filter(id=image_id, deleted=False).only('id', 'path').first()
+        if image is None:
+            return {"message": "Invalid image id"}, 400
+
+        path = tile_path(image.pyramid_directory(), level, column, row)
+        if not os.path.isfile(path):
+            return {"message": "Tile does not exist"}, 404
+
+        return send_file(path, mimetype='image/jpeg')
+
+
 @api.route('/copy/<int:from_id>/<int:to_id>/annotations')
 class ImageCopyAnnotations(Resource):
 
@@ -206,3 +424,38 @@ class ImageCoco(Resource):
 
         return coco_util.get_image_coco(image_id)
 
+
+def pass_through_type(image, path, width, height):
+    """
+    :return: content type of original image if it can be sent without re-encoding, otherwise None
+    """
+    if path != image.path or width < image.width or height < image.height:
+        return None
+    content_type = PASS_THROUGH_TYPES.get(os.path.splitext(path)[1].lower())
+    # browsers apply EXIF orientation, annotations are in the pixel orientation the file is stored in
+    if content_type is not None and exif_orientation(path) != 1:
+        return None
+    return content_type
+
+
+def rendition(image, path, width, height):
+    """
+    Returns image resized to fit in width and height, from rendition cache if possible
+
+    :param path: path to original image or its thumbnail
+    :return: path to cached rendition or file object with the rendition
+    """
+    rendition_path = renditions.path(image.id, os.stat(path).st_mtime_ns, width, height, IMAGE_QUALITY,
+                                     variant="thumbnail" if path != image.path else "")
+    if renditions.get(rendition_path) is not None:
+        # streamed from disk
+        return rendition_path
+
+    pil_image = Image.open(path)
+    pil_image.thumbnail((width, height), Image.ANTIALIAS)
+    image_io = io.BytesIO()
+    pil_image = pil_image.convert("RGB")
+    pil_image.save(image_io, "JPEG", quality=IMAGE_QUALITY)
+    renditions.put(rendition_path, image_io.getvalue())
+    image_io.seek(0)
+    return image_io
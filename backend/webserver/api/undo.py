@@ -82,7 +82,10 @@ class Undo(Resource):
         if model_object is None:
             return {"message": "Invalid id"}, 400
 
-        model_object.update(set__deleted=False)
+        if isinstance(model_object, AnnotationModel):
+            model_object.update(set__deleted=False, inc__version=1)
+        else:
+            model_object.update(set__deleted=False)
 
         return {"success": True}
 
@@ -10,6 +10,7 @@ worker_class = 'eventlet'
 worker_connections = 1000
 timeout = 30
 keepalive = 2
+sendfile = Config.SENDFILE
 
 reload = Config.DEBUG
 preload = Config.PRELOAD
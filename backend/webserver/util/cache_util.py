@@ -0,0 +1,50 @@
+import datetime
+import hashlib
+import os
+
+from flask import request, make_response
+
+# Browsers keep responses but ask whether they are still valid before every use
+CACHE_CONTROL = "private, no-cache"
+
+
+def file_validators(path, *params):
+    """
+    Computes validators of response rendered from a file
+
+    :param path: Path to file response is rendered from
+    :param params: anything else the response depends on (e.g. requested size)
+    :return: (etag, last modified datetime)
+    """
+    stat = os.stat(path)
+    key = ":".join(str(value) for value in (path, stat.st_mtime_ns, stat.st_size, *params))
+    etag = hashlib.sha1(key.encode()).hexdigest()
+    last_modified = datetime.datetime.utcfromtimestamp(int(stat.st_mtime))
+    return etag, last_modified
+
+
+def is_not_modified(etag, last_modified):
+    """
+    :return: True if the client already has the response with given validators
+    """
+    if request.if_none_match:
+        return request.if_none_match.contains(etag)
+    if request.if_modified_since is not None:
+        return request.if_modified_since.replace(tzinfo=None) >= last_modified
+    return False
+
+
+def not_modified(etag, last_modified):
+    """
+    :return: 304 response with validators
+    """
+    return set_validators(make_response("", 304), etag, last_modified)
+
+
+def set_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    response.headers["Cache-Control"] = CACHE_CONTROL
+    # set by send_file, would let browsers skip revalidation
+    response.headers.pop("Expires", None)
+    return response
@@ -1,3 +1,4 @@
+import numpy as np
 import pycocotools.mask as mask
 
 from database import (
@@ -25,47 +26,49 @@ def paperjs_to_coco(image_width, image_height, paperjs):
     # Compute segmentation
     # paperjs points are relative to the center, so we must shift them relative to the top left.
     segments = []
-    center = [image_width/2, image_height/2]
+    center = np.array([image_width/2, image_height/2])
 
     if paperjs[0] == "Path":
         compound_path = {"children": [paperjs]}
     else:
         compound_path = paperjs[1]
-    
+
     children = compound_path.get('children', [])
 
     for child in children:
 
-        child_segments = child[1].get('segments', [])
-        segments_to_add = []
-
-        for point in child_segments:
-            
-            # Cruve
-            if len(point) == 4:
-                point = point[0]
-            
-            # Point
-            if len(point) == 2:
-                x = _fit(round(center[0] + point[0], 2), image_width, 0)
-                y = _fit(round(center[1] + point[1], 2), image_height, 0)
-                segments_to_add.extend([x, y])
+        points = _segment_points(child[1].get('segments', []))
+
+        # Flat [x1, y1, x2, y2, ...] coordinates inside of the image
+        coordinates = _round(points + center).ravel()
+        bounds = np.tile([image_width, image_height], len(points))
+        above = coordinates > bounds
+        below = coordinates < 0
+        coordinates[above] = bounds[above]
+        coordinates[below] = 0
 
         # Make sure shape is not all outside the image
-        if sum(segments_to_add) == 0:
+        if not coordinates.any():
             continue
 
-        if len(segments_to_add) == 4:
+        if coordinates.size == 4:
             # len 4 means this is a line with no width; it contributes
             # no area to the mask, and if we include it, coco will treat
             # it instead as a bbox (and throw an error)
             continue
 
-        num_widths = segments_to_add.count(image_width)
-        num_heights = segments_to_add.count(image_height)
-        if num_widths + num_heights == len(segments_to_add):
+        num_widths = np.count_nonzero(coordinates == image_width)
+        num_heights = np.count_nonzero(coordinates == image_height)
+        if num_widths + num_heights == coordinates.size:
             continue
 
+        segments_to_add = coordinates.tolist()
+        # clipped coordinates are stored as the image bounds themselves, not as floats
+        for index in np.flatnonzero(above):
+            segments_to_add[index] = image_width if index % 2 == 0 else image_height
+        for index in np.flatnonzero(below):
+            segments_to_add[index] = 0
+
         segments.append(segments_to_add)
 
     if len(segments) < 1:
@@ -232,5 +235,30 @@ def get_dataset_coco(dataset):
     return coco
 
 
-def _fit(value, max_value, min_value):
-    return max(min(value, max_value), min_value)
+def _segment_points(segments):
+    """
+    :param segments: paperjs segments, either points [x, y] or curves [[x, y], handle in, handle out, flags]
+    :return: n x 2 array of points, other segments are ignored
+    """
+    try:
+        points = np.array(segments, dtype=float)
+    except (ValueError, TypeError):
+        # mix of points and curves
+        points = None
+
+    if points is None or points.ndim != 2 or points.shape[1] != 2:
+        points = [segment[0] if len(segment) == 4 else segment for segment in segments]
+        points = np.array([point for point in points if len(point) == 2], dtype=float)
+
+    return points.reshape(-1, 2)
+
+
+def _round(values):
+    """
+    Rounds values to 2 decimals exactly like `round`, which numpy only approximates next to ties
+    """
+    rounded = np.round(values, 2)
+    scaled = values * 100
+    for index in zip(*np.nonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6)):
+        rounded[index] = round(float(values[index]), 2)
+    return rounded
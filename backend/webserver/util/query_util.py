@@ -1,11 +1,60 @@
+import copy
 import json
 
+from bson import json_util
+
 
 def fix_ids(objs):
     objects_list = json.loads(objs.to_json().replace('\"_id\"', '\"id\"'))
     return objects_list
 
 
+def field_defaults(model):
+    """
+    :return: default values of fields of model which have one
+    """
+    defaults = {}
+    for name, field in model._fields.items():
+        if name == 'id' or field.default is None:
+            continue
+        defaults[field.db_field] = field.default() if callable(field.default) else field.default
+    return defaults
+
+
+def fix_pymongo_ids(document, defaults=None):
+    """
+    Converts raw document (from `QuerySet.as_pymongo`) into the same JSON as `fix_ids` produces for its model
+    instance, without building the instance
+
+    :param document: raw document
+    :param defaults: default values of fields, from `field_defaults`
+    :return: JSON compatible dict
+    """
+    json_document = {}
+    for key, value in document.items():
+        # fields without value are left out like unset ones
+        if value is None:
+            continue
+        json_document['id' if key == '_id' else key] = _to_json(value)
+
+    for key, value in (defaults or {}).items():
+        if key not in json_document:
+            json_document[key] = copy.deepcopy(value)
+
+    return json_document
+
+
+def _to_json(value):
+    if isinstance(value, dict):
+        return {'id' if key == '_id' else key: _to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_json(item) for item in value]
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    # dates, object ids, ... in MongoDB extended JSON
+    return json_util.default(value)
+
+
 def td_format(td_object):
     seconds = int(td_object.total_seconds())
     periods = [
@@ -0,0 +1,145 @@
+"""
+Size bounded on-disk cache of resized images shared by all webserver processes.
+
+Entries are immutable files named after everything the rendition depends on, so a changed source image simply
+gets new entries and stale ones age out. Files are written to a temporary name and renamed into place, so
+readers never see partial files. Access time is recorded in file mtime, which lets any process evict least
+recently used entries once the cache exceeds its byte budget; eviction is done by one process at a time.
+"""
+import fcntl
+import os
+import tempfile
+import threading
+import time
+
+# Eviction removes entries until the cache is this fraction of its budget, so it does not run on every write
+EVICTION_TARGET = 0.9
+LOCK_NAME = ".lock"
+# Seconds after which temporary files are considered abandoned
+ABANDONED_AFTER = 60 * 60
+
+
+class RenditionCache:
+
+    def __init__(self, directory, max_bytes):
+        """
+        :param directory: Directory of cache, created if needed
+        :param max_bytes: Total size of cached files
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        # size of cache as seen by this process, synchronized with disk on every eviction
+        self._size = None
+        self._lock = threading.Lock()
+
+    def path(self, image_id, mtime, width, height, quality, variant=""):
+        """
+        :param mtime: modification time of source file in nanoseconds
+        :param variant: distinguishes renditions of different sources of the same image (e.g. thumbnails)
+        :return: path of entry, which may not exist
+        """
+        name = f"{image_id}_{mtime}_{width}x{height}_q{quality}{'_' + variant if variant else ''}.jpg"
+        return os.path.join(self.directory, f"{image_id % 256:02x}", name)
+
+    def sprite_path(self, key):
+        """
+        :param key: hex digest of everything the sprite sheet depends on
+        :return: path of entry, which may not exist
+        """
+        return os.path.join(self.directory, key[:2], f"sprite_{key}.jpg")
+
+    def get(self, path):
+        """
+        :return: path if entry exists, marking it as recently used, otherwise None
+        """
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def put(self, path, data):
+        """
+        Stores entry, replacing existing one
+
+        :param data: bytes of the rendition
+        """
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, temporary_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            _remove(temporary_path)
+            raise
+
+        with self._lock:
+            if self._size is not None:
+                self._size += len(data)
+            evict = self._size is None or self._size > self.max_bytes
+
+        if evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Removes least recently used entries until cache fits in its budget. Returns immediately if another process
+        is evicting.
+
+        :return: number of removed entries
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, LOCK_NAME), "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return 0
+
+            entries = list(self._entries())
+            size = sum(entry_size for _, entry_size, _ in entries)
+            removed = 0
+            if size > self.max_bytes:
+                target = self.max_bytes * EVICTION_TARGET
+                entries.sort()
+                for _, entry_size, path in entries:
+                    if size <= target:
+                        break
+                    _remove(path)
+                    size -= entry_size
+                    removed += 1
+
+        with self._lock:
+            self._size = size
+        return removed
+
+    def _entries(self):
+        """
+        :return: (last access, size, path) of every entry
+        """
+        for bucket in os.scandir(self.directory):
+            if not bucket.is_dir():
+                continue
+            for entry in os.scandir(bucket.path):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if entry.name.startswith("."):
+                    # temporary file, left behind if its writer died
+                    if stat.st_mtime < time.time() - ABANDONED_AFTER:
+                        _remove(entry.path)
+                    continue
+                yield stat.st_mtime_ns, stat.st_size, entry.path
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+__all__ = ["RenditionCache"]
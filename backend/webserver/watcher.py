@@ -4,20 +4,38 @@ from watchdog.observers import Observer
 from config import Config
 from database import ImageModel
 
+from collections import OrderedDict
+
 import re
+import threading
+import time
+
+PREFIX = "[File Watcher]"
+
+# Events are sent to workers at the latest this many seconds after the first of them
+MAX_DELAY = 10
+MAX_BATCH_SIZE = 5000
+
+CREATED = "created"
+MOVED = "moved"
+DELETED = "deleted"
 
 
 class ImageFolderHandler(FileSystemEventHandler):
 
-    PREFIX = "[File Watcher]"
+    PREFIX = PREFIX
 
-    def __init__(self, pattern=None):
+    def __init__(self, pattern=None, batcher=None):
         self.pattern = pattern or ImageModel.PATTERN
+        if batcher is None:
+            batcher = FileEventBatcher()
+            batcher.start()
+        self.batcher = batcher
 
     def on_any_event(self, event):
 
         path = event.dest_path if event.event_type == "moved" else event.src_path
-                
+
         if (
             event.is_directory
             # check if its a hidden file
@@ -25,25 +43,116 @@ class ImageFolderHandler(FileSystemEventHandler):
             or not path.lower().endswith(self.pattern)
         ):
             return
-        
-        self._log(f'File {path} for {event.event_type}')
-        
-        image = ImageModel.objects(path=event.src_path).first()
 
-        if image is None and event.event_type != 'deleted':
-            self._log(f'Adding new file to database: {path}')
-            ImageModel.create_from_path(path).save()
+        self.batcher.add(event.event_type, path, event.src_path)
+
+
+class FileEventBatcher:
+    """
+    Collects file events, keeping only the final state of every path, and sends them to workers in batches
+    once no new event arrived for `delay` seconds
+    """
+
+    def __init__(self, delay=None, max_delay=MAX_DELAY, max_batch_size=MAX_BATCH_SIZE, send=None):
+        self.delay = Config.FILE_WATCHER_DELAY if delay is None else delay
+        self.max_delay = max_delay
+        self.max_batch_size = max_batch_size
+        self.send = send or _send_to_workers
+
+        self._events = OrderedDict()
+        self._first_event = None
+        self._last_event = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="file-watcher-batcher", daemon=True)
+        self._thread.start()
+
+    def add(self, event_type, path, source=None):
+        """
+        :param event_type: watchdog event type
+        :param path: path of file after the event
+        :param source: path of file before the event, differs from path for moves only
+        """
+        with self._condition:
+            self._coalesce(event_type, path, source)
+
+            now = time.monotonic()
+            if self._first_event is None:
+                self._first_event = now
+            self._last_event = now
+            self._condition.notify()
+
+    def flush(self):
+        """
+        :return: collected events as list of [event type, path, source path], one per path
+        """
+        with self._condition:
+            events = list(self._events.values())
+            self._events.clear()
+            self._first_event = self._last_event = None
+        return events
+
+    def _coalesce(self, event_type, path, source):
+        events = self._events
+        if event_type == "moved":
+            previous = events.pop(source, None)
+            if previous is not None and previous[0] == CREATED:
+                # file not in database yet, create it under new path
+                event = [CREATED, path, None]
+            elif previous is not None and previous[0] == MOVED:
+                event = [MOVED, path, previous[2]]
+            else:
+                event = [MOVED, path, source]
+
+            if event[0] == MOVED and event[2] == path:
+                # moved back to where it was
+                events.pop(path, None)
+            else:
+                events[path] = event
+
+        elif event_type == "deleted":
+            previous = events.get(path)
+            if previous is not None and previous[0] == MOVED:
+                # image still has its original path in database
+                events[previous[2]] = [DELETED, previous[2], None]
+            events[path] = [DELETED, path, None]
+
+        else:
+            previous = events.get(path)
+            if previous is None or previous[0] != MOVED:
+                events[path] = [CREATED, path, None]
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._events:
+                    self._condition.wait()
+
+                while len(self._events) < self.max_batch_size:
+                    now = time.monotonic()
+                    deadline = min(self._last_event + self.delay, self._first_event + self.max_delay)
+                    if now >= deadline:
+                        break
+                    self._condition.wait(deadline - now)
+
+            events = self.flush()
+            try:
+                self.send(events)
+            except Exception as e:
+                _log(f"Could not process {len(events)} event(s): {e}")
+
+
+def _send_to_workers(events):
+    from workers.tasks import process_file_events
 
-        elif event.event_type == 'moved':
-            self._log(f'Moving image from {event.src_path} to {path}')
-            image.update(path=path)
+    _log(f"Sending {len(events)} event(s) to workers")
+    process_file_events.delay(events)
 
-        elif event.event_type == 'deleted':
-            self._log(f'Deleting image from database {path}')
-            ImageModel.objects(path=path).delete()
 
-    def _log(self, message):
-        print(f'{self.PREFIX} {message}', flush=True)
+def _log(message):
+    print(f'{PREFIX} {message}', flush=True)
 
 
 def run_watcher():
@@ -1,4 +1,5 @@
 from celery import Celery
+from celery.signals import worker_ready
 from config import Config
 from database import connect_mongo
 
@@ -9,8 +10,19 @@ celery = Celery(
     backend=Config.CELERY_RESULT_BACKEND,
     broker=Config.CELERY_BROKER_URL
 )
+celery.conf.task_routes = {
+    # thumbnails have their own queue, so a dedicated worker pool can keep up with them during long running tasks
+    'workers.tasks.thumbnails.*': {'queue': 'thumbnails'}
+}
 celery.autodiscover_tasks(['workers.tasks'])
 
 
+@worker_ready.connect
+def run_migrations(sender, **kwargs):
+    from .tasks import move_paper_objects
+    # Annotations saved before paper objects had their own collection
+    move_paper_objects.delay()
+
+
 if __name__ == '__main__':
     celery.start()
@@ -0,0 +1,34 @@
+"""
+Streaming content digest of files.
+
+Files are hashed in fixed size chunks read into a reused buffer, so hashing large images does not load them into
+memory at once. hashlib releases the GIL while hashing, so digests of many files can be computed in a thread pool.
+"""
+import hashlib
+
+DIGEST_ALGORITHM = "sha256"
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path, algorithm=DIGEST_ALGORITHM, chunk_size=CHUNK_SIZE):
+    """
+    Returns hex digest of content of file stored under given path
+
+    :param path: Path to file
+    :param algorithm: Name of hashlib algorithm
+    :param chunk_size: Number of bytes read at once
+    :return: hex digest, equal to `hashlib.new(algorithm, content).hexdigest()`
+    """
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        while True:
+            size = f.readinto(buffer)
+            if not size:
+                break
+            digest.update(view[:size])
+    return digest.hexdigest()
+
+
+__all__ = ["file_digest", "DIGEST_ALGORITHM"]
@@ -0,0 +1,162 @@
+"""
+Fast image dimension probe.
+
+Reads only the header of JPEG, PNG, GIF, BMP and TIFF files to find the size of an image instead of
+letting PIL open it. Results are memoized per path and modification time, so ingestors which reference
+the same frame many times (e.g. one row per annotation) pay for a single read.
+
+Formats which cannot be parsed from the header fall back to PIL.
+"""
+import os
+import struct
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+MAX_CACHE_SIZE = 200000
+# EXIF tag telling viewers to rotate or mirror the stored pixels, 1 means as stored
+EXIF_ORIENTATION = 0x0112
+
+# Start Of Frame markers carrying the frame size (DHT, JPG and DAC share the range but do not)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# Markers without a length field
+_JPEG_STANDALONE_MARKERS = {0x01, 0xD0, 0xD1, 0xD2, 0xD3, 0xD4, 0xD5, 0xD6, 0xD7, 0xD8, 0xD9}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def image_dimensions(path):
+    """
+    Returns dimensions of image stored under given path
+
+    :param path: Path to image file
+    :return: (width, height)
+    :raises FileNotFoundError: if file does not exist
+    :raises OSError: if file is not a readable image
+    """
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+
+    with _cache_lock:
+        cached = _cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _cache.move_to_end(path)
+            return cached[1]
+
+    dimensions = _read_dimensions(path)
+
+    with _cache_lock:
+        _cache[path] = (signature, dimensions)
+        _cache.move_to_end(path)
+        if len(_cache) > MAX_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+    return dimensions
+
+
+def exif_orientation(path):
+    """
+    :return: EXIF orientation of image, 1 if it has none
+    """
+    with Image.open(path) as image:
+        return image.getexif().get(EXIF_ORIENTATION, 1)
+
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
+
+
+def _read_dimensions(path):
+    with open(path, "rb") as f:
+        head = f.read(32)
+        try:
+            dimensions = _parse_header(f, head)
+        except (struct.error, ValueError):
+            dimensions = None
+
+    if dimensions is None or dimensions[0] <= 0 or dimensions[1] <= 0:
+        with Image.open(path) as image:
+            return image.width, image.height
+    return dimensions
+
+
+def _parse_header(f, head):
+    if head.startswith(b"\x89PNG\r\n\x1a\n") and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    if head[:2] == b"\xff\xd8":
+        return _parse_jpeg(f)
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return struct.unpack("<HH", head[6:10])
+    if head[:2] == b"BM":
+        return _parse_bmp(head)
+    if head[:4] in (b"II*\x00", b"MM\x00*"):
+        return _parse_tiff(f, head)
+    return None
+
+
+def _parse_jpeg(f):
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        if not byte:
+            return None
+        if byte != b"\xff":
+            continue
+        # Markers may be preceded by any number of fill bytes
+        marker = 0xFF
+        while marker == 0xFF:
+            byte = f.read(1)
+            if not byte:
+                return None
+            marker = byte[0]
+
+        if marker in _JPEG_STANDALONE_MARKERS or marker == 0x00:
+            continue
+        length = struct.unpack(">H", f.read(2))[0]
+        if marker in _JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">xHH", f.read(5))
+            return width, height
+        f.seek(length - 2, os.SEEK_CUR)
+
+
+def _parse_bmp(head):
+    header_size = struct.unpack("<I", head[14:18])[0]
+    if header_size == 12:
+        return struct.unpack("<HH", head[18:22])
+    width, height = struct.unpack("<ii", head[18:26])
+    # Negative height marks a top-down bitmap
+    return width, abs(height)
+
+
+def _parse_tiff(f, head):
+    endian = "<" if head[:2] == b"II" else ">"
+    ifd_offset = struct.unpack(endian + "I", head[4:8])[0]
+    f.seek(ifd_offset)
+    entry_count = struct.unpack(endian + "H", f.read(2))[0]
+    entries = f.read(entry_count * 12)
+
+    width = height = None
+    for i in range(entry_count):
+        tag, field_type, _, value = struct.unpack(endian + "HHI4s", entries[i * 12:(i + 1) * 12])
+        if tag not in (256, 257):
+            continue
+        if field_type == 3:
+            value = struct.unpack(endian + "H", value[:2])[0]
+        elif field_type == 4:
+            value = struct.unpack(endian + "I", value)[0]
+        else:
+            return None
+        if tag == 256:
+            width = value
+        else:
+            height = value
+
+    if width is None or height is None:
+        return None
+    return width, height
+
+
+__all__ = ["image_dimensions", "exif_orientation", "clear_cache"]
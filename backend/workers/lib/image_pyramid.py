@@ -0,0 +1,177 @@
+"""
+Deep zoom image pyramids.
+
+A pyramid stores an image as square JPEG tiles at every power of two scale, following the Deep Zoom layout used
+by OpenSeadragon: level `max_level` is the original resolution, every lower level halves it, down to level 0
+which is a single pixel. Tiles overlap their neighbours by `overlap` pixels so viewers can blend seams.
+
+    <directory>/pyramid.json            descriptor, written last, so its presence means the pyramid is complete
+    <directory>/<level>/<column>_<row>.jpg
+
+Pyramids are generated once per image, level by level from the largest one, so each level is decoded from the
+previous one instead of from the original file.
+"""
+import json
+import math
+import os
+import shutil
+
+from PIL import Image
+
+TILE_SIZE = 256
+TILE_OVERLAP = 1
+TILE_FORMAT = "jpg"
+TILE_QUALITY = 85
+
+DESCRIPTOR_NAME = "pyramid.json"
+DESCRIPTOR_VERSION = 1
+
+
+def max_level(width, height):
+    """
+    :return: level at which image has its original size
+    """
+    return int(math.ceil(math.log2(max(width, height, 1))))
+
+
+def level_size(width, height, level):
+    """
+    :return: (width, height) of image at given level
+    """
+    scale = 2 ** (max_level(width, height) - level)
+    return int(math.ceil(width / scale)), int(math.ceil(height / scale))
+
+
+def tile_bounds(level_width, level_height, column, row, tile_size=TILE_SIZE, overlap=TILE_OVERLAP):
+    """
+    :return: (left, upper, right, lower) box of tile in pixels of its level, including overlap
+    """
+    left = column * tile_size - (overlap if column > 0 else 0)
+    upper = row * tile_size - (overlap if row > 0 else 0)
+    right = min((column + 1) * tile_size + overlap, level_width)
+    lower = min((row + 1) * tile_size + overlap, level_height)
+    return left, upper, right, lower
+
+
+def tile_path(directory, level, column, row, tile_format=TILE_FORMAT):
+    return os.path.join(directory, str(level), f"{column}_{row}.{tile_format}")
+
+
+def load_descriptor(directory, mtime=None):
+    """
+    :param mtime: modification time of image, pyramids of older files are considered missing
+    :return: descriptor of complete pyramid stored in directory or None
+    """
+    try:
+        with open(os.path.join(directory, DESCRIPTOR_NAME)) as f:
+            descriptor = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if descriptor.get("version") != DESCRIPTOR_VERSION:
+        return None
+    if mtime is not None and descriptor.get("mtime") != mtime:
+        return None
+    return descriptor
+
+
+def generate_pyramid(path, directory, tile_size=TILE_SIZE, overlap=TILE_OVERLAP, quality=TILE_QUALITY):
+    """
+    Generates pyramid of image, replacing pyramid stored in directory
+
+    :param path: Path to image
+    :param directory: Directory of pyramid, created if needed
+    :return: descriptor of the pyramid
+    """
+    mtime = os.stat(path).st_mtime
+    parent = os.path.dirname(directory.rstrip("/"))
+    os.makedirs(parent, exist_ok=True)
+    # tiles are written to a separate directory, so requests never see a partially generated pyramid
+    temporary_directory = f"{directory.rstrip('/')}.{os.getpid()}"
+    shutil.rmtree(temporary_directory, ignore_errors=True)
+
+    # pyramids are meant for gigapixel images, which exceed PIL's decompression bomb limit
+    limit, Image.MAX_IMAGE_PIXELS = Image.MAX_IMAGE_PIXELS, None
+    try:
+        image = Image.open(path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+    image = image.convert("RGB")
+    width, height = image.size
+    top_level = max_level(width, height)
+
+    try:
+        for level in range(top_level, -1, -1):
+            level_width, level_height = level_size(width, height, level)
+            if image.size != (level_width, level_height):
+                image = image.resize((level_width, level_height), Image.LANCZOS)
+
+            level_directory = os.path.join(temporary_directory, str(level))
+            os.makedirs(level_directory)
+            columns = int(math.ceil(level_width / tile_size))
+            rows = int(math.ceil(level_height / tile_size))
+            for column in range(columns):
+                for row in range(rows):
+                    tile = image.crop(tile_bounds(level_width, level_height, column, row, tile_size, overlap))
+                    tile.save(tile_path(temporary_directory, level, column, row), "JPEG", quality=quality)
+
+        descriptor = {
+            "version": DESCRIPTOR_VERSION,
+            "mtime": mtime,
+            "width": width,
+            "height": height,
+            "tile_size": tile_size,
+            "overlap": overlap,
+            "format": TILE_FORMAT,
+            "max_level": top_level
+        }
+        with open(os.path.join(temporary_directory, DESCRIPTOR_NAME), "w") as f:
+            json.dump(descriptor, f)
+
+        _replace_directory(temporary_directory, directory)
+    except BaseException:
+        shutil.rmtree(temporary_directory, ignore_errors=True)
+        raise
+
+    return descriptor
+
+
+def visible_tiles(descriptor, level, x, y, width, height):
+    """
+    Lists tiles of level covering region of the original image
+
+    :param x, y, width, height: region in pixels of the original image
+    :return: list of (column, row)
+    """
+    image_width, image_height = descriptor["width"], descriptor["height"]
+    tile_size = descriptor["tile_size"]
+    scale = 2 ** (descriptor["max_level"] - level)
+    level_width, level_height = level_size(image_width, image_height, level)
+
+    left = max(0, int(x // scale))
+    upper = max(0, int(y // scale))
+    right = min(level_width, int(math.ceil((x + width) / scale)))
+    lower = min(level_height, int(math.ceil((y + height) / scale)))
+    if right <= left or lower <= upper:
+        return []
+
+    return [
+        (column, row)
+        for row in range(upper // tile_size, (lower - 1) // tile_size + 1)
+        for column in range(left // tile_size, (right - 1) // tile_size + 1)
+    ]
+
+
+def _replace_directory(source, destination):
+    destination = destination.rstrip("/")
+    trash = f"{destination}.old.{os.getpid()}"
+    try:
+        os.rename(destination, trash)
+    except FileNotFoundError:
+        trash = None
+    os.rename(source, destination)
+    if trash is not None:
+        shutil.rmtree(trash, ignore_errors=True)
+
+
+__all__ = ["generate_pyramid", "load_descriptor", "visible_tiles", "tile_path", "level_size", "max_level",
+           "tile_bounds"]
@@ -89,9 +89,10 @@ def create_tf_example(image,
     full_path = image["path"]
     with tf.gfile.GFile(full_path, "rb") as fid:
         encoded_jpg = fid.read()
+    # digest computed during scan is reused unless file changed since then
+    key = _stored_digest(image, full_path, len(encoded_jpg)) or hashlib.sha256(encoded_jpg).hexdigest()
     encoded_jpg_io = io.BytesIO(encoded_jpg)
     image = PIL.Image.open(encoded_jpg_io)
-    key = hashlib.sha256(encoded_jpg).hexdigest()
 
     xmin = []
     xmax = []
@@ -168,6 +169,16 @@ def create_tf_example(image,
     return key, example, num_annotations_skipped
 
 
+def _stored_digest(image, path, size):
+    """Returns digest of image stored in database if file is unchanged since it was computed."""
+    digest = image.get("sha256")
+    if digest is None or image.get("file_size") != size:
+        return None
+    if os.stat(path).st_mtime != image.get("file_mtime"):
+        return None
+    return digest
+
+
 def _create_tf_record_from_coco_annotations(
         task, groundtruth_data, dataset_dir, output_path, include_masks, num_shards):
     """Loads COCO annotation json files and converts to tf.Record format.
@@ -0,0 +1,106 @@
+"""
+Renders annotated thumbnails at the size of the thumbnail instead of the size of the image.
+
+JPEG images are decoded at reduced scale (draft mode lets the decoder skip DCT coefficients, producing an image
+1/2, 1/4 or 1/8 of the original size), and annotation polygons are scaled down and drawn directly onto the small
+canvas. Memory and time needed for a thumbnail therefore depend on the thumbnail size, not on the source size.
+"""
+from PIL import Image, ImageColor, ImageDraw
+
+# Opacity of annotation masks
+MASK_ALPHA = 0.5
+OUTLINE_WIDTH = 1
+
+
+def render_thumbnail(path, annotations, max_size, alpha=MASK_ALPHA, outline_width=OUTLINE_WIDTH):
+    """
+    Returns RGB thumbnail of image with annotations drawn on it
+
+    :param path: Path to image
+    :param annotations: iterable of (segmentation, color), where segmentation is a list of flat polygons
+                        [x1, y1, x2, y2, ...] in pixels of the original image and color a CSS color (e.g. "#ff0000")
+    :param max_size: (width, height) envelope the thumbnail fits in
+    :param alpha: opacity of masks
+    :param outline_width: width of polygon outlines in pixels of the thumbnail, 0 disables outlines
+    :return: PIL image
+    """
+    image = Image.open(path)
+    width, height = image.size
+
+    # decodes JPEGs at the smallest scale still larger than max_size, other formats ignore it
+    image.draft("RGB", max_size)
+    image = image.convert("RGB")
+    image.thumbnail(max_size)
+
+    scale_x = image.width / width
+    scale_y = image.height / height
+
+    overlay_alpha = int(round(255 * alpha))
+    for segmentation, color in annotations:
+        if not isinstance(segmentation, list):
+            # run-length encoded masks are not drawn
+            continue
+        polygons = [scale_polygon(polygon, scale_x, scale_y) for polygon in segmentation
+                    if isinstance(polygon, list) and len(polygon) >= 6]
+        if not polygons:
+            continue
+        color = ImageColor.getrgb(color) if color else (255, 255, 255)
+
+        mask = Image.new("L", image.size, 0)
+        mask_draw = ImageDraw.Draw(mask)
+        for polygon in polygons:
+            mask_draw.polygon(polygon, fill=overlay_alpha)
+        image.paste(color, mask=mask)
+
+        if outline_width:
+            draw = ImageDraw.Draw(image)
+            for polygon in polygons:
+                draw.line(polygon + polygon[:2], fill=color, width=outline_width)
+
+    return image
+
+
+def render_sprite(paths, cell_size, columns):
+    """
+    Packs thumbnails of images into a single sprite sheet, one image per square cell in row-major order. Images
+    are fitted in their cells and placed at their top left corners.
+
+    :param paths: paths to images, None leaves cell empty
+    :param cell_size: width and height of a cell
+    :param columns: number of cells in a row
+    :return: (RGB PIL image, list of (x, y, width, height) of every image, None for empty cells and images which
+             could not be read)
+    """
+    columns = max(1, min(columns, len(paths)))
+    rows = (len(paths) + columns - 1) // columns
+    sprite = Image.new("RGB", (columns * cell_size, max(rows, 1) * cell_size))
+
+    offsets = []
+    for index, path in enumerate(paths):
+        if path is None:
+            offsets.append(None)
+            continue
+        try:
+            thumbnail = render_thumbnail(path, [], (cell_size, cell_size))
+        except OSError:
+            offsets.append(None)
+            continue
+        x, y = (index % columns) * cell_size, (index // columns) * cell_size
+        sprite.paste(thumbnail, (x, y))
+        offsets.append((x, y, thumbnail.width, thumbnail.height))
+
+    return sprite, offsets
+
+
+def scale_polygon(polygon, scale_x, scale_y):
+    """
+    :param polygon: flat list of coordinates [x1, y1, x2, y2, ...]
+    :return: flat list of scaled coordinates
+    """
+    scaled = list(polygon)
+    scaled[0::2] = [x * scale_x for x in polygon[0::2]]
+    scaled[1::2] = [y * scale_y for y in polygon[1::2]]
+    return scaled
+
+
+__all__ = ["render_thumbnail", "render_sprite", "scale_polygon"]
@@ -1,9 +1,11 @@
+import itertools
 import json
 import os
 import sys
 from contextlib import redirect_stdout
 from .messenger import messenger
 from .vod_converter import converter
+from .vod_converter.labels_and_aliases import output_labels
 
 INGESTORS = [
     "mio",  # NOT tested
@@ -34,24 +36,31 @@ def check_coco(ann_file):
         return False, ann_file
 
 
-def convert_to_coco(ann_file, current_task):
-    to_key = "coco"
-    success = False
+def ingest_dataset(ann_file, current_task):
+    """
+    Finds ingestor able to read dataset stored under ann_file
+
+    :return: (generator of validated image detections with labels converted to `output_labels`, success)
+    """
     messenger.connect_task(current_task)
     for from_key in INGESTORS:
-        messenger.message(f"\nConverting from {from_key} to {to_key}.")
+        messenger.message(f"\nIngesting from {from_key}.")
         try:
-            success, encoded_labels = converter.convert(from_path=ann_file, to_path=None, ingestor_key=from_key,
-                                                        egestor_key=to_key,
-                                                        select_only_known_labels=False,
-                                                        filter_images_without_labels=True, folder_names=None)
+            success, image_detections = converter.ingest(from_path=ann_file, ingestor_key=from_key,
+                                                         expected_labels=output_labels,
+                                                         select_only_known_labels=False,
+                                                         filter_images_without_labels=True, folder_names=None)
+            if success:
+                # Ingestion is lazy, so make sure the format can actually be read before choosing this ingestor
+                first = next(image_detections, None)
+                if first is not None:
+                    image_detections = itertools.chain([first], image_detections)
         except:
             success = False
         if success:
-            messenger.message(f"Successfully converted from {from_key} to {to_key}.")
-            coco = encoded_labels
-            return coco, True
+            messenger.message(f"Successfully ingested from {from_key}.")
+            return image_detections, True
         else:
-            messenger.message(f"Failed to convert from {from_key} to {to_key}")
+            messenger.message(f"Failed to ingest from {from_key}")
 
     return None, False
@@ -16,11 +16,34 @@ class Ingestor:
     def ingest(self, path, folder_names):
         """
         Read in data from the filesytem.
+
+        Ingestors implement either this method or `iter_ingest`. By default the detections yielded by
+        `iter_ingest` are collected into a list.
+
         :param path: '/path/to/data/'
         :param folder_names: List of folders containing dataset
         :return: an array of dicts conforming to `IMAGE_DETECTION_SCHEMA`
         """
-        pass
+        if type(self).iter_ingest is Ingestor.iter_ingest:
+            raise NotImplementedError()
+        return list(self.iter_ingest(path, folder_names))
+
+    def iter_ingest(self, path, folder_names):
+        """
+        Read in data from the filesystem one image at a time.
+
+        Streaming ingestors override this method so that the whole dataset never has to be held in memory.
+        For list based ingestors this adapts the array returned by `ingest`.
+
+        :param path: '/path/to/data/'
+        :param folder_names: List of folders containing dataset
+        :return: a generator of dicts conforming to `IMAGE_DETECTION_SCHEMA`
+        """
+        if type(self).ingest is Ingestor.ingest:
+            raise NotImplementedError()
+        image_detections = self.ingest(path, folder_names)
+        if image_detections is not None:
+            yield from image_detections
 
 
 class Egestor:
@@ -41,9 +64,10 @@ class Egestor:
         Output data to the filesystem.
 
         Note: image_detections will already have any conversions specified via `expected_labels` applied
-        by the time they are passed to this method.
+        by the time they are passed to this method. They may be a lazy iterator, so egestors should consume
+        them in a single pass and write output incrementally.
 
-        :param image_detections: an array of dicts conforming to `IMAGE_DETECTION_SCHEMA`
+        :param image_detections: an iterable of dicts conforming to `IMAGE_DETECTION_SCHEMA`
         :param root: '/path/to/output/data/'
         """
         raise NotImplementedError()
@@ -45,7 +45,7 @@ person-fa - this label is quite the same as 'person?'
 import json
 import os
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 from workers.lib.messenger import message
 
 from .abstract import Ingestor
@@ -64,11 +64,10 @@ class CaltechIngestor(Ingestor):
             return False, f"Expected annotations.json file within {path}"
         return True, None
 
-    def ingest(self, path, folder_names):
+    def iter_ingest(self, path, folder_names):
         return self._get_image_detection(path, folder_names=folder_names)
 
     def _get_image_detection(self, root, folder_names):
-        annotations = []
         failed_loads = 0
         path = os.path.join(root, "annotations.json")
         with open(path) as f:
@@ -84,7 +83,7 @@ class CaltechIngestor(Ingestor):
 
                             image_id = f"{data_set_key}_{video_key}_{frame_key}"
                             image_path = os.path.join(root, "images", f"{image_id}.png")
-                            image_width, image_height = self._image_dimensions(image_path)
+                            image_width, image_height = image_dimensions(image_path)
 
                             detections = self._get_detections(frame_dict, image_id, image_width, image_height)
 
@@ -97,18 +96,18 @@ class CaltechIngestor(Ingestor):
                             single_img_detection["image"]["file_name"] = os.path.basename(image_path)
 
                             single_img_detection["detections"] = detections
-                            annotations.append(single_img_detection)
 
                         except Exception as e:
                             message(e)
                             failed_loads += 1
+                            continue
+                        yield single_img_detection
 
                     video_processed += 1
                     message(f"Processed {video_processed} videos in current set")
                 sets_processed += 1
                 message(f"Loaded {sets_processed} sets on {total_sets}...")
         message(f"Unable to load {failed_loads} images")
-        return annotations
 
     def _get_detections(self, frame, img_id, image_width, image_height):
         detections = []
@@ -133,8 +132,3 @@ class CaltechIngestor(Ingestor):
             except Exception as e:
                 message(e)
         return detections
-
-    @staticmethod
-    def _image_dimensions(path):
-        with Image.open(path) as image:
-            return image.width, image.height
@@ -31,13 +31,14 @@ class VocCityIngestor(Ingestor):
                 return False, f"Expected {chosen_set} to exist within {os.path.join(root, folder_names['sets'])}"
         return True, None
 
-    def ingest(self, path, folder_names=None):
+    def iter_ingest(self, path, folder_names=None):
         self.iii = 0
         self.detection_counter = 0
         if folder_names is None:
             folder_names = self.folder_names
         image_names = self._get_image_ids(path, folder_names)
-        return [self._get_image_detection(path, image_name, folder_names) for image_name in image_names]
+        for image_name in image_names:
+            yield self._get_image_detection(path, image_name, folder_names)
 
     def _get_image_ids(self, root, folder_names):
         if folder_names is None:
@@ -18,10 +18,14 @@ license{
 
 """
 import collections
+import io
 import json
+import math
 import os
+import shutil
+import tempfile
 
-from PIL import Image
+import numpy as np
 from pycocotools import mask
 from workers.lib.messenger import message
 
@@ -29,6 +33,9 @@ from .abstract import Ingestor, Egestor
 from .labels_and_aliases import output_labels
 from .validation_schemas import get_blank_detection_schema, get_blank_image_detection_schema
 
+# Images with fewer boxes have their areas computed without numpy, which is slower for small batches
+VECTORIZE_MIN_BOXES = 32
+
 
 class COCOIngestor(Ingestor):
     default_label_file = "labels.json"
@@ -45,7 +52,7 @@ class COCOIngestor(Ingestor):
             return False, f"Expected {self.default_label_file} file within {path}"
         return True, None
 
-    def ingest(self, path, folder_names):
+    def iter_ingest(self, path, folder_names):
         return self._get_image_detection(path, folder_names=folder_names)
 
     def _get_image_ids(self, root):
@@ -57,7 +64,6 @@ class COCOIngestor(Ingestor):
             return image_ids, coco_image_ids
 
     def _get_image_detection(self, root, folder_names):
-        image_detections = []
         path = os.path.join(root, self.default_label_file)
         with open(path) as f:
             data = json.load(f)
@@ -78,9 +84,7 @@ class COCOIngestor(Ingestor):
             single_img_detection["image"]["file_name"] = image_dict["file_name"]
             single_img_detection["detections"] = self._get_detections(
                 annotations_base[single_img_detection["image"]["id"]])
-            image_detections.append(single_img_detection)
-
-        return image_detections
+            yield single_img_detection
 
     def _get_detections(self, annotations_for_curr_img):
         detections = []
@@ -113,79 +117,117 @@ class COCOIngestor(Ingestor):
 
         return annotations_dict
 
-    @staticmethod
-    def _image_dimensions(path):
-        with Image.open(path) as image:
-            return image.width, image.height
-
 
 class COCOEgestor(Egestor):
     default_label_file = "labels.json"
+    spool_max_size = 64 * 1024 * 1024
 
     def expected_labels(self):
         return output_labels
 
     def egest(self, *, image_detections, root, folder_names):
-
+        """
+        Writes COCO labels incrementally to `labels.json` within root. If root is None labels are returned
+        as an encoded json string.
+        """
         message("Processing data by COCO Egestor...")
-        labels = {"images": [], "categories": self.generate_categories(), "annotations": []}
-        detection_counter = 0
+        if root is None:
+            out = io.StringIO()
+            self._write_labels(image_detections, out)
+            message("Finished egesting COCO")
+            return out.getvalue()
 
-        for i, image_detection in enumerate(image_detections):
-            if i % 100 == 0:
-                message(f"Processed {i} image detections")
-            image = image_detection["image"]
-            new_image = {
-                "id": i,
-                "dataset_id": None,
-                "path": image["path"],
-                "width": image["width"],
-                "height": image["height"],
-                "file_name": os.path.basename(image["path"])
-            }
-
-            labels["images"].append(new_image)
-
-            for detection in image_detection["detections"]:
-                category_id = next((category["id"] for category in labels["categories"]
-                                    if category["name"] == detection["label"]), None)
-                if category_id is None:
-                    message(f"No available category found: detection label = {detection['label']}")
-                    continue
-                new_detection = {"id": detection_counter}
-                detection_counter += 1
-                new_detection["image_id"] = new_image["id"]
-                new_detection["category_id"] = category_id
-                new_detection["iscrowd"] = detection["iscrowd"]
-                new_detection["isbbox"] = detection["isbbox"]
-                # Bbox = [x left upper corner, y left upper corner, width, height]
-                new_detection["bbox"] = [detection["left"], detection["top"], detection["right"] - detection["left"],
-                                         detection["bottom"] - detection["top"]]
-                if new_detection["isbbox"] == True and detection["segmentation"] is None:
-                    # segmentation from bbox = [x right upper corner, y right upper corner, x right lower corner,
-                    # y right lower corner, x left lower corner, y left lower corner, x left upper corner,
-                    # y left upper corner]
-                    new_detection["segmentation"] = [
-                        [detection["right"], detection["top"], detection["right"], detection["bottom"],
-                         detection["left"], detection["bottom"], detection["left"], detection["top"]]
-                    ]
-                else:
-                    new_detection["segmentation"] = detection["segmentation"]
-                detection["area"] = None
-                if detection["area"] is None:
-                    try:
-                        new_detection["area"] = int(sum(mask.area(mask.frPyObjects(
-                            new_detection["segmentation"], new_image["height"], new_image["width"]))))
-                    except Exception as e:
-                        message(f"Unable to automatically calculate area from segmentation: {e}")
-                        new_detection["area"] = 0
-
-                new_detection["keypoints"] = detection["keypoints"]
-                labels["annotations"].append(new_detection)
-        message("Saving json file...")
-        encoded_labels = json.dumps(labels)
+        os.makedirs(root, exist_ok=True)
+        with open(os.path.join(root, self.default_label_file), "w") as out:
+            self._write_labels(image_detections, out)
         message("Finished egesting COCO")
-        return encoded_labels
+
+    def _write_labels(self, image_detections, out):
+        """
+        Streams labels into out as {"images": [...], "categories": [...], "annotations": [...]}.
+        Annotations are spooled to a temporary file until all images have been written.
+        """
+        categories = self.generate_categories()
+        category_ids = {category["name"]: category["id"] for category in categories}
+        detection_counter = 0
+
+        out.write('{"images": [')
+        with tempfile.SpooledTemporaryFile(max_size=self.spool_max_size, mode="w+") as annotations_file:
+            for i, image_detection in enumerate(image_detections):
+                if i % 100 == 0:
+                    message(f"Processed {i} image detections")
+                image = image_detection["image"]
+                new_image = {
+                    "id": i,
+                    "dataset_id": None,
+                    "path": image["path"],
+                    "width": image["width"],
+                    "height": image["height"],
+                    "file_name": os.path.basename(image["path"])
+                }
+
+                if i > 0:
+                    out.write(", ")
+                out.write(json.dumps(new_image))
+
+                new_detections = self.create_annotations(image_detection["detections"], new_image, category_ids,
+                                                         first_id=detection_counter)
+                for new_detection in new_detections:
+                    if new_detection["id"] > 0:
+                        annotations_file.write(", ")
+                    annotations_file.write(json.dumps(new_detection))
+                detection_counter += len(new_detections)
+
+            message("Saving json file...")
+            out.write('], "categories": ')
+            out.write(json.dumps(categories))
+            out.write(', "annotations": [')
+            annotations_file.seek(0)
+            shutil.copyfileobj(annotations_file, out)
+        out.write("]}")
+
+    @staticmethod
+    def create_annotations(detections, image, category_ids, first_id=0):
+        """
+        Converts detections of a single image into COCO annotations
+
+        :param detections: list of detections conforming to `DETECTION_SCHEMA`
+        :param image: COCO image dict the detections belong to
+        :param category_ids: dict mapping label to category id
+        :param first_id: id of first created annotation
+        :return: list of COCO annotations
+        """
+        annotations = []
+        for detection in detections:
+            category_id = category_ids.get(detection["label"])
+            if category_id is None:
+                message(f"No available category found: detection label = {detection['label']}")
+                continue
+            new_detection = {"id": first_id + len(annotations)}
+            new_detection["image_id"] = image["id"]
+            new_detection["category_id"] = category_id
+            new_detection["iscrowd"] = detection["iscrowd"]
+            new_detection["isbbox"] = detection["isbbox"]
+            # Bbox = [x left upper corner, y left upper corner, width, height]
+            new_detection["bbox"] = [detection["left"], detection["top"], detection["right"] - detection["left"],
+                                     detection["bottom"] - detection["top"]]
+            if new_detection["isbbox"] == True and detection["segmentation"] is None:
+                # segmentation from bbox = [x right upper corner, y right upper corner, x right lower corner,
+                # y right lower corner, x left lower corner, y left lower corner, x left upper corner,
+                # y left upper corner]
+                new_detection["segmentation"] = [
+                    [detection["right"], detection["top"], detection["right"], detection["bottom"],
+                     detection["left"], detection["bottom"], detection["left"], detection["top"]]
+                ]
+            else:
+                new_detection["segmentation"] = detection["segmentation"]
+            # Area is always calculated from segmentation, see `_set_areas`
+            new_detection["area"] = 0
+            new_detection["keypoints"] = detection["keypoints"]
+            annotations.append(new_detection)
+
+        _set_areas(annotations, image["height"], image["width"])
+        return annotations
 
     def generate_categories(self):
         categories = []
@@ -193,3 +235,118 @@ class COCOEgestor(Egestor):
             curr_cat = {"id": i, "name": label, "supercategory": ""}
             categories.append(curr_cat)
         return categories
+
+
+def _set_areas(annotations, image_height, image_width):
+    """
+    Calculates areas of all annotations of a single image at once. Axis-aligned rectangles are computed in closed
+    form, remaining polygons are rasterized by a single pycocotools call.
+    """
+    boxes, box_annotations = [], []
+    polygons, polygon_owners, polygon_annotations = [], [], []
+    for annotation in annotations:
+        segmentation = annotation["segmentation"]
+        box = _axis_aligned_box(segmentation)
+        if box is not None:
+            boxes.append(box)
+            box_annotations.append(annotation)
+        elif _is_polygon_list(segmentation):
+            polygons.extend(segmentation)
+            polygon_owners.extend([len(polygon_annotations)] * len(segmentation))
+            polygon_annotations.append(annotation)
+        else:
+            _set_area(annotation, image_height, image_width)
+
+    if boxes:
+        try:
+            if len(boxes) < VECTORIZE_MIN_BOXES:
+                areas = [_box_area(box, image_height, image_width) for box in boxes]
+            else:
+                areas = _box_areas(boxes, image_height, image_width).tolist()
+        except (TypeError, ValueError):
+            for annotation in box_annotations:
+                _set_area(annotation, image_height, image_width)
+        else:
+            for annotation, area in zip(box_annotations, areas):
+                annotation["area"] = area
+
+    if polygons:
+        try:
+            areas = mask.area(mask.frPyObjects(polygons, image_height, image_width))
+            areas = np.bincount(polygon_owners, weights=areas, minlength=len(polygon_annotations))
+        except Exception:
+            # Let every annotation report its own error
+            for annotation in polygon_annotations:
+                _set_area(annotation, image_height, image_width)
+        else:
+            for annotation, area in zip(polygon_annotations, areas.tolist()):
+                annotation["area"] = int(area)
+
+
+def _set_area(annotation, image_height, image_width):
+    try:
+        annotation["area"] = int(sum(mask.area(mask.frPyObjects(
+            annotation["segmentation"], image_height, image_width))))
+    except Exception as e:
+        message(f"Unable to automatically calculate area from segmentation: {e}")
+        annotation["area"] = 0
+
+
+def _is_polygon_list(segmentation):
+    # pycocotools treats the whole list as polygons when first element has more than 4 coordinates
+    return isinstance(segmentation, list) and len(segmentation) > 0 and isinstance(segmentation[0], list) \
+        and len(segmentation[0]) > 4
+
+
+def _axis_aligned_box(segmentation):
+    """
+    :return: (left, top, right, bottom) if segmentation is a single axis-aligned rectangle, None otherwise
+    """
+    if not isinstance(segmentation, list) or len(segmentation) != 1:
+        return None
+    polygon = segmentation[0]
+    if not isinstance(polygon, list) or len(polygon) != 8:
+        return None
+    xs, ys = polygon[0::2], polygon[1::2]
+    vertical_first = xs[0] == xs[1] and ys[1] == ys[2] and xs[2] == xs[3] and ys[3] == ys[0]
+    horizontal_first = ys[0] == ys[1] and xs[1] == xs[2] and ys[2] == ys[3] and xs[3] == xs[0]
+    if not (vertical_first or horizontal_first):
+        return None
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _box_area(box, image_height, image_width):
+    """
+    Scalar version of `_box_areas`, cheaper for images with just a few boxes
+    """
+    left, top, right, bottom = (int(value * 5 + .5) for value in box)
+
+    columns = min(math.floor((right - 3) / 5), image_width - 1) - max(math.ceil((left - 2) / 5), 0) + 1
+    first_row = math.ceil(min(max((top + .5) / 5 - .5, 0), image_height))
+    last_row = math.ceil(min(max((bottom + .5) / 5 - .5, 0), image_height))
+
+    return max(columns, 0) * max(last_row - first_row, 0)
+
+
+def _box_areas(boxes, image_height, image_width):
+    """
+    Closed form of pycocotools polygon rasterization (rleFrPoly) for axis-aligned rectangles.
+
+    Polygons are upsampled 5 times and rounded, a column belongs to the mask when its centre lies between
+    the vertical edges, rows are counted between the rounded horizontal edges.
+
+    :param boxes: list of (left, top, right, bottom)
+    :return: array of areas
+    """
+    boxes = np.asarray(boxes, dtype=np.float64)
+    left, top, right, bottom = np.trunc(boxes * 5 + .5).T
+
+    first_column = np.maximum(np.ceil((left - 2) / 5), 0)
+    last_column = np.minimum(np.floor((right - 3) / 5), image_width - 1)
+    columns = np.maximum(last_column - first_column + 1, 0)
+
+    first_row = np.ceil(np.clip((top + .5) / 5 - .5, 0, image_height))
+    last_row = np.ceil(np.clip((bottom + .5) / 5 - .5, 0, image_height))
+    rows = np.maximum(last_row - first_row, 0)
+
+    return (columns * rows).astype(np.int64)
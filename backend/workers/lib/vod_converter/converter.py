@@ -3,16 +3,23 @@ Defines the protocol for converting too and from a common data format and execut
 the conversion, validating proper conversion along the way.
 
 For a given dataformat, e.g `voc.py`, if you wish to support reading in of your data format, define
-an `Ingestor` that can read in data from a path and return an array of data conforming to `IMAGE_DETECTION_SCHEMA`.
+an `Ingestor` that can read in data from a path and yield (`iter_ingest`) or return (`ingest`) data conforming
+to `IMAGE_DETECTION_SCHEMA`.
 
-If you wish to support data output, define an `Egestor` that, given an array of data of the same form,
+If you wish to support data output, define an `Egestor` that, given an iterable of data of the same form,
 can output the data to the filesystem.
 
+Image detections flow lazily from the ingestor through validation and label conversion into the egestor,
+so only the image currently being processed has to be held in memory.
+
 See `main.py` for the supported types, and `voc.py` and `kitti.py` for reference.
 """
 
-from jsonschema import validate as raw_validate
-from jsonschema.exceptions import ValidationError as SchemaError
+import collections
+import itertools
+
+import numpy as np
+from jsonschema import validators
 from workers.lib.messenger import message
 
 from .caltech import *
@@ -30,12 +37,19 @@ from .validation_schemas import IMAGE_DETECTION_SCHEMA
 from .voc import *
 
 
-def validate_schema(data, schema):
-    """Wraps default implementation but accepting tuples as arrays too.
+def _create_validator(schema):
+    """Compiles validator for schema once, accepting tuples as arrays too.
 
     https://github.com/Julian/jsonschema/issues/148
     """
-    return raw_validate(data, schema, types={"array": (list, tuple)})
+    validator_class = validators.validator_for(schema)
+    type_checker = validator_class.TYPE_CHECKER.redefine(
+        "array", lambda checker, instance: isinstance(instance, (list, tuple)))
+    return validators.extend(validator_class, type_checker=type_checker)(schema)
+
+
+IMAGE_DETECTION_VALIDATOR = _create_validator(IMAGE_DETECTION_SCHEMA)
+VALIDATION_BATCH_SIZE = 1000
 
 
 INGESTORS = {
@@ -76,57 +90,132 @@ def convert(*, from_path, ingestor_key, to_path, egestor_key, select_only_known_
     :param folder_names: List of folders' names that are passed to Egestor
     :return: (success, message)
     """
-    ingestor = INGESTORS[ingestor_key]
     egestor = EGESTORS[egestor_key]
+    success, image_detections = ingest(from_path=from_path, ingestor_key=ingestor_key,
+                                       expected_labels=egestor.expected_labels(),
+                                       select_only_known_labels=select_only_known_labels,
+                                       filter_images_without_labels=filter_images_without_labels,
+                                       folder_names=folder_names)
+    if not success:
+        return success, image_detections
+
+    encoded_labels = egestor.egest(image_detections=image_detections, root=to_path, folder_names=folder_names)
+    return True, encoded_labels
+
+
+def ingest(*, from_path, ingestor_key, expected_labels, select_only_known_labels, filter_images_without_labels,
+           folder_names):
+    """
+    Reads in data without egesting it, validating that it matches `IMAGE_DETECTION_SCHEMA`
+    and converting labels to `expected_labels`.
+
+    :param from_path: '/path/to/read/from'
+    :param ingestor_key: `Ingestor` to read in data
+    :param expected_labels: Dict with expected labels and their aliases, see `Egestor.expected_labels`
+    :param select_only_known_labels: Bool indicating if an annotation with unknown label should be kept
+    :param filter_images_without_labels: Bool indicating if an image detection without any annotation should be kept
+    :param folder_names: List of folders' names that are passed to Ingestor
+    :return: (success, generator of image detections) or (False, message)
+    """
+    ingestor = INGESTORS[ingestor_key]
     from_valid, from_msg = ingestor.validate(from_path, folder_names)
     if not from_valid:
         return from_valid, from_msg
 
-    image_detections = ingestor.ingest(from_path, folder_names)
+    image_detections = ingestor.iter_ingest(from_path, folder_names)
 
-    validate_image_detections(image_detections)
+    image_detections = validate_image_detections(image_detections)
 
     image_detections = convert_labels(
-        image_detections=image_detections, expected_labels=egestor.expected_labels(),
+        image_detections=image_detections, expected_labels=expected_labels,
         select_only_known_labels=select_only_known_labels,
         filter_images_without_labels=filter_images_without_labels)
 
-    encoded_labels = egestor.egest(image_detections=image_detections, root=to_path, folder_names=folder_names)
-    return True, encoded_labels
+    return True, image_detections
 
 
-def validate_image_detections(image_detections):
+def validate_image_detections(image_detections, batch_size=VALIDATION_BATCH_SIZE):
+    """
+    Lazily drops image detections which do not conform to `IMAGE_DETECTION_SCHEMA` or have invalid bounding boxes.
+    Detections are checked in batches and a summary of rejections grouped by reason is reported at the end.
+
+    :param image_detections: iterable of image detections
+    :param batch_size: Number of image detections whose bounding boxes are checked at once
+    :return: generator of valid image detections
+    """
     message("Validating...")
-    deleted_img_detections = 0
-    for i, image_detection in enumerate(image_detections):
-        if i % 100 == 0:
-            message(f"Validated {i} image detections")
-        try:
-            validate_schema(image_detection, IMAGE_DETECTION_SCHEMA)
-        except SchemaError as se:
-            message(se)
-            image_detections.remove(image_detection)
-            continue
-        image = image_detection["image"]
-        for detection in image_detection["detections"]:
-            if detection["isbbox"] is True:
-                try:
-                    if detection["right"] > image["width"]:
-                        raise ValueError(f"Image {image} has out of bounds bounding box {detection}")
-                    if detection["bottom"] > image["height"]:
-                        raise ValueError(f"Image {image} has out of bounds bounding box {detection}")
-                    if detection["right"] <= detection["left"] or detection["bottom"] <= detection["top"]:
-                        raise ValueError(f"Image {image} has zero dimension bbox {detection}")
-                except Exception as ve:
-                    message(ve)
-                    image_detections.remove(image_detection)
-                    deleted_img_detections += 1
-                    break
-    message(f"Deleted labels for {deleted_img_detections} images")
+    rejected = collections.Counter()
+    examples = {}
+    validated = 0
+
+    image_detections = iter(image_detections)
+    while True:
+        batch = list(itertools.islice(image_detections, batch_size))
+        if not batch:
+            break
+
+        schema_valid = []
+        for image_detection in batch:
+            error = next(IMAGE_DETECTION_VALIDATOR.iter_errors(image_detection), None)
+            if error is None:
+                schema_valid.append(image_detection)
+            else:
+                rejected["schema error"] += 1
+                examples.setdefault("schema error", error.message)
+
+        for image_detection, reason in zip(schema_valid, _find_invalid_bboxes(schema_valid)):
+            if reason is None:
+                yield image_detection
+            else:
+                rejected[reason] += 1
+                examples.setdefault(reason, image_detection["image"]["path"])
+
+        validated += len(batch)
+        message(f"Validated {validated} image detections")
+
+    message(f"Deleted labels for {sum(rejected.values())} images")
+    for reason, count in rejected.most_common():
+        message(f"{count} images rejected due to {reason}, e.g. {examples[reason]}")
+
+
+def _find_invalid_bboxes(image_detections):
+    """
+    Compares bounding boxes of all bbox detections in a batch against each other and their image sizes at once
+
+    :param image_detections: list of image detections conforming to `IMAGE_DETECTION_SCHEMA`
+    :return: list with reason of rejection (or None if valid) for every image detection
+    """
+    reasons = [None] * len(image_detections)
+    boxes = [
+        (index, detection["left"], detection["top"], detection["right"], detection["bottom"],
+         image_detection["image"]["width"], image_detection["image"]["height"])
+        for index, image_detection in enumerate(image_detections)
+        for detection in image_detection["detections"]
+        if detection["isbbox"] is True
+    ]
+    if not boxes:
+        return reasons
+
+    boxes = np.array(boxes, dtype=np.float64)
+    index = boxes[:, 0].astype(np.intp)
+    left, top, right, bottom, width, height = boxes[:, 1:].T
+
+    zero_dimension = (right <= left) | (bottom <= top)
+    out_of_bounds = (right > width) | (bottom > height)
+    # Out of bounds takes precedence when image has both kinds of invalid bboxes
+    for reason, invalid in (("zero dimension bbox", zero_dimension), ("out of bounds bbox", out_of_bounds)):
+        for i in np.unique(index[invalid]):
+            reasons[i] = reason
+    return reasons
 
 
 def convert_labels(*, image_detections, expected_labels,
                    select_only_known_labels, filter_images_without_labels):
+    """
+    Lazily maps detection labels onto `expected_labels` of the egestor
+
+    :return: generator of image detections with converted labels
+    """
     message("Converting labels...")
     convert_dict = {}
     for label, aliases in expected_labels.items():
@@ -134,7 +223,6 @@ def convert_labels(*, image_detections, expected_labels,
         for alias in aliases:
             convert_dict[alias.lower()] = label
 
-    final_image_detections = []
     for i, image_detection in enumerate(image_detections):
         if i % 100 == 0:
             message(f"Converted {i} labels")
@@ -150,10 +238,8 @@ def convert_labels(*, image_detections, expected_labels,
                     detection["label"] = final_label
                     detections.append(detection)
             image_detection["detections"] = detections
-            if detections:
-                final_image_detections.append(image_detection)
-            elif not filter_images_without_labels:
-                final_image_detections.append(image_detection)
         except Exception as e:
             message(e)
-    return final_image_detections
+            continue
+        if detections or not filter_images_without_labels:
+            yield image_detection
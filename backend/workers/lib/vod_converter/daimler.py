@@ -27,7 +27,7 @@ Ingestor for DAIMLER formats.
 import json
 import os
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 from workers.lib.messenger import message
 
 from .abstract import Ingestor
@@ -73,7 +73,7 @@ class DAIMLERIngestor(Ingestor):
                     detections = [det for det in detections if
                                   det["left"] < det["right"] and det["top"] < det["bottom"]]
                     try:
-                        image_width, image_height = _image_dimensions(image_path)
+                        image_width, image_height = image_dimensions(image_path)
                     except FileNotFoundError as e:
                         message(e)
                         continue
@@ -117,11 +117,6 @@ class DAIMLERIngestor(Ingestor):
         return detections
 
 
-def _image_dimensions(path):
-    with Image.open(path) as image:
-        return image.width, image.height
-
-
 def file_base_name(file_name):
     if "." in file_name:
         separator_index = file_name.index(".")
@@ -1,7 +1,7 @@
 import os
 import xml.etree.ElementTree as ET
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 
 from .abstract import Ingestor
 from .validation_schemas import get_blank_detection_schema, get_blank_image_detection_schema
@@ -20,12 +20,11 @@ class DETRACIngestor(Ingestor):
                 return False, f"Expected subdirectory {subdir} within {path}"
         return True, None
 
-    def ingest(self, path, folder_names):
+    def iter_ingest(self, path, folder_names):
         return self._get_image_detection(path, folder_names=folder_names)
 
     def _get_image_detection(self, root, folder_names):
         lab_dirs = ["DETRAC-Train-Annotations-XML", "DETRAC-Test-Annotations-XML"]
-        img_det = []
         for lab_type in lab_dirs:
             directory = os.path.join(root, lab_type)
             for lab in os.scandir(directory):
@@ -38,7 +37,7 @@ class DETRACIngestor(Ingestor):
                     no_frame = frame.attrib["num"]
                     img_name = f"img{'0' * (5 - len(str(no_frame)))}{no_frame}"
                     try:
-                        im_width, im_height = self._image_dimensions(os.path.join(directory, mov_name, f"{img_name}.jpg"))
+                        im_width, im_height = image_dimensions(os.path.join(directory, mov_name, f"{img_name}.jpg"))
                     except:
                         im_width, im_height = 10000, 10000
                     for target in frame:
@@ -69,10 +68,4 @@ class DETRACIngestor(Ingestor):
                         img["image"]["width"] = im_width
                         img["image"]["height"] = im_height
                         img["image"]["file_name"] = f"{img_name}.jpg"
-                        img_det.append(img)
-        return img_det
-
-    @staticmethod
-    def _image_dimensions(path):
-        with Image.open(path) as image:
-            return image.width, image.height
+                        yield img
@@ -0,0 +1,161 @@
+"""
+Materializes image files of egested datasets.
+
+Files are linked instead of copied whenever source and destination share a filesystem: a reflink (copy-on-write
+clone) is tried first, then a hardlink. Otherwise files are copied by a pool of threads, so egestors only pay
+for queueing the copy. Which method works is remembered per pair of devices, so unsupported methods are tried
+once per export, not once per file.
+"""
+import errno
+import os
+import shutil
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# ioctl cloning whole file on Linux, see ioctl_ficlone(2)
+FICLONE = 0x40049409
+
+REFLINK = "reflink"
+HARDLINK = "hardlink"
+COPY = "copy"
+
+DEFAULT_MAX_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+# Errors meaning the method is not available for given pair of filesystems, not that the file is broken
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL,
+                       errno.EMLINK, errno.ENOSYS, errno.EBADF}
+
+
+class FileMaterializer:
+    """
+    Context manager placing files in egested dataset. All files are in place when the block exits, the first
+    error of any of them is raised there.
+
+        with FileMaterializer() as files:
+            files.materialize(source, destination)
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, methods=(REFLINK, HARDLINK, COPY)):
+        """
+        :param max_workers: number of threads copying files
+        :param methods: methods tried in order, `COPY` should be last as it is always supported
+        """
+        self.max_workers = max_workers
+        self.methods = methods
+        self.counts = {method: 0 for method in methods}
+        self._methods_by_devices = {}
+        self._directory_devices = {}
+        self._lock = threading.Lock()
+        # limits number of pending copies, so whole dataset is not queued in memory
+        self._pending = threading.BoundedSemaphore(max_workers * 4)
+        self._errors = []
+        self._executor = None
+
+    def __enter__(self):
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._executor.shutdown(wait=True)
+        if exc_type is None and self._errors:
+            raise self._errors[0]
+        return False
+
+    def materialize(self, source, destination):
+        """
+        Places file `source` under `destination`, replacing existing file. Nothing is done if destination already
+        is the source file, e.g. hardlinked by an earlier export.
+
+        :raises FileNotFoundError: if source does not exist
+        """
+        if _same_file(source, destination):
+            return
+
+        devices = (os.stat(source).st_dev, self._directory_device(os.path.dirname(destination)))
+        with self._lock:
+            methods = self._methods_by_devices.setdefault(devices, list(self.methods))
+
+        while methods[0] != COPY:
+            method = methods[0]
+            try:
+                _link(source, destination, method)
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED_ERRNOS:
+                    raise
+                with self._lock:
+                    if methods[0] == method:
+                        methods.pop(0)
+                continue
+            self._count(method)
+            return
+
+        self._pending.acquire()
+        try:
+            self._executor.submit(self._copy, source, destination)
+        except BaseException:
+            self._pending.release()
+            raise
+
+    def _copy(self, source, destination):
+        try:
+            _replace(source, destination, shutil.copyfile)
+            self._count(COPY)
+        except Exception as e:
+            with self._lock:
+                self._errors.append(e)
+        finally:
+            self._pending.release()
+
+    def _count(self, method):
+        with self._lock:
+            self.counts[method] += 1
+
+    def _directory_device(self, directory):
+        device = self._directory_devices.get(directory)
+        if device is None:
+            device = self._directory_devices[directory] = os.stat(directory or ".").st_dev
+        return device
+
+
+def _same_file(source, destination):
+    try:
+        return os.path.samefile(source, destination)
+    except FileNotFoundError:
+        return False
+
+
+def _link(source, destination, method):
+    if method not in (HARDLINK, REFLINK):
+        raise ValueError(f"Unknown method {method}")
+
+    _replace(source, destination, os.link if method == HARDLINK else _reflink)
+
+
+def _replace(source, destination, place):
+    """
+    Places file under a temporary name with `place(source, temporary)` and renames it into place, so a failure
+    never leaves a broken destination behind and a destination still linked to another file is never written to
+    """
+    temporary = f"{destination}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        place(source, temporary)
+        os.replace(temporary, destination)
+    except BaseException:
+        try:
+            os.unlink(temporary)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def _reflink(source, destination):
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.ENOSYS, "Reflinks are only supported on Linux")
+    import fcntl
+
+    with open(source, "rb") as src, open(destination, "xb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+__all__ = ["FileMaterializer", "REFLINK", "HARDLINK", "COPY"]
@@ -30,12 +30,12 @@ each row corresponds to one object. The 15 columns represent:
 
 import csv
 import os
-import shutil
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 from workers.lib.messenger import message
 
 from .abstract import Ingestor, Egestor
+from .file_materializer import FileMaterializer
 from .labels_and_aliases import output_labels
 
 
@@ -52,16 +52,15 @@ class KITTIIngestor(Ingestor):
             return False, f"Expected train.txt file within {path}"
         return True, None
 
-    def ingest(self, path, folder_names):
+    def iter_ingest(self, path, folder_names):
         image_ids = self._get_image_ids(path)
         image_ext = "png"
         if len(image_ids):
             first_image_id = image_ids[0]
             image_ext = self.find_image_ext(path, first_image_id)
-        tmp = [self._get_image_detection(path, image_name, image_ext=image_ext, folder_names=folder_names) for
-               image_name in image_ids]
-        message(f"size: {len(tmp)}")
-        return tmp
+        message(f"size: {len(image_ids)}")
+        for image_name in image_ids:
+            yield self._get_image_detection(path, image_name, image_ext=image_ext, folder_names=folder_names)
 
     @staticmethod
     def find_image_ext(root, image_id):
@@ -82,7 +81,7 @@ class KITTIIngestor(Ingestor):
             detections = self._get_detections(detections_fpath, image_id)
             detections = [det for det in detections if det["left"] < det["right"] and det["top"] < det["bottom"]]
             image_path = os.path.join(root, "images", f"{image_id}.{image_ext}")
-            image_width, image_height = _image_dimensions(image_path)
+            image_width, image_height = image_dimensions(image_path)
             return {
                 "image": {
                     "id": image_id,
@@ -127,11 +126,6 @@ class KITTIIngestor(Ingestor):
         return detections
 
 
-def _image_dimensions(path):
-    with Image.open(path) as image:
-        return image.width, image.height
-
-
 DEFAULT_TRUNCATED = 0.0  # 0% truncated
 DEFAULT_OCCLUDED = 0  # fully visible
 
@@ -148,31 +142,36 @@ class KITTIEgestor(Egestor):
         os.makedirs(labels_dir, exist_ok=True)
         id_file = os.path.join(root, "train.txt")
 
-        for image_detection in image_detections:
-            image = image_detection["image"]
-            image_id = image["id"]
-            src_extension = os.path.splitext(image["path"])[-1]
-            try:
-                shutil.copyfile(image["path"], os.path.join(images_dir, f"{image_id}{src_extension}"))
-            except FileNotFoundError as e:
-                message(e)
-                continue
-
-            with open(id_file, "a") as out_image_index_file:
-                out_image_index_file.write(f"{image_id}\n")
-
-            out_labels_path = os.path.join(labels_dir, f"{image_id}.txt")
-            with open(out_labels_path, "w") as csvfile:
-                csvwriter = csv.writer(csvfile, delimiter=" ", quoting=csv.QUOTE_MINIMAL)
-
-                for detection in image_detection["detections"]:
-                    kitti_row = [-1] * 15
-                    kitti_row[0] = detection["label"]
-                    kitti_row[1] = DEFAULT_TRUNCATED
-                    kitti_row[2] = DEFAULT_OCCLUDED
-                    x1 = detection["left"]
-                    x2 = detection["right"]
-                    y1 = detection["top"]
-                    y2 = detection["bottom"]
-                    kitti_row[4:8] = x1, y1, x2, y2
-                    csvwriter.writerow(kitti_row)
+        image_ids = []
+        with FileMaterializer() as files:
+            for image_detection in image_detections:
+                image = image_detection["image"]
+                image_id = image["id"]
+                src_extension = os.path.splitext(image["path"])[-1]
+                try:
+                    files.materialize(image["path"], os.path.join(images_dir, f"{image_id}{src_extension}"))
+                except FileNotFoundError as e:
+                    message(e)
+                    continue
+
+                image_ids.append(f"{image_id}\n")
+
+                out_labels_path = os.path.join(labels_dir, f"{image_id}.txt")
+                with open(out_labels_path, "w") as csvfile:
+                    csvwriter = csv.writer(csvfile, delimiter=" ", quoting=csv.QUOTE_MINIMAL)
+
+                    for detection in image_detection["detections"]:
+                        kitti_row = [-1] * 15
+                        kitti_row[0] = detection["label"]
+                        kitti_row[1] = DEFAULT_TRUNCATED
+                        kitti_row[2] = DEFAULT_OCCLUDED
+                        x1 = detection["left"]
+                        x2 = detection["right"]
+                        y1 = detection["top"]
+                        y2 = detection["bottom"]
+                        kitti_row[4:8] = x1, y1, x2, y2
+                        csvwriter.writerow(kitti_row)
+        message(f"Egested {len(image_ids)} images: {files.counts}")
+
+        with open(id_file, "a") as out_image_index_file:
+            out_image_index_file.writelines(image_ids)
@@ -53,7 +53,7 @@ import os
 import re
 from collections import defaultdict
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 
 from .abstract import Ingestor
 
@@ -71,17 +71,15 @@ class KITTITrackingIngestor(Ingestor):
                 return False, f"Expected subdirectory {subdir} within {path}"
         return True, None
 
-    def ingest(self, path):
+    def iter_ingest(self, path, folder_names=None):
         fs = os.listdir(os.path.join(path, "label_02"))
         label_fnames = [f for f in fs if LABEL_F_PATTERN.match(f)]
-        image_detections = []
         for label_fname in label_fnames:
             frame_name = path_base_name(label_fname)
             labels_path = os.path.join(path, "label_02", label_fname)
             images_dir = os.path.join(path, "image_02", frame_name)
-            image_detections.extend(
-                self._get_track_image_detections(frame_name=frame_name, labels_path=labels_path, images_dir=images_dir))
-        return image_detections
+            yield from self._get_track_image_detections(frame_name=frame_name, labels_path=labels_path,
+                                                        images_dir=images_dir)
 
     def _get_track_image_detections(self, *, frame_name, labels_path, images_dir):
         detections_by_frame = defaultdict(list)
@@ -92,11 +90,18 @@ class KITTITrackingIngestor(Ingestor):
                 x1, y1, x2, y2 = map(float, row[6:10])
                 label = row[2]
                 detections_by_frame[frame_id].append({
+                    "id": f"{frame_name}-{row[1]}",
+                    "image_id": f"{frame_name}-{frame_id:06d}",
                     "label": label,
                     "left": x1,
                     "right": x2,
                     "top": y1,
-                    "bottom": y2
+                    "bottom": y2,
+                    "area": None,
+                    "segmentation": None,
+                    "isbbox": True,
+                    "iscrowd": False,
+                    "keypoints": []
                 })
 
         image_detections = []
@@ -105,27 +110,27 @@ class KITTITrackingIngestor(Ingestor):
             image_path = os.path.join(images_dir, f"{frame_id:06d}.png")
             if not os.path.exists(image_path):
                 image_path = os.path.join(images_dir, f"{frame_id:06d}.jpg")
-            with Image.open(image_path) as image:
-                image_width = image.width
-                image_height = image.height
-
-                def clamp_bbox(det):
-                    if det["right"] > image_width - 1:
-                        det["right"] = image_width - 1
-                    if det["bottom"] > image_height - 1:
-                        det["bottom"] = image_height - 1
-                    return det
-
-                image_detections.append({
-                    "image": {
-                        "id": f"{frame_name}-{frame_id:06d}",
-                        "path": image_path,
-                        "segmented_path": None,
-                        "width": image.width,
-                        "height": image.height
-                    },
-                    "detections": [clamp_bbox(det) for det in frame_dets]
-                })
+            image_width, image_height = image_dimensions(image_path)
+
+            def clamp_bbox(det):
+                if det["right"] > image_width - 1:
+                    det["right"] = image_width - 1
+                if det["bottom"] > image_height - 1:
+                    det["bottom"] = image_height - 1
+                return det
+
+            image_detections.append({
+                "image": {
+                    "id": f"{frame_name}-{frame_id:06d}",
+                    "dataset_id": None,
+                    "path": image_path,
+                    "segmented_path": None,
+                    "width": image_width,
+                    "height": image_height,
+                    "file_name": os.path.basename(image_path)
+                },
+                "detections": [clamp_bbox(det) for det in frame_dets]
+            })
         return image_detections
 
 
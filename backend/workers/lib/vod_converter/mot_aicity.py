@@ -9,7 +9,7 @@ import csv
 import os
 import traceback
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 from workers.lib.messenger import message
 
 from .abstract import Ingestor
@@ -121,8 +121,8 @@ class MOT_AICITYIngestor(Ingestor):
     @staticmethod
     def _image_dimensions(path):
         try:
-            with Image.open(path) as image:
-                return True, image.width, image.height
+            width, height = image_dimensions(path)
+            return True, width, height
         except FileNotFoundError as e:
             message(e)
             return False, -1, -1
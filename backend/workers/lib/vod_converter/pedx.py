@@ -4,7 +4,7 @@
 import json
 import os
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 
 from .abstract import Ingestor
 from .validation_schemas import get_blank_detection_schema, get_blank_image_detection_schema
@@ -45,7 +45,7 @@ class PEDXIngestor(Ingestor):
             detcs[im_name] = []
             im_name_seg = im_name.split("_")
             image_path = os.path.join(path_imgs, im_name_seg[0], im_name_seg[1], f"{im_name}.jpg")
-            image_width[im_name], image_height[im_name] = self._image_dimensions(image_path)
+            image_width[im_name], image_height[im_name] = image_dimensions(image_path)
         for date in os.scandir(path_labs):
             for lab in os.scandir(date):
                 with open(lab.path) as file_lab:
@@ -117,8 +117,3 @@ class PEDXIngestor(Ingestor):
                 list_keypoints.append(0)
                 list_keypoints.append(0)
         return list_keypoints, no_keypoints
-
-    @staticmethod
-    def _image_dimensions(path):
-        with Image.open(path) as image:
-            return image.width, image.height
@@ -3,7 +3,7 @@ import csv
 import glob
 import os
 
-from PIL import Image
+from workers.lib.image_probe import image_dimensions
 from workers.lib.messenger import message
 
 from .abstract import Ingestor
@@ -25,12 +25,11 @@ class TownCentreIngestor(Ingestor):
             return False, f"Expected {self.default_label_file} file within {path}"
         return True, None
 
-    def ingest(self, path, folder_names):
+    def iter_ingest(self, path, folder_names):
         self.detection_counter = 0
         return self._get_image_detection(path, folder_names=folder_names)
 
     def _get_image_detection(self, root, folder_names):
-        image_detections = []
         annotations_base = self._create_annotations_base(root)
 
         for i, image_path in enumerate(glob.glob(os.path.join(root, "images", "*.png"))):
@@ -43,14 +42,13 @@ class TownCentreIngestor(Ingestor):
             single_img_detection["image"]["dataset_id"] = None
             single_img_detection["image"]["path"] = image_path
             single_img_detection["image"]["segmented_path"] = None
-            img_width, img_height = self._image_dimensions(image_path)
+            img_width, img_height = image_dimensions(image_path)
             single_img_detection["image"]["width"] = img_width
             single_img_detection["image"]["height"] = img_height
             single_img_detection["image"]["file_name"] = img_file_name
             single_img_detection["detections"] = self._get_detections(annotations_base, img_name, img_width, img_height)
 
-            image_detections.append(single_img_detection)
-        return image_detections
+            yield single_img_detection
 
     def _create_annotations_base(self, root):
         labels_path = os.path.join(root, self.default_label_file)
@@ -95,11 +93,6 @@ class TownCentreIngestor(Ingestor):
             detections_for_curr_img.append(curr_detection)
         return detections_for_curr_img
 
-    @staticmethod
-    def _image_dimensions(path):
-        with Image.open(path) as image:
-            return image.width, image.height
-
 
 def file_base_name(file_name):
     if "." in file_name:
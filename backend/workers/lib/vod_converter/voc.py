@@ -6,7 +6,6 @@ http://host.robots.ox.ac.uk/pascal/VOC/voc2012/htmldoc/index.html
 
 import glob
 import os
-import shutil
 import xml.etree.ElementTree as ElementTree
 
 import numpy as np
@@ -16,6 +15,7 @@ from skimage import measure
 from workers.lib.messenger import message
 
 from .abstract import Ingestor, Egestor
+from .file_materializer import FileMaterializer
 from .labels_and_aliases import output_labels
 from .validation_schemas import get_blank_image_detection_schema, get_blank_detection_schema
 
@@ -38,13 +38,14 @@ class VOCIngestor(Ingestor):
                 return False, f"Expected subdirectory {subdir}"
         return True, None
 
-    def ingest(self, path, folder_names=None):
+    def iter_ingest(self, path, folder_names=None):
         self.iii = 0
         self.detection_counter = 0
         if folder_names is None:
             folder_names = self.folder_names
         image_names = self._get_image_ids(path, folder_names)
-        return [self._get_image_detection(path, image_name, folder_names) for image_name in image_names]
+        for image_name in image_names:
+            yield self._get_image_detection(path, image_name, folder_names)
 
     @staticmethod
     def _get_image_ids(root, folder_names):
@@ -208,60 +209,70 @@ class VOCEgestor(Egestor):
         return output_labels
 
     def egest(self, *, image_detections, root, folder_names):
+        if folder_names is None:
+            folder_names = VOCIngestor.folder_names
         image_sets_path = os.path.join(root, "ImageSets", "Main")
         images_path = os.path.join(root, folder_names["images"])
         annotations_path = os.path.join(root, folder_names["annotations"])
         segmentations_path = os.path.join(root, "SegmentationObject")
-        segmentations_dir_created = False
 
         for to_create in [image_sets_path, images_path, annotations_path]:
             os.makedirs(to_create, exist_ok=True)
-        for image_detection in image_detections:
-            image = image_detection["image"]
-            image_id = image["id"]
-            src_extension = os.path.splitext(image["path"])[-1]
-            shutil.copyfile(image["path"], os.path.join(images_path, f"{image_id}{src_extension}"))
-
-            with open(os.path.join(image_sets_path, "trainval.txt"), "a") as out_image_index_file:
-                out_image_index_file.write(f"{image_id}\n")
-
-            if image["segmented_path"] is not None:
-                if not segmentations_dir_created:
-                    os.makedirs(segmentations_path)
-                    segmentations_dir_created = True
-                shutil.copyfile(image["segmented_path"], os.path.join(segmentations_path, f"{image_id}.png"))
-
-            xml_root = ElementTree.Element("annotation")
-            add_text_node(xml_root, "filename", f"{image_id}{src_extension}")
-            add_text_node(xml_root, "folder", os.path.basename(root))
-            add_text_node(xml_root, "segmented", int(segmentations_dir_created))
-
-            add_sub_node(xml_root, "size", {
-                "depth": 3,
-                "width": image["width"],
-                "height": image["height"]
+        image_ids = []
+        with FileMaterializer() as files:
+            for image_detection in image_detections:
+                image_id = self._egest_image(image_detection, root, images_path, annotations_path,
+                                             segmentations_path, files)
+                image_ids.append(f"{image_id}\n")
+        message(f"Egested {len(image_ids)} images: {files.counts}")
+
+        with open(os.path.join(image_sets_path, "trainval.txt"), "a") as out_image_index_file:
+            out_image_index_file.writelines(image_ids)
+
+    @staticmethod
+    def _egest_image(image_detection, root, images_path, annotations_path, segmentations_path, files):
+        image = image_detection["image"]
+        image_id = image["id"]
+        src_extension = os.path.splitext(image["path"])[-1]
+        files.materialize(image["path"], os.path.join(images_path, f"{image_id}{src_extension}"))
+
+        segmented = image["segmented_path"] is not None
+        if segmented:
+            os.makedirs(segmentations_path, exist_ok=True)
+            files.materialize(image["segmented_path"], os.path.join(segmentations_path, f"{image_id}.png"))
+
+        xml_root = ElementTree.Element("annotation")
+        add_text_node(xml_root, "filename", f"{image_id}{src_extension}")
+        add_text_node(xml_root, "folder", os.path.basename(root))
+        add_text_node(xml_root, "segmented", int(segmented))
+
+        add_sub_node(xml_root, "size", {
+            "depth": 3,
+            "width": image["width"],
+            "height": image["height"]
+        })
+        add_sub_node(xml_root, "source", {
+            "annotation": "Dummy",
+            "database": "Dummy",
+            "image": "Dummy"
+        })
+
+        for detection in image_detection["detections"]:
+            x_object = add_sub_node(xml_root, "object", {
+                "name": detection["label"],
+                "difficult": 0,
+                "occluded": 0,
+                "truncated": 0,
+                "pose": "Unspecified"
             })
-            add_sub_node(xml_root, "source", {
-                "annotation": "Dummy",
-                "database": "Dummy",
-                "image": "Dummy"
+            add_sub_node(x_object, "bndbox", {
+                "xmin": detection["left"] + 1,
+                "xmax": detection["right"] + 1,
+                "ymin": detection["top"] + 1,
+                "ymax": detection["bottom"] + 1
             })
-
-            for detection in image_detection["detections"]:
-                x_object = add_sub_node(xml_root, "object", {
-                    "name": detection["label"],
-                    "difficult": 0,
-                    "occluded": 0,
-                    "truncated": 0,
-                    "pose": "Unspecified"
-                })
-                add_sub_node(x_object, "bndbox", {
-                    "xmin": detection["left"] + 1,
-                    "xmax": detection["right"] + 1,
-                    "ymin": detection["top"] + 1,
-                    "ymax": detection["bottom"] + 1
-                })
-            ElementTree.ElementTree(xml_root).write(os.path.join(annotations_path, f"{image_id}.xml"))
+        ElementTree.ElementTree(xml_root).write(os.path.join(annotations_path, f"{image_id}.xml"))
+        return image_id
 
 
 def add_sub_node(node, name, kvs):
@@ -1,4 +1,7 @@
 
 from .data import *
 from .test import *
-from .scan import *
\ No newline at end of file
+from .scan import *
+from .files import *
+from .thumbnails import *
+from .paper_objects import *
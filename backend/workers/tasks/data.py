@@ -5,9 +5,11 @@ import zipfile
 from datetime import datetime
 
 import numpy as np
+import imantics as im
 from celery import shared_task
 from database import (
     fix_ids,
+    reserve_ids,
     ImageModel,
     CategoryModel,
     AnnotationModel,
@@ -15,7 +17,10 @@ from database import (
     TaskModel,
     ExportModel
 )
-from workers.lib import convert_to_coco
+from pymongo import UpdateOne
+from workers.lib import ingest_dataset
+from workers.lib.vod_converter.coco import COCOEgestor
+from workers.lib.vod_converter.labels_and_aliases import output_labels
 from workers.lib.tf_models.create_tf_record_from_coco import convert_coco_to_tfrecord
 from workers.lib.vod_converter.split_labels_from_json_string import split_coco_labels
 
@@ -68,7 +73,7 @@ def export_annotations_to_tf_record(task_id, dataset_id, categories, validation_
 
     # Getting coco annotations
     task.info("===== Getting COCO labels =====")
-    coco, category_names = collect_coco_annotations(task, categories, dataset, socket)
+    coco, category_names = collect_coco_annotations(task, categories, dataset, socket, digests=True)
 
     out_directory = f"{dataset.directory}.exports/"
     image_dir = f"{dataset.directory}"
@@ -98,10 +103,12 @@ def export_annotations_to_tf_record(task_id, dataset_id, categories, validation_
     task.set_progress(100, socket=socket)
 
 
-def collect_coco_annotations(task, categories, dataset, socket):
+def collect_coco_annotations(task, categories, dataset, socket, digests=False):
     """
     Getting all coco labels from current dataset and creating a dict from it
 
+    :param digests: include stored content digests of images ("sha256", "file_size", "file_mtime")
+
     :return: COCO labels from current dataset as dict with fields: "images", "categories",
     "annotations".
     """
@@ -110,7 +117,7 @@ def collect_coco_annotations(task, categories, dataset, socket):
     db_categories = CategoryModel.objects(id__in=categories, deleted=False) \
         .only(*CategoryModel.COCO_PROPERTIES)
     db_images = ImageModel.objects(deleted=False, dataset_id=dataset.id) \
-        .only(*ImageModel.COCO_PROPERTIES)
+        .only(*ImageModel.COCO_PROPERTIES, *(["sha256", "file_size", "file_mtime"] if digests else []))
     db_annotations = AnnotationModel.objects(deleted=False, category_id__in=categories)
     total_items = db_categories.count()
 
@@ -329,7 +336,7 @@ def import_annotations(task_id, dataset_id, encoded_coco_json):
 
             image_categories.append(category_id)
         else:
-            annotation_model.update(deleted=False, isbbox=isbbox)
+            annotation_model.update(deleted=False, isbbox=isbbox, inc__version=1)
             task.info(f"Annotation already exists (i:{image_id}, c:{category_id}) "
                       f"({annotation_counter+1}/{total_annotations})")
 
@@ -344,6 +351,7 @@ def import_annotations(task_id, dataset_id, encoded_coco_json):
             set__category_ids=list(set(all_category_ids)),
             set__num_annotations=AnnotationModel.objects(image_id=image_model.id, area__gt=0, deleted=False).count()
         )
+    ImageModel.queue_thumbnails(images_id)
 
     task.set_progress(100, socket=socket)
 
@@ -399,15 +407,19 @@ def load_annotation_files(task_id, dataset_id, coco_json_strings, dataset_name):
 
 @shared_task
 def convert_dataset(task_id, dataset_id, coco_json, dataset_name):
+    """
+    Reads dataset stored in any supported format and imports its annotations in batches, without
+    encoding them as intermediate COCO json
+    """
     task = TaskModel.objects.get(id=task_id)
-    max_json_string_size = 32000000
+    dataset = DatasetModel.objects.get(id=dataset_id)
 
     task.update(status="PROGRESS")
     socket = create_socket()
     task.info("===== Beginning Conversion =====")
     task.set_progress(0, socket=socket)
     task.info('Trying to import your dataset...')
-    coco_json, success = convert_to_coco(coco_json, task)
+    image_detections, success = ingest_dataset(coco_json, task)
 
     if not success:
         task.info('Format not supported')
@@ -416,34 +428,191 @@ def convert_dataset(task_id, dataset_id, coco_json, dataset_name):
         return
     task.set_progress(50, socket=socket)
 
-    task.info(f"Checking size of json string, max size = {max_json_string_size}")
-    json_string_size = sys.getsizeof(coco_json)
-    task.info(f"Json string size = {json_string_size}")
-
-    if json_string_size > max_json_string_size:
-        task.info("Json string to large")
-        task.info("===== Splitting json string =====")
-        list_of_json_strings = split_coco_labels(coco_json, max_byte_size=max_json_string_size, current_task=task)
-    else:
-        task.info("Correct size of json string")
-        list_of_json_strings = [coco_json]
-
-    task.set_progress(75, socket=socket)
-
-    task.info("===== Outsourcing import annotations tasks to other workers =====")
-    for i, json_substring in enumerate(list_of_json_strings):
-        load_annotations_task = TaskModel(
-            name="Import COCO format into {}".format(dataset_name),
-            dataset_id=dataset_id,
-            group="Annotation Import"
-        )
-        load_annotations_task.save()
-        task.info(f"Sending json subfile to worker {i}")
-        cel_test_task = import_annotations.delay(load_annotations_task.id, dataset_id, json_substring)
+    # ingestion is lazy, so the number of image detections is unknown; most files describe every image once
+    expected_images = max(ImageModel.objects(dataset_id=dataset.id, deleted=False).count(), 1)
+
+    def progress(imported):
+        task.set_progress(50 + 49 * min(imported / expected_images, 1), socket=socket)
+
+    task.info(f"===== Importing annotations into {dataset_name} =====")
+    if not import_image_detections(task, dataset, image_detections, progress=progress):
+        task.update(failed=True)
 
     task.set_progress(100, socket=socket)
     task.info("===== Finished =====")
 
 
+IMPORT_BATCH_SIZE = 500
+
+
+def import_image_detections(task, dataset, image_detections, batch_size=IMPORT_BATCH_SIZE, progress=None):
+    """
+    Imports image detections into dataset. Images are matched by file name and every batch is written
+    with a fixed number of queries, regardless of how many annotations it holds.
+
+    :param task: TaskModel used for logging
+    :param dataset: DatasetModel the annotations are imported to
+    :param image_detections: iterable of image detections conforming to `IMAGE_DETECTION_SCHEMA`
+                             with labels from `output_labels`
+    :param batch_size: number of image detections handled at once
+    :param progress: called with number of image detections handled so far after every batch
+    :return: False if image detections could not be read to the end, batches before the error stay imported
+    """
+    task.info("===== Importing Categories =====")
+    categories_id = {}
+    for category_name in output_labels:
+        category_model = CategoryModel.objects(name__iexact=category_name).first()
+        if category_model is None:
+            task.warning(f"{category_name} category not found in Database Categories (creating a new one)")
+            category_model = CategoryModel(name=category_name)
+            category_model.save()
+
+        if category_model.id not in dataset.categories:
+            task.warning(f"{category_name} category not found in Dataset categories (adding a new one)")
+            dataset.categories.append(category_model.id)
+        categories_id[category_name] = category_model.id
+    dataset.update(set__categories=dataset.categories)
+
+    task.info("===== Import Annotations =====")
+    total_images = total_annotations = handled = 0
+    batch = []
+    try:
+        # image detections are parsed and validated while they are read, so errors can come up at any point
+        for image_detection in image_detections:
+            batch.append(image_detection)
+            if len(batch) == batch_size:
+                images, annotations = _import_batch(task, dataset, batch, categories_id)
+                total_images, total_annotations = total_images + images, total_annotations + annotations
+                handled += len(batch)
+                batch = []
+                if progress is not None:
+                    progress(handled)
+        if batch:
+            images, annotations = _import_batch(task, dataset, batch, categories_id)
+            total_images, total_annotations = total_images + images, total_annotations + annotations
+    except Exception as e:
+        task.error(f"Import failed after {total_annotations} annotations were imported to {total_images} images: {e}")
+        return False
+
+    task.info(f"Imported {total_annotations} annotations to {total_images} images")
+    return True
+
+
+def _import_batch(task, dataset, image_detections, categories_id):
+    """
+    :return: (number of matched images, number of created annotations)
+    """
+    file_names = [os.path.basename(image_detection["image"]["path"]) for image_detection in image_detections]
+    images_by_name = {}
+    for image in ImageModel.objects(dataset_id=dataset.id, file_name__in=file_names) \
+            .only("id", "file_name", "width", "height", "category_ids"):
+        images_by_name.setdefault(image.file_name, []).append(image)
+
+    # annotations of every matched image, with category ids already mapped to the database
+    annotations_by_image = {}
+    for file_name, image_detection in zip(file_names, image_detections):
+        image_models = images_by_name.get(file_name, [])
+        if len(image_models) == 0:
+            task.warning(f"Could not find image {file_name}")
+            continue
+        if len(image_models) > 1:
+            task.error(f"Too many images found with the same file name: {file_name}")
+            continue
+        image_model = image_models[0]
+
+        annotations = []
+        image = {"id": image_model.id, "width": image_model.width, "height": image_model.height}
+        for annotation in COCOEgestor.create_annotations(image_detection["detections"], image, categories_id):
+            annotation["keypoints"] = annotation["keypoints"] or []
+            annotation["segmentation"] = annotation["segmentation"] or []
+            if len(annotation["segmentation"]) == 0 and len(annotation["keypoints"]) == 0:
+                task.warning(f"Annotation of image {file_name} has no segmentation or keypoints")
+                continue
+            annotations.append(annotation)
+        annotations_by_image.setdefault(image_model.id, (image_model, []))[1].extend(annotations)
+
+    if not annotations_by_image:
+        return 0, 0
+
+    existing = {}
+    for annotation in AnnotationModel.objects(image_id__in=list(annotations_by_image)) \
+            .only("id", "image_id", "category_id", "segmentation", "keypoints").as_pymongo():
+        existing[_annotation_key(annotation)] = annotation["_id"]
+
+    restored = {True: [], False: []}
+    new_annotations = []
+    for image_model, annotations in annotations_by_image.values():
+        for annotation in annotations:
+            annotation_id = existing.get(_annotation_key(annotation))
+            if annotation_id is None:
+                new_annotations.append((image_model, annotation))
+            else:
+                restored[bool(annotation["isbbox"])].append(annotation_id)
+
+    for isbbox, annotation_ids in restored.items():
+        if annotation_ids:
+            AnnotationModel.objects(id__in=annotation_ids)\
+                .update(set__deleted=False, set__isbbox=isbbox, inc__version=1)
+
+    if new_annotations:
+        metadata = dataset.default_annotation_metadata or {}
+        models = []
+        for annotation_id, (image_model, annotation) in zip(reserve_ids(AnnotationModel, len(new_annotations)),
+                                                             new_annotations):
+            # image is already known, so do not let the constructor look it up again
+            annotation_model = AnnotationModel(
+                id=annotation_id,
+                category_id=annotation["category_id"],
+                color=im.Color.random().hex,
+                metadata=metadata.copy(),
+                isbbox=annotation["isbbox"],
+                keypoints=annotation["keypoints"],
+                creator='system'
+            )
+            annotation_model.image_id = image_model.id
+            annotation_model.width = image_model.width
+            annotation_model.height = image_model.height
+            annotation_model.dataset_id = dataset.id
+            if len(annotation["segmentation"]) > 0:
+                annotation_model.segmentation = annotation["segmentation"]
+                annotation_model.area = annotation["area"]
+                annotation_model.bbox = annotation["bbox"]
+            models.append(annotation_model)
+        AnnotationModel.objects.insert(models, load_bulk=False)
+
+    counts = {result["_id"]: result["count"] for result in AnnotationModel._get_collection().aggregate([
+        {"$match": {"image_id": {"$in": list(annotations_by_image)}, "area": {"$gt": 0}, "deleted": False}},
+        {"$group": {"_id": "$image_id", "count": {"$sum": 1}}}
+    ])}
+    updates = []
+    for image_id, (image_model, annotations) in annotations_by_image.items():
+        category_ids = set(image_model.category_ids)
+        category_ids.update(annotation["category_id"] for annotation in annotations)
+        updates.append(UpdateOne({"_id": image_id}, {"$set": {
+            "annotated": True,
+            "category_ids": list(category_ids),
+            "num_annotations": counts.get(image_id, 0)
+        }}))
+    ImageModel._get_collection().bulk_write(updates, ordered=False)
+    ImageModel.queue_thumbnails(annotations_by_image)
+
+    task.info(f"Imported {len(new_annotations)} new annotations to {len(annotations_by_image)} images")
+    return len(annotations_by_image), len(new_annotations)
+
+
+def _annotation_key(annotation):
+    return (annotation["image_id"], annotation["category_id"], _freeze(annotation.get("segmentation", [])),
+            _freeze(annotation.get("keypoints", [])))
+
+
+def _freeze(value):
+    # Hashable version of value, numbers compared as floats like MongoDB does
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
 __all__ = ["export_annotations", "import_annotations", "convert_dataset", "export_annotations_to_tf_record",
            "load_annotation_files"]
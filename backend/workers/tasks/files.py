@@ -0,0 +1,100 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from celery import shared_task
+from database import (
+    ImageModel,
+    DatasetModel
+)
+from pymongo import UpdateOne
+
+from .scan import insert_images, PROBE_WORKERS
+
+PREFIX = "[File Watcher]"
+
+CREATED = "created"
+MOVED = "moved"
+DELETED = "deleted"
+
+
+@shared_task
+def process_file_events(events):
+    """
+    Applies coalesced file watcher events to the database with a fixed number of queries per batch
+
+    :param events: list of [event type, path, source path] with at most one event per path, event type is one of
+                   `CREATED`, `MOVED` (from source path) or `DELETED`
+    """
+    deleted = [path for event_type, path, _ in events if event_type == DELETED]
+    moved = {path: source for event_type, path, source in events if event_type == MOVED}
+    created = [path for event_type, path, _ in events if event_type == CREATED]
+
+    if deleted:
+        _log(f"Deleting {len(deleted)} image(s) from database")
+        ImageModel.objects(path__in=deleted).delete()
+
+    if moved:
+        images = dict(ImageModel.objects(path__in=list(moved.values())).scalar('path', 'id'))
+        # images moved from outside of database are new ones
+        created.extend(path for path, source in moved.items() if source not in images)
+        moved = {path: source for path, source in moved.items() if source in images}
+
+    if moved:
+        _log(f"Moving {len(moved)} image(s)")
+        sources = set(moved.values())
+        # files at destinations which are not moved away themselves were replaced
+        ImageModel.objects(path__in=[path for path in moved if path not in sources]).delete()
+        # paths are unique, so images are first moved out of the way in case they swap places
+        collection = ImageModel._get_collection()
+        collection.bulk_write([
+            UpdateOne({"_id": images[source]}, {"$set": {"path": f"{path}\0{images[source]}"}})
+            for path, source in moved.items()
+        ], ordered=False)
+        collection.bulk_write([
+            UpdateOne({"_id": images[source]}, {"$set": {"path": path, "file_name": os.path.basename(path)}})
+            for path, source in moved.items()
+        ], ordered=False)
+
+    if created:
+        existing = set(ImageModel.objects(path__in=created).scalar('path'))
+        created = [path for path in created if path not in existing]
+        if created:
+            _create_images(created)
+
+
+def _create_images(paths):
+    dataset_names = {path: _dataset_name(path) for path in paths}
+    datasets = dict(DatasetModel.objects(name__in=list(set(dataset_names.values()))).scalar('name', 'id'))
+
+    def probe(path):
+        dataset_id = datasets.get(dataset_names[path])
+        if dataset_id is None:
+            _log(f"No dataset found for {path}")
+            return None
+        try:
+            return ImageModel.create_from_path(path, dataset_id)
+        except Exception as e:
+            _log(f"Could not read {path}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+        images = [image for image in executor.map(probe, paths) if image is not None]
+
+    _log(f"Adding {len(images)} new file(s) to database")
+    insert_images(images)
+
+
+def _dataset_name(path):
+    # datasets are stored in /datasets/<dataset name>/, see `ImageModel.create_from_path`
+    folders = path.split('/')
+    try:
+        return folders[folders.index("datasets") + 1]
+    except (ValueError, IndexError):
+        return None
+
+
+def _log(message):
+    print(f'{PREFIX} {message}', flush=True)
+
+
+__all__ = ["process_file_events"]
@@ -0,0 +1,49 @@
+from celery import shared_task
+from database import AnnotationModel, PaperObjectModel
+from pymongo import UpdateOne
+
+PREFIX = "[Paper objects]"
+BATCH_SIZE = 1000
+
+
+@shared_task
+def move_paper_objects():
+    """
+    Moves paper objects stored inline in annotations, as before they had their own collection, into
+    PaperObjectModel. Paper objects saved by the annotator in the meantime are kept.
+    """
+    annotations = AnnotationModel._get_collection()
+    paper_objects = PaperObjectModel._get_collection()
+
+    moved = 0
+    while True:
+        batch = list(annotations.find({'paper_object': {'$exists': True}}, {'paper_object': 1}).limit(BATCH_SIZE))
+        if not batch:
+            break
+
+        updates = [
+            UpdateOne(
+                {'_id': annotation['_id']},
+                {'$setOnInsert': {'data': PaperObjectModel.compress(annotation['paper_object'])}},
+                upsert=True
+            )
+            for annotation in batch if annotation['paper_object']
+        ]
+        if updates:
+            paper_objects.bulk_write(updates, ordered=False)
+
+        annotations.update_many(
+            {'_id': {'$in': [annotation['_id'] for annotation in batch]}},
+            {'$unset': {'paper_object': ''}}
+        )
+        moved += len(updates)
+
+    if moved:
+        _log(f"Moved {moved} paper object(s) out of annotations")
+
+
+def _log(message):
+    print(f'{PREFIX} {message}', flush=True)
+
+
+__all__ = ["move_paper_objects"]
@@ -1,61 +1,316 @@
+import datetime
+import json
 import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from celery import shared_task
 from database import (
+    reserve_ids,
     ImageModel,
     TaskModel,
     DatasetModel
 )
+from mongoengine import NotUniqueError
+from pymongo import UpdateOne
 
+from ..lib.file_digest import file_digest
 from ..socket import create_socket
 
+# Number of new images probed and inserted at once
+SCAN_BATCH_SIZE = 1000
+# Threads reading image headers, scans are bound by file system latency rather than CPU
+PROBE_WORKERS = 16
+
+# Manifest of scanned directories, relative to dataset directory
+MANIFEST_PATH = os.path.join(".scan", "manifest.json")
+MANIFEST_VERSION = 2
+# Directories modified this close to the scan may change again within the same mtime tick, so they are not trusted
+MTIME_SAFETY_MARGIN = 2
+
 
 @shared_task
-def scan_dataset(task_id, dataset_id):
+def scan_dataset(task_id, dataset_id, full=False):
+    """
+    Scans dataset directory for new and removed images. Directories whose mtime did not change since the last
+    scan are not listed again, so rescanning an unchanged dataset costs one stat per directory. Content digests
+    of images in listed directories are recomputed if their size or mtime changed.
 
+    :param full: list every directory, ignoring manifest of the last scan
+    """
     task = TaskModel.objects.get(id=task_id)
     dataset = DatasetModel.objects.get(id=dataset_id)
 
     task.update(status="PROGRESS")
     socket = create_socket()
-    
+
     directory = dataset.directory
     toplevel = list(os.listdir(directory))
     task.info(f"Scanning {directory}")
 
+    manifest_path = os.path.join(directory, MANIFEST_PATH)
+    manifest = {} if full else load_manifest(manifest_path)
+    if not manifest:
+        task.info("No manifest of previous scan, listing every directory")
+    new_manifest = {}
+    started = time.time()
+
+    known_paths = set()
+    # (id, digest, size, mtime) of images which are not deleted, by path
+    digests = {}
+    # file names of images which are not deleted, by directory
+    present_by_directory = defaultdict(set)
+    # number of all images, including deleted ones, by directory
+    count_by_directory = defaultdict(int)
+    db_images = ImageModel.objects(dataset_id=dataset.id) \
+        .scalar('id', 'path', 'deleted', 'sha256', 'file_size', 'file_mtime')
+    for image_id, path, deleted, sha256, file_size, file_mtime in db_images:
+        known_paths.add(path)
+        image_directory, file_name = os.path.split(path)
+        count_by_directory[image_directory] += 1
+        if not deleted:
+            present_by_directory[image_directory].add(file_name)
+            digests[path] = (image_id, sha256, file_size, file_mtime)
+    task.info(f"{len(known_paths)} image(s) already in dataset")
+
     count = 0
-    for root, dirs, files in os.walk(directory):
+    skipped = 0
+    rehashed = 0
+    new_paths = []
+    known_images = []
+    removed_paths = []
+    visited = set()
+    with ThreadPoolExecutor(max_workers=PROBE_WORKERS) as executor:
+        stack = [directory.rstrip('/')]
+        while stack:
+            root = stack.pop()
+            visited.add(root)
 
-        try:
-            youarehere = toplevel.index(root.split('/')[-1])
-            progress = int(((youarehere)/len(toplevel))*100)
-            task.set_progress(progress, socket=socket)
-        except:
-            pass
+            name = os.path.basename(root)
+            if os.path.dirname(root) == directory.rstrip('/') and name in toplevel:
+                progress = int(((toplevel.index(name))/len(toplevel))*100)
+                task.set_progress(progress, socket=socket)
 
-        if root.split('/')[-1].startswith('.'):
-            continue
-        
-        for file in files:
-            path = os.path.join(root, file)
-
-            if path.endswith(ImageModel.PATTERN):
-                db_image = ImageModel.objects(path=path).first()
-
-                if db_image is not None:
-                    if db_image.get_dataset_id() != dataset_id:
-                        db_image.delete()
-                    else:
-                        continue
-                try:
-                    ImageModel.create_from_path(path, dataset.id).save()
-                    count += 1
-                    task.info(f"New file found: {path}")
-                except:
-                    task.warning(f"Could not read {path}")
+            try:
+                stat = os.stat(root)
+            except OSError as e:
+                task.warning(f"Could not read {root}: {e}")
+                continue
+
+            relative = os.path.relpath(root, directory)
+            entry = manifest.get(relative)
+            if entry is not None and entry["mtime"] == stat.st_mtime_ns and entry["nlink"] == stat.st_nlink \
+                    and count_by_directory[root] >= entry["images"]:
+                new_manifest[relative] = entry
+                stack.extend(os.path.join(root, subdirectory) for subdirectory in entry["dirs"])
+                skipped += 1
+                continue
+
+            try:
+                files, subdirectories = list_directory(root)
+            except OSError as e:
+                task.warning(f"Could not read {root}: {e}")
+                continue
+            stack.extend(os.path.join(root, subdirectory) for subdirectory in subdirectories)
+
+            images = [file for file in files if file.endswith(ImageModel.PATTERN)]
+
+            for file in images:
+                path = os.path.join(root, file)
+                if path in known_paths:
+                    if path in digests:
+                        known_images.append((path, *digests[path]))
+                        if len(known_images) >= SCAN_BATCH_SIZE:
+                            rehashed += update_digests(task, known_images, executor)
+                            known_images = []
+                    continue
+                new_paths.append(path)
+
+                if len(new_paths) >= SCAN_BATCH_SIZE:
+                    count += create_images(task, dataset, new_paths, executor)
+                    new_paths = []
 
+            removed = present_by_directory[root].difference(images)
+            removed_paths.extend(os.path.join(root, file) for file in removed)
+
+            new_manifest[relative] = {
+                # directory may still be changing, make next scan list it again
+                "mtime": stat.st_mtime_ns if stat.st_mtime < started - MTIME_SAFETY_MARGIN else None,
+                "nlink": stat.st_nlink,
+                "entries": len(files) + len(subdirectories),
+                "images": len(images),
+                "dirs": subdirectories
+            }
+
+        if new_paths:
+            count += create_images(task, dataset, new_paths, executor)
+        if known_images:
+            rehashed += update_digests(task, known_images, executor)
+
+    # Images in directories which no longer exist
+    for image_directory, file_names in present_by_directory.items():
+        if image_directory not in visited:
+            removed_paths.extend(os.path.join(image_directory, file) for file in file_names)
+
+    removed_count = delete_images(dataset, removed_paths)
+    save_manifest(manifest_path, new_manifest)
+
+    task.info(f"Skipped {skipped} unchanged of {len(visited)} directories")
     task.info(f"Created {count} new image(s)")
+    task.info(f"Updated digests of {rehashed} image(s)")
+    task.info(f"Marked {removed_count} removed image(s) as deleted")
     task.set_progress(100, socket=socket)
 
 
-__all__ = ["scan_dataset"]
\ No newline at end of file
+def list_directory(directory):
+    """
+    :return: (names of files, names of subdirectories), symbolic links to directories are not followed like in
+             `os.walk` and hidden directories, e.g. thumbnails and tile pyramids, are left out with all their content
+    """
+    files, subdirectories = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            try:
+                is_directory = entry.is_dir()
+            except OSError:
+                is_directory = False
+            if not is_directory:
+                files.append(entry.name)
+            elif not entry.is_symlink() and not entry.name.startswith('.'):
+                subdirectories.append(entry.name)
+    return files, subdirectories
+
+
+def load_manifest(path):
+    try:
+        with open(path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION:
+        return {}
+    return manifest.get("directories", {})
+
+
+def save_manifest(path, directories):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary_path = f"{path}.{os.getpid()}"
+    with open(temporary_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "directories": directories}, f)
+    os.replace(temporary_path, path)
+
+
+def create_images(task, dataset, paths, executor):
+    """
+    Creates images of dataset from paths which are not in the dataset yet. Images under these paths which belong
+    to other datasets are deleted first.
+
+    :param executor: executor reading image dimensions
+    :return: number of created images
+    """
+    for db_image in ImageModel.objects(path__in=paths, dataset_id__ne=dataset.id):
+        db_image.delete()
+
+    def probe(path):
+        try:
+            return ImageModel.create_from_path(path, dataset.id)
+        except Exception:
+            return None
+
+    images = []
+    for path, image in zip(paths, executor.map(probe, paths)):
+        if image is None:
+            task.warning(f"Could not read {path}")
+            continue
+        task.info(f"New file found: {path}")
+        images.append(image)
+
+    return insert_images(images)
+
+
+def update_digests(task, images, executor):
+    """
+    Recomputes content digests of known images whose files changed since their digest was computed, or which
+    have no digest yet. Files are checked and hashed by the executor.
+
+    Only images of directories listed by the scan are passed. Rewriting a file in place does not change the mtime
+    of its directory, so its digest stays outdated until the directory is listed again or a full scan runs.
+
+    :param images: list of (path, id, digest, size, mtime)
+    :return: number of updated digests
+    """
+    def rehash(image):
+        path, _, sha256, file_size, file_mtime = image
+        try:
+            stat = os.stat(path)
+            if sha256 is not None and stat.st_size == file_size and stat.st_mtime == file_mtime:
+                return None
+            return stat.st_size, stat.st_mtime, file_digest(path)
+        except OSError as e:
+            task.warning(f"Could not read {path}: {e}")
+            return None
+
+    updates = []
+    for image, result in zip(images, executor.map(rehash, images)):
+        if result is None:
+            continue
+        file_size, file_mtime, sha256 = result
+        updates.append(UpdateOne({"_id": image[1]},
+                                 {"$set": {"file_size": file_size, "file_mtime": file_mtime, "sha256": sha256}}))
+    if updates:
+        ImageModel._get_collection().bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def insert_images(images):
+    """
+    Inserts new images with a single query, falling back to saving them one by one if some of the paths were
+    taken in the meantime (e.g. by file watcher or concurrent scan). Thumbnails of inserted images are queued.
+
+    :return: number of inserted images
+    """
+    if not images:
+        return 0
+
+    for image, image_id in zip(images, reserve_ids(ImageModel, len(images))):
+        image.id = image_id
+    try:
+        ImageModel.objects.insert(images, load_bulk=False)
+    except NotUniqueError:
+        existing = dict(ImageModel.objects(path__in=[image.path for image in images]).scalar('path', 'id'))
+        created = []
+        for image in images:
+            if image.path in existing:
+                # inserted before the conflict
+                if existing[image.path] == image.id:
+                    created.append(image.id)
+                continue
+            image.id = None
+            try:
+                image.save()
+                created.append(image.id)
+            except NotUniqueError:
+                pass
+        ImageModel.queue_thumbnails(created)
+        return len(created)
+
+    ImageModel.queue_thumbnails(image.id for image in images)
+    return len(images)
+
+
+def delete_images(dataset, paths):
+    """
+    Marks images of dataset whose files were removed as deleted
+
+    :return: number of deleted images
+    """
+    deleted = 0
+    now = datetime.datetime.now()
+    for i in range(0, len(paths), SCAN_BATCH_SIZE):
+        deleted += ImageModel.objects(dataset_id=dataset.id, path__in=paths[i:i + SCAN_BATCH_SIZE], deleted=False) \
+            .update(set__deleted=True, set__deleted_date=now)
+    return deleted
+
+
+__all__ = ["scan_dataset"]
@@ -0,0 +1,61 @@
+import os
+
+from celery import shared_task
+from database import ImageModel
+
+from ..lib.image_pyramid import generate_pyramid, load_descriptor
+
+PREFIX = "[Thumbnails]"
+
+
+@shared_task
+def generate_thumbnails(image_ids):
+    """
+    Generates thumbnails of images queued by `ImageModel.queue_thumbnails`. Images modified while their thumbnail
+    is generated are queued again.
+    """
+    # picked up, changes from now on need another run
+    ImageModel.objects(id__in=image_ids).update(unset__thumbnail_queued=True, set__regenerate_thumbnail=False)
+
+    failed = []
+    for image in ImageModel.objects(id__in=image_ids, deleted=False):
+        try:
+            image.render_thumbnail()
+        except Exception as e:
+            _log(f"Could not generate thumbnail of image {image.id}: {e}")
+            failed.append(image.id)
+
+    if failed:
+        ImageModel.objects(id__in=failed).update(set__regenerate_thumbnail=True)
+
+    _log(f"Generated {len(image_ids) - len(failed)} thumbnail(s)")
+
+
+@shared_task
+def generate_image_pyramid(image_id):
+    """
+    Generates tiled pyramid of image queued by `ImageModel.queue_pyramid`, unless it is up to date
+    """
+    image = ImageModel.objects(id=image_id, deleted=False).first()
+    if image is None:
+        return
+
+    directory = image.pyramid_directory()
+    try:
+        if load_descriptor(directory, mtime=os.stat(image.path).st_mtime) is None:
+            descriptor = generate_pyramid(image.path, directory)
+            _log(f"Generated {descriptor['max_level'] + 1} level pyramid of image {image.id}")
+    except Exception as e:
+        _log(f"Could not generate pyramid of image {image.id}: {e}")
+    finally:
+        try:
+            os.remove(directory.rstrip('/') + '.queued')
+        except FileNotFoundError:
+            pass
+
+
+def _log(message):
+    print(f'{PREFIX} {message}', flush=True)
+
+
+__all__ = ["generate_thumbnails", "generate_image_pyramid"]
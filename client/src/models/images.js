@@ -0,0 +1,23 @@
+import axios from "axios";
+
+const baseURL = "/api/image";
+
+export default {
+  sprite(params) {
+    return axios.get(`${baseURL}/sprite`, {
+      params: {
+        ...params
+      }
+    });
+  },
+  pyramid(id) {
+    return axios.get(`${baseURL}/${id}/pyramid`);
+  },
+  tiles(id, params) {
+    return axios.get(`${baseURL}/${id}/tiles`, {
+      params: {
+        ...params
+      }
+    });
+  }
+};